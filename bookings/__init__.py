@@ -0,0 +1 @@
+default_app_config = 'bookings.apps.BookingsConfig'
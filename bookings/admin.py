@@ -1,8 +1,22 @@
+from urllib.parse import urlencode
+
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.shortcuts import redirect, render
+from django.urls import reverse
 from .models import (
     Service, Appointment, Rating, 
-    ProductCategory, Product, Cart, CartItem, Order, OrderItem
+    ProductCategory, Product, Cart, CartItem, Order, OrderItem, Job,
+    DailySales, DailyProductSales, ProductRecommendations, StockMovement, StockSnapshot,
+    ArchivedOrder, ArchivedOrderItem, BlockAdjacency, SchedulerMark
 )
+from . import events, inventory, rollups
+from .db import scale, update
+from .forms import PriceChangeForm
+from .middleware import clear_page_cache
+
+# The bulk actions below each run as one update() over the selection
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
@@ -14,6 +28,24 @@ class AppointmentAdmin(admin.ModelAdmin):
     list_display = ['user', 'service', 'appointment_date', 'appointment_time', 'status']
     list_filter = ['status', 'appointment_date']
     search_fields = ['user__username', 'service__name']
+    actions = ['mark_confirmed', 'mark_completed']
+    
+    def set_status(self, queryset, status):
+        # update() skips post_save, so the live status events are sent here
+        appointments = list(queryset.values_list('pk', 'user_id'))
+        updated = update(queryset, status=status)
+        events.appointments_changed(appointments, status)
+        return updated
+    
+    def mark_confirmed(self, request, queryset):
+        updated = self.set_status(queryset, 'confirmed')
+        self.message_user(request, f'Confirmed {updated} appointments.')
+    mark_confirmed.short_description = 'Mark selected appointments as confirmed'
+    
+    def mark_completed(self, request, queryset):
+        updated = self.set_status(queryset, 'completed')
+        self.message_user(request, f'Marked {updated} appointments as completed.')
+    mark_completed.short_description = 'Mark selected appointments as completed'
 
 @admin.register(Rating)
 class RatingAdmin(admin.ModelAdmin):
@@ -28,15 +60,62 @@ class ProductCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'car_make', 'price', 'stock_quantity', 'is_available']
+    list_display = ['name', 'category', 'car_make', 'price', 'stock_level', 'is_available']
     list_filter = ['category', 'car_make', 'is_available']
     search_fields = ['name', 'description']
-    list_editable = ['price', 'stock_quantity', 'is_available']
+    list_editable = ['price', 'is_available']
+    # Stock changes are recorded as stock movements
+    exclude = ['stock_quantity']
+    actions = ['make_available', 'make_unavailable', 'change_price']
+    
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        inventory.attach_stock_levels(changelist.result_list)
+        return changelist
+    
+    def stock_level(self, obj):
+        return obj.stock_level
+    
+    def make_available(self, request, queryset):
+        updated = update(queryset, is_available=True)
+        clear_page_cache()
+        self.message_user(request, f'{updated} products are now available.')
+    make_available.short_description = 'Make selected products available'
+    
+    def make_unavailable(self, request, queryset):
+        updated = update(queryset, is_available=False)
+        clear_page_cache()
+        self.message_user(request, f'{updated} products are now unavailable.')
+    make_unavailable.short_description = 'Make selected products unavailable'
+    
+    def change_price(self, request, queryset):
+        form = PriceChangeForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            percent = form.cleaned_data['percent']
+            updated = scale(queryset, 'price', 1 + percent / 100)
+            clear_page_cache()
+            self.message_user(request, f'Changed the price of {updated} products by {percent}%.')
+            return None
+        
+        # Ask for the percentage, then post the same selection back to this
+        # action. With "select all" the selection stays the current page's ids
+        # plus select_across, so the form doesn't list every product.
+        return render(request, 'admin/bookings/product/change_price.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Change prices',
+            'opts': self.model._meta,
+            'form': form,
+            'count': queryset.count(),
+            'select_across': request.POST.get('select_across') == '1',
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+    change_price.short_description = 'Change price of selected products by a percentage'
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['session_id', 'created_at', 'get_item_count']
-    readonly_fields = ['session_id', 'created_at', 'updated_at']
+    list_display = ['session_id', 'created_at', 'item_count', 'total']
+    readonly_fields = ['session_id', 'item_count', 'total', 'created_at', 'updated_at']
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
@@ -48,7 +127,129 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'area', 'payment_method', 'created_at']
     search_fields = ['order_number', 'customer_name', 'customer_phone']
     readonly_fields = ['order_number', 'created_at', 'updated_at']
+    actions = ['mark_confirmed', 'mark_out_for_delivery', 'mark_delivered']
+    
+    def set_status(self, queryset, status):
+        # update() skips post_save, so the live status events are sent here
+        order_numbers = list(queryset.values_list('order_number', flat=True))
+        updated = rollups.set_status(queryset, status)
+        events.orders_changed(order_numbers, status)
+        # Cached order pages show the old status
+        clear_page_cache()
+        return updated
+    
+    def mark_confirmed(self, request, queryset):
+        updated = self.set_status(queryset, 'confirmed')
+        self.message_user(request, f'Confirmed {updated} orders.')
+    mark_confirmed.short_description = 'Mark selected orders as confirmed'
+    
+    def mark_out_for_delivery(self, request, queryset):
+        updated = self.set_status(queryset, 'out_for_delivery')
+        self.message_user(request, f'Marked {updated} orders as out for delivery.')
+    mark_out_for_delivery.short_description = 'Mark selected orders as out for delivery'
+    
+    def mark_delivered(self, request, queryset):
+        updated = self.set_status(queryset, 'delivered')
+        self.message_user(request, f'Marked {updated} orders as delivered.')
+    mark_delivered.short_description = 'Mark selected orders as delivered'
+    
+    # Orders moved by `manage.py archive_orders` open from the archive instead
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        query = request.GET.get(SEARCH_VAR, '').strip()
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if query and changelist and changelist.result_count == 0:
+            if ArchivedOrder.objects.filter(order_number=query).exists():
+                url = reverse('admin:bookings_archivedorder_changelist')
+                return redirect(f'{url}?{urlencode({SEARCH_VAR: query})}')
+        return response
+    
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        if (object_id.isdigit() and self.get_object(request, object_id) is None
+                and ArchivedOrder.objects.filter(pk=object_id).exists()):
+            return redirect('admin:bookings_archivedorder_change', object_id)
+        return super().change_view(request, object_id, form_url, extra_context)
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ['product_name', 'quantity', 'price']
+    extra = 0
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_number', 'customer_name', 'customer_phone', 'area', 'status', 'total_amount', 'created_at', 'archived_at']
+    list_filter = ['status', 'area', 'payment_method']
+    search_fields = ['order_number', 'customer_name', 'customer_phone']
+    inlines = [ArchivedOrderItemInline]
+    
+    # Read-only, the archive is only written by `manage.py archive_orders`
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ['order', 'product_name', 'quantity', 'price', 'get_subtotal']
\ No newline at end of file
+    list_display = ['order', 'product_name', 'quantity', 'price', 'get_subtotal']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_at', 'locked_by', 'created_at']
+    list_filter = ['status', 'name']
+    search_fields = ['idempotency_key']
+    readonly_fields = ['created_at', 'updated_at']
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = ['date', 'area', 'payment_method', 'order_count', 'revenue']
+    list_filter = ['area', 'payment_method']
+    date_hierarchy = 'date'
+
+@admin.register(DailyProductSales)
+class DailyProductSalesAdmin(admin.ModelAdmin):
+    list_display = ['date', 'product_name', 'quantity', 'revenue']
+    search_fields = ['product_name']
+    date_hierarchy = 'date'
+
+@admin.register(ProductRecommendations)
+class ProductRecommendationsAdmin(admin.ModelAdmin):
+    list_display = ['product', 'updated_at']
+    readonly_fields = ['product', 'neighbours', 'updated_at']
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['product', 'kind', 'quantity', 'reference', 'expires_at', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['product__name', 'reference']
+    fields = ['product', 'kind', 'quantity', 'reference', 'note']
+    # Sales and reservations come from checkout (bookings/inventory.py), which
+    # sets the expiry and keys they need; staff only restock and adjust
+    ADMIN_KINDS = ['restock', 'adjustment']
+    
+    def formfield_for_choice_field(self, db_field, request, **kwargs):
+        if db_field.name == 'kind':
+            kwargs['choices'] = [choice for choice in db_field.choices if choice[0] in self.ADMIN_KINDS]
+        return super().formfield_for_choice_field(db_field, request, **kwargs)
+    
+    # The ledger is append-only, corrections are new adjustments
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['product', 'quantity', 'last_movement_id', 'taken_at']
+    readonly_fields = ['product', 'quantity', 'last_movement_id', 'taken_at']
+
+@admin.register(BlockAdjacency)
+class BlockAdjacencyAdmin(admin.ModelAdmin):
+    list_display = ['block', 'adjacent_block']
+    search_fields = ['block', 'adjacent_block']
+
+@admin.register(SchedulerMark)
+class SchedulerMarkAdmin(admin.ModelAdmin):
+    list_display = ['name', 'position', 'updated_at']
+    readonly_fields = ['name', 'position', 'updated_at']
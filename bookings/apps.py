@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class BookingsConfig(AppConfig):
     name = 'bookings'
+
+    def ready(self):
+        # Register the background job handlers, the sales rollup signals and
+        # the live status events
+        from . import events, rollups, tasks  # noqa: F401
@@ -0,0 +1,75 @@
+"""Cold storage for finished orders.
+
+`manage.py archive_orders` moves delivered and cancelled orders, with their
+items, from Order/OrderItem into ArchivedOrder/ArchivedOrderItem, keeping
+their ids. The live collections and their indexes then only hold recent
+and open orders. Lookups by order number fall back to the archive.
+Archived orders still count in the sales rollups.
+"""
+from django.http import Http404
+
+from . import rollups
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ARCHIVE_STATUSES = ['delivered', 'cancelled']
+
+
+def _plain(value):
+    # Decimal128 from Djongo can't be saved back into a DecimalField as is
+    return value.to_decimal() if hasattr(value, 'to_decimal') else value
+
+
+def _copy(instance, model):
+    """An unsaved `model` row with the same field values as `instance`"""
+    return model(**{
+        field.attname: _plain(getattr(instance, field.attname))
+        for field in model._meta.concrete_fields
+        if hasattr(instance, field.attname)
+    })
+
+
+def archivable(cutoff):
+    """Finished orders last changed before `cutoff`"""
+    return Order.objects.filter(status__in=ARCHIVE_STATUSES, updated_at__lt=cutoff)
+
+
+def archive_batch(orders):
+    """Copy orders and their items to the archive, then delete them.
+
+    Rows already in the archive are skipped, so a batch interrupted between
+    the copy and the delete is finished by the next run.
+    """
+    orders = list(orders)
+    order_ids = [order.pk for order in orders]
+    items = list(OrderItem.objects.filter(order_id__in=order_ids))
+
+    archived = set(ArchivedOrder.objects.filter(id__in=order_ids).values_list('id', flat=True))
+    ArchivedOrder.objects.bulk_create([
+        _copy(order, ArchivedOrder) for order in orders if order.pk not in archived
+    ])
+    archived = set(ArchivedOrderItem.objects.filter(
+        id__in=[item.pk for item in items]
+    ).values_list('id', flat=True))
+    ArchivedOrderItem.objects.bulk_create([
+        _copy(item, ArchivedOrderItem) for item in items if item.pk not in archived
+    ])
+
+    with rollups.untracked():
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(pk__in=order_ids).delete()
+    return len(orders), len(items)
+
+
+def find_order(order_number):
+    """The live order, or the archived one, or None"""
+    return (
+        Order.objects.filter(order_number=order_number).first()
+        or ArchivedOrder.objects.filter(order_number=order_number).first()
+    )
+
+
+def get_order_or_404(order_number):
+    order = find_order(order_number)
+    if order is None:
+        raise Http404('No order found')
+    return order
@@ -0,0 +1,84 @@
+"""Async shop and cart views, used when the site is served over ASGI.
+
+Djongo is synchronous, so each view's database work is pushed onto a small
+bounded thread pool in a single call instead of holding a worker thread for
+the whole request.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import redirect
+from django.contrib import messages
+
+from . import views
+
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+
+def get_db_executor():
+    """The bounded database pool, started on first use so WSGI never has one"""
+    global _db_executor
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_DB_THREADS,
+                    thread_name_prefix='bookings-db',
+                )
+    return _db_executor
+
+
+def run_in_db_thread(func):
+    """Wrap a sync callable so it runs on the bounded database pool"""
+    return sync_to_async(func, thread_sensitive=False, executor=get_db_executor())
+
+
+async def shop(request):
+    """Display all products"""
+    # One trip to the pool for the queries and the render, which touches
+    # request.user and the session (both lazy DB lookups); every trip costs
+    # a thread handoff
+    return await run_in_db_thread(views.shop)(request)
+
+
+async def catalog(request):
+    """Product catalog as JSON"""
+    products = await run_in_db_thread(views.catalog_data)(
+        request.GET.get('category', ''), request.GET.get('car_make', '')
+    )
+    return JsonResponse({'products': products})
+
+
+async def view_cart(request):
+    """View shopping cart"""
+    return await run_in_db_thread(views.view_cart)(request)
+
+
+# require_POST wraps views in a sync function, so the method check is inline
+async def add_to_cart(request, product_id):
+    """Add a product to cart"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    quantity = views.posted_quantity(request)
+    if quantity is None:
+        return views.invalid_quantity_response()
+    data = await run_in_db_thread(views.add_product_to_cart)(request, product_id, quantity)
+    return JsonResponse(data)
+
+
+async def update_cart(request, product_id):
+    """Update cart item quantity"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    message = await run_in_db_thread(views.apply_cart_action)(
+        request, product_id, request.POST.get('action')
+    )
+    if message:
+        messages.success(request, message)
+    return redirect('view_cart')
@@ -0,0 +1,42 @@
+"""Static CSS/JS bundles extracted from templates by `manage.py build_bundles`"""
+import hashlib
+import json
+from pathlib import Path
+
+STATIC_DIR = Path(__file__).resolve().parent / 'static'
+BUNDLES_DIR = STATIC_DIR / 'bundles'
+BUNDLES_MANIFEST = BUNDLES_DIR / 'bundles.json'
+
+_manifest_cache = {'mtime': None, 'data': {}}
+
+
+def content_digest(source):
+    return hashlib.md5(source.encode('utf-8')).hexdigest()[:12]
+
+
+def bundle_path(name):
+    """Static path of a bundle, e.g. 'bundles/shop.css'"""
+    return f'{BUNDLES_DIR.relative_to(STATIC_DIR).as_posix()}/{name}'
+
+
+def load_bundles():
+    """Map of bundle name -> digest of the template source it was built from"""
+    try:
+        mtime = BUNDLES_MANIFEST.stat().st_mtime
+    except OSError:
+        return {}
+    if _manifest_cache['mtime'] != mtime:
+        with open(BUNDLES_MANIFEST) as f:
+            _manifest_cache['data'] = json.load(f)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['data']
+
+
+def write_bundles(sources):
+    """Write each bundle file plus the manifest, sources is {name: source}"""
+    BUNDLES_DIR.mkdir(parents=True, exist_ok=True)
+    for name, source in sources.items():
+        (BUNDLES_DIR / name).write_text(source, encoding='utf-8')
+    with open(BUNDLES_MANIFEST, 'w') as f:
+        json.dump({name: content_digest(source) for name, source in sources.items()},
+                  f, indent=2, sort_keys=True)
@@ -0,0 +1,130 @@
+"""A Django cache backend on a MongoDB collection.
+
+Every process sees the same entries, with no cache server beyond the
+MongoDB the site already uses. add() is one insert and incr() one $inc, so
+both are atomic across processes. Rate-limit buckets get their own
+incr_window()/decr_window(), so bookings/ratelimit.py counts a token in a
+single findAndModify.
+Integers are stored as they are, so they can be incremented; other values
+are pickled. MongoDB's TTL monitor deletes expired entries within a minute
+or so, and reads skip them until then.
+"""
+import pickle
+from datetime import datetime
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .db import mongo_database
+
+INT64 = range(-2 ** 63, 2 ** 63)
+
+
+class MongoCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.collection_name = location or 'bookings_cache'
+        self._indexed = False
+
+    def collection(self):
+        collection = mongo_database()[self.collection_name]
+        if not self._indexed:
+            collection.create_index('expires', expireAfterSeconds=0)
+            self._indexed = True
+        return collection
+
+    def expiry(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        # pymongo stores naive datetimes as UTC
+        return None if expires is None else datetime.utcfromtimestamp(expires)
+
+    def document(self, value, timeout):
+        if not (type(value) is int and value in INT64):
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return {'value': value, 'expires': self.expiry(timeout)}
+
+    def live(self, key):
+        return {'_id': key, '$or': [{'expires': None}, {'expires': {'$gt': datetime.utcnow()}}]}
+
+    def key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        from pymongo.errors import DuplicateKeyError
+
+        key = self.key(key, version)
+        document = self.document(value, timeout)
+        try:
+            self.collection().insert_one({'_id': key, **document})
+            return True
+        except DuplicateKeyError:
+            # Only an expired entry the TTL monitor hasn't deleted yet gives way
+            result = self.collection().update_one(
+                {'_id': key, 'expires': {'$lte': datetime.utcnow()}}, {'$set': document}
+            )
+            return result.matched_count == 1
+
+    def get(self, key, default=None, version=None):
+        document = self.collection().find_one(self.live(self.key(key, version)))
+        if document is None:
+            return default
+        value = document['value']
+        return pickle.loads(value) if isinstance(value, bytes) else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.collection().update_one(
+            {'_id': self.key(key, version)}, {'$set': self.document(value, timeout)}, upsert=True
+        )
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        result = self.collection().update_one(
+            self.live(self.key(key, version)), {'$set': {'expires': self.expiry(timeout)}}
+        )
+        return result.matched_count == 1
+
+    def incr(self, key, delta=1, version=None):
+        from pymongo import ReturnDocument
+
+        key = self.key(key, version)
+        document = self.collection().find_one_and_update(
+            self.live(key), {'$inc': {'value': delta}}, return_document=ReturnDocument.AFTER
+        )
+        if document is None:
+            raise ValueError("Key '%s' not found" % key)
+        return document['value']
+
+    def incr_window(self, key, index, timeout, version=None):
+        """Count one in period `index`: (count this period, count the period before)
+
+        One document per key holds the last period's count and index; an
+        update pipeline moves it on and counts in the same atomic step.
+        """
+        from pymongo import ReturnDocument
+
+        current = {'$eq': ['$index', index]}
+        document = self.collection().find_one_and_update(
+            {'_id': self.key(key, version)},
+            [{'$set': {
+                # Every expression reads the document as it was before the update
+                'previous': {'$cond': [current, '$previous', {
+                    '$cond': [{'$eq': ['$index', index - 1]}, '$taken', 0],
+                }]},
+                'taken': {'$cond': [current, {'$add': ['$taken', 1]}, 1]},
+                'index': index,
+                'expires': self.expiry(timeout),
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return document['taken'], document['previous']
+
+    def decr_window(self, key, index, version=None):
+        """Take back one counted in period `index`, unless it has moved on"""
+        self.collection().update_one({'_id': self.key(key, version), 'index': index}, {'$inc': {'taken': -1}})
+
+    def delete(self, key, version=None):
+        return self.collection().delete_one({'_id': self.key(key, version)}).deleted_count == 1
+
+    def clear(self):
+        self.collection().delete_many({})
@@ -0,0 +1,7 @@
+from .views import cart_count, session_cart_key
+
+
+def cart_badge(request):
+    """Item count for the nav cart badge; no query without a cart"""
+    cart_key = session_cart_key(request) if hasattr(request, 'session') else None
+    return {'cart_badge_count': cart_count(session_id=cart_key) if cart_key else 0}
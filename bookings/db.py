@@ -0,0 +1,112 @@
+"""Helpers for the things Djongo's SQL translation can't do on its own"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F
+
+
+def price_to_float(value):
+    """Convert a Djongo price (Decimal128, str or Decimal) to float"""
+    if hasattr(value, 'to_decimal'):
+        return float(value.to_decimal())
+    return float(str(value))
+
+
+def mongo_database():
+    """The pymongo Database behind the default Djongo connection"""
+    connection.ensure_connection()
+    return connection.connection
+
+
+def mongo_collection(model):
+    return mongo_database()[model._meta.db_table]
+
+
+# Lookups mongo_filter() can translate
+MONGO_OPERATORS = {'exact': '$eq', 'gt': '$gt', 'gte': '$gte', 'lt': '$lt', 'lte': '$lte'}
+
+
+def mongo_filter(model, lookups):
+    """A MongoDB query for simple lookups such as {'quantity__gt': 1}"""
+    query = {}
+    for lookup, value in lookups.items():
+        name, _, operator = lookup.partition('__')
+        query.setdefault(model._meta.get_field(name).column, {})[MONGO_OPERATORS[operator or 'exact']] = value
+    return query
+
+
+def increment(model, pk, where=None, **deltas):
+    """Atomically add to numeric fields of one row.
+
+    Djongo turns every UPDATE into a $set, so F() expressions are lost; on
+    MongoDB this issues a real $inc instead. With `where` (lookups as for
+    filter(), see mongo_filter()) the row only changes while it matches
+    them. Returns whether it changed.
+    """
+    if connection.vendor == 'djongo':
+        from bson.decimal128 import Decimal128
+
+        inc = {
+            model._meta.get_field(name).column:
+                Decimal128(str(value)) if isinstance(value, Decimal) else value
+            for name, value in deltas.items()
+        }
+        query = {model._meta.pk.column: pk, **mongo_filter(model, where or {})}
+        return mongo_collection(model).update_one(query, {'$inc': inc}).matched_count == 1
+    return bool(model.objects.filter(pk=pk, **(where or {})).update(
+        **{name: F(name) + value for name, value in deltas.items()}
+    ))
+
+
+def delete_returning(model, pk, field):
+    """Delete one row, returning `field` as the delete found it.
+
+    None if the row was gone already. On MongoDB this is one
+    find_one_and_delete, which skips signals and cascades, so use it only
+    for rows nothing else refers to.
+    """
+    if connection.vendor == 'djongo':
+        column = model._meta.get_field(field).column
+        deleted = mongo_collection(model).find_one_and_delete(
+            {model._meta.pk.column: pk}, projection={column: True}
+        )
+        return deleted[column] if deleted else None
+    with transaction.atomic():
+        value = model.objects.select_for_update().filter(pk=pk).values_list(field, flat=True).first()
+        if value is not None:
+            model.objects.filter(pk=pk).delete()
+    return value
+
+
+def update(queryset, **fields):
+    """queryset.update(**fields), also for a queryset without filters.
+
+    Djongo can't translate an UPDATE without a WHERE, which is what the
+    admin's "select all" over an unfiltered list runs, so this adds one that
+    every row matches.
+    """
+    return queryset.filter(pk__isnull=False).update(**fields)
+
+
+def scale(queryset, field, factor):
+    """Multiply a decimal field by `factor` for every row, in one update.
+
+    As with increment(), Djongo can't run F() * factor, so on MongoDB this is
+    a single update_many pipeline that also rounds to the field's places.
+    """
+    model = queryset.model
+    model_field = model._meta.get_field(field)
+    if connection.vendor == 'djongo':
+        from bson.decimal128 import Decimal128
+
+        column = model_field.column
+        pks = list(queryset.values_list('pk', flat=True))
+        result = mongo_collection(model).update_many(
+            {model._meta.pk.column: {'$in': pks}},
+            [{'$set': {column: {'$round': [
+                {'$multiply': [f'${column}', Decimal128(str(factor))]},
+                model_field.decimal_places,
+            ]}}}],
+        )
+        return result.matched_count
+    return queryset.update(**{field: F(field) * Decimal(str(factor))})
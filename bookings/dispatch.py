@@ -0,0 +1,191 @@
+"""Delivery batches for confirmed orders.
+
+Orders are grouped by area, then by neighbouring blocks, into batches of at
+most `capacity` stops, one batch per driver. Within a batch the stops are
+ordered with a nearest-neighbour route improved by 2-opt.
+
+Distances between blocks are hop counts over the BlockAdjacency table.
+Blocks missing from it fall back to the gap between their block numbers,
+which roughly follow geography in Bahrain.
+"""
+import re
+from collections import defaultdict, deque
+
+from .models import BlockAdjacency, Order
+
+DEFAULT_CAPACITY = 15
+
+# Moving within a block, in block hops
+ROAD_COST = 0.2
+HOUSE_COST = 0.01
+
+# Adjacency searches stop here; further blocks use the number fallback
+MAX_HOPS = 8
+
+NUMBER_RE = re.compile(r'\d+')
+
+
+def address_number(value):
+    """Leading number of an address part ('324', 'Block 324A'), or None"""
+    match = NUMBER_RE.search(value or '')
+    return int(match.group()) if match else None
+
+
+class BlockGraph:
+    """Hop distances between blocks, searched on demand and memoised"""
+    def __init__(self, edges):
+        self.neighbours = defaultdict(set)
+        for a, b in edges:
+            self.neighbours[a].add(b)
+            self.neighbours[b].add(a)
+        self._hops = {}
+
+    @classmethod
+    def load(cls):
+        return cls(BlockAdjacency.objects.values_list('block', 'adjacent_block'))
+
+    def hops_from(self, block):
+        if block not in self._hops:
+            hops = {block: 0}
+            queue = deque([block])
+            while queue:
+                current = queue.popleft()
+                if hops[current] == MAX_HOPS:
+                    continue
+                for neighbour in self.neighbours[current]:
+                    if neighbour not in hops:
+                        hops[neighbour] = hops[current] + 1
+                        queue.append(neighbour)
+            self._hops[block] = hops
+        return self._hops[block]
+
+    def distance(self, a, b):
+        if a == b:
+            return 0
+        hops = self.hops_from(a).get(b)
+        if hops is not None:
+            return hops
+        number_a, number_b = address_number(a), address_number(b)
+        if number_a is None or number_b is None:
+            return MAX_HOPS + 1
+        return 1 + abs(number_a - number_b) / 10
+
+
+class Stop:
+    """One order's delivery address, parsed for distance checks"""
+    def __init__(self, order):
+        self.order = order
+        self.area = order.area.strip().title()
+        self.block = order.block_number.strip()
+        self.road = address_number(order.road_number)
+        self.house = address_number(order.house_number)
+
+    def sort_key(self):
+        return (address_number(self.block) or 0, self.block, self.road or 0, self.house or 0)
+
+
+def stop_distance(graph, a, b):
+    if a.block != b.block:
+        return graph.distance(a.block, b.block)
+    if a.road != b.road:
+        return ROAD_COST
+    return 0 if a.house == b.house else HOUSE_COST
+
+
+class Batch:
+    """Stops for one driver, in delivery order"""
+    def __init__(self, area, stops, graph):
+        self.area = area
+        self.stops = route(stops, graph)
+        self.blocks = list(dict.fromkeys(stop.block for stop in self.stops))
+        self.distance = sum(
+            stop_distance(graph, a, b) for a, b in zip(self.stops, self.stops[1:])
+        )
+
+    def __len__(self):
+        return len(self.stops)
+
+
+def route(stops, graph):
+    """Nearest-neighbour route from the lowest block, then 2-opt until no gain"""
+    stops = sorted(stops, key=Stop.sort_key)
+    n = len(stops)
+    if n < 3:
+        return stops
+    dist = [[stop_distance(graph, a, b) for b in stops] for a in stops]
+
+    path = [0]
+    left = set(range(1, n))
+    while left:
+        last = path[-1]
+        nearest = min(left, key=lambda j: (dist[last][j], j))
+        path.append(nearest)
+        left.remove(nearest)
+
+    # Open path: the first stop stays put, the last edge has no return leg
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b, c = path[i - 1], path[i], path[j]
+                d = path[j + 1] if j + 1 < n else None
+                before = dist[a][b] + (dist[c][d] if d is not None else 0)
+                after = dist[a][c] + (dist[b][d] if d is not None else 0)
+                if after < before - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+    return [stops[i] for i in path]
+
+
+def block_order(blocks, graph):
+    """Blocks of one area, each followed by the nearest one not yet visited"""
+    left = sorted(blocks, key=lambda block: (address_number(block) or 0, block))
+    ordered = [left.pop(0)]
+    while left:
+        nearest = min(left, key=lambda block: graph.distance(ordered[-1], block))
+        left.remove(nearest)
+        ordered.append(nearest)
+    return ordered
+
+
+def make_batches(stops, graph, capacity=DEFAULT_CAPACITY):
+    """Fill batches area by area, keeping a block's stops together when they fit"""
+    by_area = defaultdict(lambda: defaultdict(list))
+    for stop in stops:
+        by_area[stop.area][stop.block].append(stop)
+
+    batches = []
+    for area in sorted(by_area):
+        blocks = by_area[area]
+        current = []
+        for block in block_order(blocks, graph):
+            block_stops = sorted(blocks[block], key=Stop.sort_key)
+            if current and len(current) + len(block_stops) > capacity:
+                batches.append(Batch(area, current, graph))
+                current = []
+            # A block with more orders than one driver takes is split
+            while len(block_stops) > capacity:
+                batches.append(Batch(area, block_stops[:capacity], graph))
+                block_stops = block_stops[capacity:]
+            current += block_stops
+        if current:
+            batches.append(Batch(area, current, graph))
+    return batches
+
+
+def confirmed_orders():
+    """Orders waiting for dispatch, one query on the (status, updated_at) index"""
+    # status is read by the rollups post_init handler, so it isn't deferred
+    return Order.objects.filter(status='confirmed').only(
+        'order_number', 'status', 'customer_name', 'customer_phone', 'area', 'block_number',
+        'road_number', 'house_number', 'building_name', 'flat_number',
+        'additional_directions', 'payment_method', 'total_amount',
+    )
+
+
+def plan(capacity=DEFAULT_CAPACITY, orders=None):
+    if orders is None:
+        orders = confirmed_orders()
+    stops = [Stop(order) for order in orders]
+    return make_batches(stops, BlockGraph.load(), capacity)
@@ -0,0 +1,272 @@
+"""Order and appointment status changes, published for live pages.
+
+Saving an Order or Appointment publishes its new status on a channel:
+'order:<order number>' or 'appointments:<user id>'. bookings/sse.py streams
+those channels to the confirmation and my-appointments pages as
+Server-Sent Events, so customers no longer reload them to see progress.
+
+The broker is chosen by settings.EVENT_BROKER:
+
+- MongoBroker (the default) writes events to a capped collection that every
+  process tails, so several workers, the admin and `manage.py run_worker`
+  all reach every client.
+- LocalBroker only reaches clients of the process that saved the row, which
+  is enough for a single uvicorn worker that also serves the admin.
+  check_broker() stops an ASGI worker from starting with it when the server
+  runs several workers.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .db import mongo_database
+from .models import Appointment, Order
+
+logger = logging.getLogger(__name__)
+
+# Only the latest statuses matter, so a slow client loses the oldest ones
+SUBSCRIBER_BUFFER = 16
+
+
+def order_channel(order_number):
+    return f'order:{order_number}'
+
+
+def appointments_channel(user_id):
+    return f'appointments:{user_id}'
+
+
+class Subscription:
+    """Events for one client, queued on the event loop that serves it"""
+    def __init__(self, channel):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(SUBSCRIBER_BUFFER)
+
+    def put(self, data):
+        # Runs on self.loop
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(data)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBroker:
+    """In-process pub/sub. publish() may be called from any thread."""
+    # Whether events reach subscribers in other processes
+    shared = False
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions[subscription.channel]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def deliver(self, channel, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, data)
+            except RuntimeError:  # Loop already closed
+                pass
+
+    def publish(self, events):
+        """Send (channel, data) pairs"""
+        for channel, data in events:
+            self.deliver(channel, data)
+
+
+class MongoBroker(LocalBroker):
+    """Pub/sub across processes through a capped MongoDB collection.
+
+    publish() inserts the event; a thread per process tails the collection
+    and delivers each event to that process's subscribers. The thread only
+    starts once a client subscribes, so WSGI and worker processes just write.
+    """
+    shared = True
+    collection_name = 'bookings_events'
+    collection_size = 16 * 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self._tailing = False
+        self._created = False
+
+    def collection(self):
+        db = mongo_database()
+        if not self._created and self.collection_name not in db.list_collection_names():
+            from pymongo.errors import CollectionInvalid
+
+            try:
+                db.create_collection(self.collection_name, capped=True, size=self.collection_size)
+            except CollectionInvalid:  # Created by another process meanwhile
+                pass
+        self._created = True
+        return db[self.collection_name]
+
+    def publish(self, events):
+        self.collection().insert_many(
+            [{'channel': channel, 'data': data} for channel, data in events], ordered=False
+        )
+
+    def subscribe(self, channel):
+        if not self._tailing:
+            with self._lock:
+                if not self._tailing:
+                    threading.Thread(target=self.tail, name='bookings-events', daemon=True).start()
+                    self._tailing = True
+        return super().subscribe(channel)
+
+    def tail(self):
+        from pymongo import CursorType
+
+        last = None
+        while True:
+            try:
+                collection = self.collection()
+                if last is None:
+                    # Start after the newest event; older ones are history
+                    newest = collection.find_one(sort=[('$natural', -1)])
+                    last = newest['_id'] if newest else None
+                query = {'_id': {'$gt': last}} if last else {}
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for event in cursor:
+                        last = event['_id']
+                        self.deliver(event['channel'], event['data'])
+            except Exception:
+                logger.exception('Event tailing failed, retrying')
+            # A tailable cursor on an empty collection dies straight away
+            time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.EVENT_BROKER)()
+    return _broker
+
+
+def server_workers():
+    """How many worker processes the server was started with.
+
+    uvicorn and gunicorn take --workers (gunicorn also -w) or fall back to
+    WEB_CONCURRENCY; uvicorn's workers are spawned with the server's argv.
+    """
+    args = sys.argv[1:]
+    for index, arg in enumerate(args):
+        if arg in ('--workers', '-w') and index + 1 < len(args):
+            value = args[index + 1]
+        elif arg.startswith('--workers='):
+            value = arg.split('=', 1)[1]
+        else:
+            continue
+        return int(value) if value.isdigit() else 1
+    value = os.environ.get('WEB_CONCURRENCY', '')
+    return int(value) if value.isdigit() else 1
+
+
+def check_broker():
+    """Refuse to serve events with a per-process broker across several workers"""
+    broker_class = import_string(settings.EVENT_BROKER)
+    workers = server_workers()
+    if workers > 1 and not broker_class.shared:
+        raise ImproperlyConfigured(
+            f'EVENT_BROKER {settings.EVENT_BROKER} only reaches clients of one process, '
+            f'but the server runs {workers} workers; use bookings.events.MongoBroker'
+        )
+
+
+def publish(events):
+    """Publish (channel, data) pairs after the current transaction commits"""
+    events = list(events)
+    if not events:
+        return
+
+    def send():
+        try:
+            get_broker().publish(events)
+        except Exception:
+            # Live updates are best effort; never fail the save over them
+            logger.exception('Could not publish %d events', len(events))
+    transaction.on_commit(send)
+
+
+def order_status(order_number, status):
+    return {
+        'order_number': order_number,
+        'status': status,
+        'label': dict(Order.STATUS_CHOICES).get(status, status),
+    }
+
+
+def appointment_status(appointment_id, status):
+    return {
+        'id': appointment_id,
+        'status': status,
+        'label': dict(Appointment.STATUS_CHOICES).get(status, status),
+    }
+
+
+def orders_changed(order_numbers, status):
+    """For update() calls, which skip post_save"""
+    publish(
+        (order_channel(order_number), order_status(order_number, status))
+        for order_number in order_numbers
+    )
+
+
+def appointments_changed(appointments, status):
+    """`appointments` are (id, user id) pairs; for update() calls"""
+    publish(
+        (appointments_channel(user_id), appointment_status(appointment_id, status))
+        for appointment_id, user_id in appointments
+    )
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, created, **kwargs):
+    # Nobody can be watching an order before checkout has redirected
+    if not created:
+        orders_changed([instance.order_number], instance.status)
+
+
+@receiver(post_save, sender=Appointment)
+def publish_appointment_status(sender, instance, created, **kwargs):
+    if not created:
+        appointments_changed([(instance.pk, instance.user_id)], instance.status)
@@ -26,4 +26,11 @@ class RatingForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['service'].queryset = Service.objects.all()
         self.fields['service'].required = False
-        self.fields['comment'].required = False
\ No newline at end of file
+        self.fields['comment'].required = False
+
+class PriceChangeForm(forms.Form):
+    """Percentage for the bulk price change admin action"""
+    percent = forms.DecimalField(
+        max_digits=5, decimal_places=2, min_value=-90, max_value=500,
+        help_text='e.g. 10 for a 10% increase, -15 for a 15% discount'
+    )
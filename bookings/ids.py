@@ -0,0 +1,148 @@
+"""Unique ID generation for orders and ratings"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .db import mongo_database
+
+# Crockford base32: no I, L, O or U, so order numbers read well over the phone
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+EPOCH_MS = 1735689600000  # 2025-01-01 00:00 UTC
+TIMESTAMP_BITS = 41  # ~69 years of milliseconds
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+ID_BITS = TIMESTAMP_BITS + NODE_BITS + SEQUENCE_BITS
+ID_LENGTH = -(-ID_BITS // 5)  # base32 digits, fixed width so IDs sort by time
+
+
+def encode_base32(number, length=ID_LENGTH):
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def default_node_id():
+    """This process's node id: settings.ORDER_NODE_ID, else one claimed from MongoDB.
+
+    A claim is a single $inc on a counter, so no two processes get the same
+    id until 1024 more have claimed one since. Forked workers claim their own.
+    """
+    node = settings.ORDER_NODE_ID
+    if node is None:
+        return (order_nodes.next_id() - 1) % (1 << NODE_BITS)
+    if not 0 <= node < 1 << NODE_BITS:
+        raise ImproperlyConfigured(f'ORDER_NODE_ID must be 0-{(1 << NODE_BITS) - 1}, not {node}')
+    return node
+
+
+class SnowflakeGenerator:
+    """Time-ordered 63-bit IDs: milliseconds | node | per-millisecond sequence.
+
+    Thread-safe, and resets itself in forked worker processes.
+    """
+
+    def __init__(self, node_id=None):
+        self._fixed_node = node_id
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._node = self._fixed_node if self._fixed_node is not None else default_node_id()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting
+                # from the last timestamp so IDs never repeat or go backwards
+                self._sequence += 1
+                if self._sequence >> SEQUENCE_BITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+
+            return (
+                (self._last_ms << (NODE_BITS + SEQUENCE_BITS))
+                | (self._node << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+_order_ids = SnowflakeGenerator()
+
+
+def new_order_number():
+    """Short, unique, time-ordered order number, e.g. 'ORD-06KBYJ1ZZ4R00'"""
+    return f'ORD-{encode_base32(_order_ids.next_id())}'
+
+
+class SequenceAllocator:
+    """Integer IDs from an atomic MongoDB counter, reserved in blocks.
+
+    Each process reserves `block_size` ids with a single findAndModify/$inc
+    on the django_sequences collection and hands them out from memory, so
+    concurrent inserts never collide and never scan for max(id). Ids left
+    in a block when a process exits are skipped, leaving gaps.
+    """
+    collection = 'django_sequences'
+
+    def __init__(self, sequence_name, block_size=20):
+        self.sequence_name = sequence_name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _reserve(self, count):
+        """Atomically bump the counter, returns the first id of the range"""
+        from pymongo import ReturnDocument
+
+        counter = mongo_database()[self.collection].find_one_and_update(
+            {'_id': self.sequence_name},
+            {'$inc': {'last_id': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter['last_id'] - count + 1
+
+    def take(self, count=1):
+        """Return `count` unused ids, reserving a new block when needed"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share a block with the parent of a forked worker
+                self._pid = os.getpid()
+                self._next = self._ceiling = 0
+
+            ids = []
+            while len(ids) < count:
+                if self._next >= self._ceiling:
+                    size = max(self.block_size, count - len(ids))
+                    self._next = self._reserve(size)
+                    self._ceiling = self._next + size
+                take = min(count - len(ids), self._ceiling - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+            return ids
+
+    def next_id(self):
+        return self.take(1)[0]
+
+
+# Same counter document the Rating fix in the README created by hand
+rating_ids = SequenceAllocator('bookings_rating_id_seq')
+
+# One id per claim, so a process never holds more than its own node id
+order_nodes = SequenceAllocator('bookings_order_node_seq', block_size=1)
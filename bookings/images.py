@@ -0,0 +1,63 @@
+"""Resized product image variants built by `manage.py build_product_images`"""
+import json
+from pathlib import Path
+
+# Product images live in the app's static folder, e.g. 'images/products/oil.png'
+STATIC_DIR = Path(__file__).resolve().parent / 'static'
+PRODUCT_IMAGE_DIR = STATIC_DIR / 'images' / 'products'
+VARIANTS_DIR = PRODUCT_IMAGE_DIR / 'variants'
+VARIANTS_MANIFEST = VARIANTS_DIR / 'variants.json'
+
+# Grid tiles are ~280px wide, so 320w covers 1x screens and 640w covers 2x
+VARIANT_WIDTHS = [320, 640]
+VARIANT_FORMATS = ['webp', 'png']
+
+_manifest_cache = {'mtime': None, 'data': {}}
+_size_cache = {}
+
+
+def variant_path(image_url, width, fmt):
+    """Static path of one variant, e.g. 'images/products/variants/oil-320w.webp'"""
+    stem = Path(image_url).stem
+    return f'{VARIANTS_DIR.relative_to(STATIC_DIR).as_posix()}/{stem}-{width}w.{fmt}'
+
+
+def load_variants():
+    """Map of source image_url -> list of {width, height, formats} variants.
+
+    The manifest is re-read only when the build command rewrites it.
+    """
+    try:
+        mtime = VARIANTS_MANIFEST.stat().st_mtime
+    except OSError:
+        return {}
+    if _manifest_cache['mtime'] != mtime:
+        with open(VARIANTS_MANIFEST) as f:
+            _manifest_cache['data'] = json.load(f)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['data']
+
+
+def write_variants(data):
+    VARIANTS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(VARIANTS_MANIFEST, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def image_size(image_url):
+    """(width, height) of a source image, or None if it can't be read.
+
+    Only the header is read, once per image, so an image without variants
+    still gets width/height and doesn't shift the page as it loads.
+    """
+    if image_url not in _size_cache:
+        try:
+            from PIL import Image
+
+            path = (STATIC_DIR / image_url).resolve()
+            path.relative_to(STATIC_DIR)  # Nothing outside the static folder
+            with Image.open(path) as image:
+                _size_cache[image_url] = image.size
+        except (ImportError, OSError, ValueError):
+            _size_cache[image_url] = None
+    return _size_cache[image_url]
@@ -0,0 +1,216 @@
+"""Product stock as an append-only ledger.
+
+Every change is a new StockMovement row (+in/-out) instead of an update of
+one Product field, so concurrent sales and restocks never contend on the
+same document and every change is kept. The level of a product is its
+StockSnapshot plus the movements after it; `manage.py snapshot_stock`
+moves the snapshots forward so reads only sum a short tail.
+
+Carts hold their items with 'reservation' movements. Each hold is settled
+exactly once: by a 'release' when the cart changes or checks out, or by an
+'expiry' from the background worker once STOCK_RESERVATION_MINUTES pass.
+Snapshots never move past a hold that is still open, so holds the worker
+missed are found by scanning from the snapshots on. Checkout holds the cart
+again before placing the order, as its first holds may have expired and the
+stock gone to another cart.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Min
+from django.utils import timezone
+
+from . import jobs
+from .models import Product, StockMovement, StockSnapshot
+
+# Movement ids are allocated before the insert lands, so snapshots stop
+# short of the newest rows to avoid skipping one that is still in flight
+SNAPSHOT_LAG = timedelta(minutes=1)
+
+
+def stock_levels(product_ids):
+    """{product_id: current stock} from snapshots and the movements since"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    snapshots = {s.product_id: s for s in StockSnapshot.objects.filter(product_id__in=product_ids)}
+    levels = {pid: snapshots[pid].quantity if pid in snapshots else 0 for pid in product_ids}
+
+    since = 0
+    if len(snapshots) == len(product_ids):
+        since = min(s.last_movement_id for s in snapshots.values())
+    tail = StockMovement.objects.filter(product_id__in=product_ids, id__gt=since)
+    for product_id, movement_id, quantity in tail.values_list('product_id', 'id', 'quantity'):
+        snapshot = snapshots.get(product_id)
+        if snapshot is None or movement_id > snapshot.last_movement_id:
+            levels[product_id] += quantity
+    return levels
+
+
+def stock_level(product_id):
+    return stock_levels([product_id])[product_id]
+
+
+def attach_stock_levels(products):
+    """Set product.stock_level on each product, two queries in total"""
+    products = list(products)
+    levels = stock_levels(p.id for p in products)
+    for p in products:
+        p.stock_level = levels[p.id]
+    return products
+
+
+def settle(reservation, kind):
+    """Return a held quantity to stock, False if it was already settled"""
+    try:
+        StockMovement.objects.create(
+            product_id=reservation.product_id,
+            kind=kind,
+            quantity=-reservation.quantity,
+            key=f'settle:{reservation.pk}',
+            reference=reservation.reference,
+        )
+    except DatabaseError:
+        # The unique key was taken by a concurrent release or expiry
+        return False
+    return True
+
+
+def open_reservations(reservations):
+    reservations = list(reservations)
+    settled = set(StockMovement.objects.filter(
+        key__in=[f'settle:{r.pk}' for r in reservations]
+    ).values_list('key', flat=True))
+    return [r for r in reservations if f'settle:{r.pk}' not in settled]
+
+
+def release_cart(cart_key):
+    """Release every live hold of a cart"""
+    held = StockMovement.objects.filter(
+        reference=cart_key, kind='reservation', expires_at__gt=timezone.now()
+    )
+    for reservation in open_reservations(held):
+        settle(reservation, 'release')
+
+
+def hold_cart(cart):
+    """Replace the cart's holds with ones matching its current items"""
+    release_cart(cart.session_id)
+    expires_at = timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+    held = [
+        StockMovement.objects.create(
+            product_id=item.product_id,
+            kind='reservation',
+            quantity=-item.quantity,
+            reference=cart.session_id,
+            expires_at=expires_at,
+        )
+        for item in cart.items.all()
+    ]
+    if held:
+        jobs.enqueue(
+            'expire_stock_reservations',
+            {'reservation_ids': [r.pk for r in held]},
+            delay=settings.STOCK_RESERVATION_MINUTES * 60,
+        )
+    return held
+
+
+def hold_for_checkout(cart):
+    """Hold the cart's items afresh, returns {product_id: units available} for
+    the products that are short, after releasing the holds again"""
+    held = hold_cart(cart)
+    levels = stock_levels(r.product_id for r in held)
+    short = {
+        r.product_id: levels[r.product_id] - r.quantity
+        for r in held if levels[r.product_id] < 0
+    }
+    if short:
+        release_cart(cart.session_id)
+    return short
+
+
+def expire(reservation_ids):
+    """Settle the given holds as expired, skipping released ones"""
+    held = StockMovement.objects.filter(id__in=reservation_ids, kind='reservation')
+    return sum(settle(r, 'expiry') for r in open_reservations(held))
+
+
+def snapshot_position():
+    """Movement id every snapshot has folded in, 0 before the first"""
+    return StockSnapshot.objects.aggregate(position=Min('last_movement_id'))['position'] or 0
+
+
+def expire_overdue():
+    """Expire holds whose worker job never ran, returns how many"""
+    overdue = StockMovement.objects.filter(
+        kind='reservation', id__gt=snapshot_position(), expires_at__lte=timezone.now()
+    )
+    return sum(settle(r, 'expiry') for r in open_reservations(overdue))
+
+
+def record_sale(order, order_items, cart_key):
+    """Turn the cart's holds into sale movements for a placed order"""
+    release_cart(cart_key)
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            product_id=item.product_id,
+            kind='sale',
+            quantity=-item.quantity,
+            key=f'sale:{item.pk}',
+            reference=order.order_number,
+        )
+        for item in order_items
+        if item.product_id is not None
+    ])
+
+
+def take_snapshots():
+    """Fold settled movements into each product's snapshot, returns how many moved"""
+    cutoff = StockMovement.objects.filter(
+        created_at__lte=timezone.now() - SNAPSHOT_LAG
+    ).order_by('-id').values_list('id', flat=True).first()
+    if cutoff is None:
+        return 0
+
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    snapshots = {s.product_id: s for s in StockSnapshot.objects.all()}
+    since = 0
+    if all(pid in snapshots for pid in product_ids):
+        since = min((s.last_movement_id for s in snapshots.values()), default=0)
+    # Stop short of the oldest open hold, expire_overdue only looks after it
+    holds = StockMovement.objects.filter(kind='reservation', id__gt=since, id__lte=cutoff)
+    open_ids = [r.pk for r in open_reservations(holds)]
+    if open_ids:
+        cutoff = min(open_ids) - 1
+    deltas = {}
+    tail = StockMovement.objects.filter(id__gt=since, id__lte=cutoff)
+    for product_id, movement_id, quantity in tail.values_list('product_id', 'id', 'quantity'):
+        snapshot = snapshots.get(product_id)
+        if snapshot is None or movement_id > snapshot.last_movement_id:
+            deltas[product_id] = deltas.get(product_id, 0) + quantity
+
+    moved = 0
+    for product_id in product_ids:
+        snapshot = snapshots.get(product_id)
+        if snapshot is None:
+            try:
+                StockSnapshot.objects.create(
+                    product_id=product_id, quantity=deltas.get(product_id, 0), last_movement_id=cutoff
+                )
+            except DatabaseError:
+                continue  # Another run created it first
+        elif snapshot.last_movement_id < cutoff:
+            # Only applies if no other run moved this snapshot in the meantime
+            StockSnapshot.objects.filter(
+                pk=snapshot.pk, last_movement_id=snapshot.last_movement_id
+            ).update(
+                quantity=snapshot.quantity + deltas.get(product_id, 0),
+                last_movement_id=cutoff,
+                taken_at=timezone.now(),
+            )
+        else:
+            continue
+        moved += 1
+    return moved
@@ -0,0 +1,158 @@
+"""Database-backed background jobs.
+
+Views enqueue side effects (emails, SMS, stock alerts) through the event
+hooks at the bottom of this module and return right after their own writes;
+`manage.py run_worker` picks the jobs up. Handlers are registered with the
+@job decorator (see bookings/tasks.py).
+"""
+import json
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import Job
+
+# Retry after 10s, 20s, 40s ... capped at an hour, with some jitter
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 3600
+
+_handlers = {}
+_subscribers = {}
+
+
+def job(name, on=None):
+    """Register a handler for jobs called `name`.
+
+    With `on`, the job is also enqueued whenever that event fires, e.g.
+    @job('send_order_confirmation', on='order_placed').
+    """
+    def decorator(func):
+        _handlers[name] = func
+        if on:
+            _subscribers.setdefault(on, []).append(name)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, idempotency_key=None, delay=0, max_attempts=5):
+    """Queue a job, returns the existing one if the key was already used"""
+    queued, created = Job.objects.get_or_create(
+        idempotency_key=idempotency_key or uuid.uuid4().hex,
+        defaults={
+            'name': name,
+            'payload': json.dumps(payload or {}),
+            'run_at': timezone.now() + timedelta(seconds=delay),
+            'max_attempts': max_attempts,
+        },
+    )
+    return queued
+
+
+def enqueue_many(name, jobs, delay=0, max_attempts=5):
+    """Queue (payload, idempotency key) pairs of one job in a single insert.
+
+    Keys already used are skipped, as with enqueue(), also when another
+    process queues the same ones meanwhile. Returns how many were new.
+    """
+    jobs = dict((key, payload) for payload, key in jobs)
+    existing = set(Job.objects.filter(idempotency_key__in=list(jobs)).values_list('idempotency_key', flat=True))
+    run_at = timezone.now() + timedelta(seconds=delay)
+    new = [
+        Job(name=name, payload=json.dumps(payload), idempotency_key=key,
+            run_at=run_at, max_attempts=max_attempts)
+        for key, payload in jobs.items() if key not in existing
+    ]
+    try:
+        Job.objects.bulk_create(new, ignore_conflicts=True)
+    except DatabaseError:
+        # Djongo has no ON CONFLICT and reports the duplicates, but its
+        # unordered insert has still written the rest
+        queued = Job.objects.filter(idempotency_key__in=[job.idempotency_key for job in new]).count()
+        if queued < len(new):
+            raise
+    return len(new)
+
+
+def fire(event, **payload):
+    """Enqueue every job subscribed to `event`, once per event key"""
+    key = ':'.join(f'{k}={v}' for k, v in sorted(payload.items()))
+    for name in _subscribers.get(event, []):
+        enqueue(name, payload, idempotency_key=f'{name}:{key}')
+
+
+def backoff_seconds(attempts):
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_jobs(worker, limit):
+    """Lock up to `limit` due jobs for this worker.
+
+    The conditional update only matches while the job is still unclaimed, so
+    two workers can never both get the same job. Jobs stuck in 'running'
+    longer than JOB_LOCK_TIMEOUT (a crashed worker) are claimed again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    candidates = list(
+        Job.objects.filter(status='pending', run_at__lte=now).order_by('run_at')[:limit]
+    )
+    if len(candidates) < limit:
+        candidates += list(
+            Job.objects.filter(status='running', locked_at__lt=stale)[:limit - len(candidates)]
+        )
+
+    claimed = []
+    for candidate in candidates:
+        updated = Job.objects.filter(
+            pk=candidate.pk, status=candidate.status, locked_at=candidate.locked_at
+        ).update(status='running', locked_by=worker, locked_at=now)
+        if updated:
+            candidate.status, candidate.locked_by, candidate.locked_at = 'running', worker, now
+            claimed.append(candidate)
+    return claimed
+
+
+def run_job(job):
+    job.attempts += 1
+    try:
+        handler = _handlers[job.name]
+        handler(json.loads(job.payload))
+    except Exception:
+        job.last_error = traceback.format_exc(limit=5)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.run_at = timezone.now() + timedelta(seconds=backoff_seconds(job.attempts))
+    else:
+        job.status = 'done'
+        job.last_error = ''
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=['attempts', 'status', 'run_at', 'last_error',
+                            'locked_by', 'locked_at', 'updated_at'])
+    return job.status
+
+
+def run_pending(worker, batch_size=10):
+    """Claim and run one batch, returns the number of jobs processed"""
+    jobs = claim_jobs(worker, batch_size)
+    for claimed in jobs:
+        run_job(claimed)
+    return len(jobs)
+
+
+# Event hooks called from the views after their core writes
+
+def order_placed(order):
+    fire('order_placed', order_id=order.pk)
+
+
+def appointment_booked(appointment):
+    fire('appointment_booked', appointment_id=appointment.pk)
@@ -0,0 +1,178 @@
+"""Logging that never blocks a request thread.
+
+Records are put on an in-memory queue; a QueueListener thread formats them
+as one JSON object per line and writes them to the real stream. If the
+stream is slow and the queue fills up, records are dropped (and counted)
+rather than making the request wait. The listener writes how many were
+dropped at most once a minute, and when it stops. Configured in
+settings.LOGGING.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Set per request by bookings.middleware.RequestIdMiddleware
+request_id = contextvars.ContextVar('request_id', default='-')
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Per-logger sampling and rate limits.
+
+    `rules` maps a logger name (children included) to `sample_rate`, the
+    share of records below WARNING that are kept, and `max_per_second`, a
+    token bucket over all of its records.
+    """
+    def __init__(self, rules=None):
+        super().__init__()
+        self.rules = rules or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def rule_for(self, name):
+        while name:
+            if name in self.rules:
+                return name, self.rules[name]
+            name = name.rpartition('.')[0]
+        return None, None
+
+    def filter(self, record):
+        name, rule = self.rule_for(record.name)
+        if rule is None:
+            return True
+        if record.levelno < logging.WARNING and random.random() >= rule.get('sample_rate', 1):
+            return False
+        rate = rule.get('max_per_second')
+        if rate is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(name, (rate, now))
+            tokens = min(rate, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[name] = (tokens, now)
+                return False
+            self._buckets[name] = (tokens - 1, now)
+        return True
+
+
+class Listener(QueueListener):
+    def __init__(self, queue, handler, report):
+        super().__init__(queue, handler)
+        self.report = report
+
+    def handle(self, record):
+        super().handle(record)
+        self.report()
+
+    def enqueue_sentinel(self):
+        # Waits for room: at exit the queue may be full, and this thread is
+        # the one emptying it
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:  # Stopped already
+            super().stop()
+            self.report(final=True)
+
+
+class NonBlockingHandler(QueueHandler):
+    """Queue records for a background thread that writes them to `stream`"""
+    # How often, at most, the listener writes the count of dropped records
+    report_seconds = 60
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.sink = logging.StreamHandler(stream)
+        self.sink.setFormatter(JsonFormatter())
+        self.dropped = 0
+        self._reported = 0
+        self._next_report = 0.0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        self.sink.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Only what can't wait: the arguments and traceback may change or go
+        # away once the caller moves on. JSON encoding happens on the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.sink.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def start_listener(self):
+        # Threads don't survive a fork, so each worker process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = Listener(self.queue, self.sink, self.report_dropped)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._listener.stop)  # Flushes what is queued
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def report_dropped(self, final=False):
+        """Write how many records were dropped since the last report.
+
+        Runs on the listener thread, which owns the stream, so the report is
+        written straight to it rather than queued behind the backlog.
+        """
+        now = time.monotonic()
+        dropped = self.dropped - self._reported
+        if not dropped or (now < self._next_report and not final):
+            return
+        self._reported += dropped
+        self._next_report = now + self.report_seconds
+        self.sink.handle(logging.makeLogRecord({
+            'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': 'Dropped %d log records: the log stream is not keeping up',
+            'args': (dropped,), 'dropped': dropped,
+        }))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bookings import archive, rollups
+
+
+class Command(BaseCommand):
+    help = 'Move delivered and cancelled orders into the order archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True, metavar='DAYS',
+                            help='Archive orders last updated more than DAYS days ago')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Orders moved per batch (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        if rollups.rebuilding():
+            # Its pass could miss orders moving between the two collections
+            raise CommandError('A rollup rebuild is running, archive once it has finished')
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        orders = items = 0
+        while True:
+            # Each batch deletes what it moved, so the next one starts over
+            batch = list(archive.archivable(cutoff).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            moved_orders, moved_items = archive.archive_batch(batch)
+            orders += moved_orders
+            items += moved_items
+            self.stdout.write(f'Archived {orders} orders so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {orders} orders and {items} items'))
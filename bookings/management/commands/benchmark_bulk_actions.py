@@ -0,0 +1,67 @@
+import time
+from decimal import Decimal
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bookings.db import scale
+from bookings.models import Order, Product
+
+
+def timed(func, *args, **kwargs):
+    started = time.monotonic()
+    func(*args, **kwargs)
+    return time.monotonic() - started
+
+
+def save_each(queryset, **fields):
+    """What the actions replaced: load and save() every selected object"""
+    for obj in queryset:
+        for name, value in fields.items():
+            setattr(obj, name, value)
+        # Only the changed fields: Djongo can't save a loaded Decimal128 back
+        obj.save(update_fields=list(fields))
+
+
+class Command(BaseCommand):
+    help = 'Time the bulk admin actions against per-object saves, on a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Selected orders and products (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        old_name = connection.settings_dict['NAME']
+        # The same kind of database the tests get, created and dropped here
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Seeded with bulk_create, so no rollup signals run
+            Order.objects.bulk_create([
+                Order(order_number=f'BENCH-{n}', customer_name='Bench', customer_phone='1',
+                      house_number='1', road_number='1', block_number='1', area='Riffa',
+                      payment_method='cash', total_amount=Decimal('1.000'), status='pending')
+                for n in range(rows)
+            ], batch_size=1000)
+            Product.objects.bulk_create([
+                Product(name=f'Bench {n}', category='polish', description='', price=Decimal('2.500'))
+                for n in range(rows)
+            ], batch_size=1000)
+
+            order_admin = admin.site._registry[Order]
+            results = [
+                ('Set order status', timed(save_each, Order.objects.all(), status='confirmed'),
+                 timed(order_admin.set_status, Order.objects.all(), 'delivered')),
+                ('Change prices by 10%', timed(save_each, Product.objects.all(), price=Decimal('2.750')),
+                 timed(scale, Product.objects.all(), 'price', Decimal('1.1'))),
+            ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'{rows} selected rows, {connection.vendor}')
+        for name, per_object, bulk in results:
+            self.stdout.write(
+                f'{name:24} per-object save {per_object:8.2f}s  bulk action {bulk:6.3f}s  '
+                f'({per_object / bulk:.0f}x)'
+            )
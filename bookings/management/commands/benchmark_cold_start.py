@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.warmup import WARM_URLS
+
+from .benchmark_views import SERVERS, read_response, wait_until_up
+
+
+async def first_request(port, path):
+    """(status, seconds) of one request on a new connection"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        started = time.monotonic()
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: identity\r\n\r\n'.encode())
+        status = await read_response(reader)
+        return status, time.monotonic() - started
+    finally:
+        writer.close()
+
+
+async def readiness(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(b'GET /health/ready/ HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        return await read_response(reader)
+    finally:
+        writer.close()
+
+
+class Command(BaseCommand):
+    help = "Time a new worker's boot and first requests, with and without warm-up"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3,
+                            help='Fresh workers started per mode (default: %(default)s)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='URL requested once after boot, repeatable (default: the warmed pages)')
+        parser.add_argument('--port', type=int, default=8702)
+
+    def boot(self, application, extra, warmup, paths, port):
+        """Start one worker, returns (seconds until it accepts, {path: seconds})"""
+        env = {**os.environ, 'DJANGO_WARMUP': '1' if warmup else '0'}
+        started = time.monotonic()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', application, '--port', str(port),
+             '--workers', '1', '--log-level', 'warning', '--no-access-log'] + extra,
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            # uvicorn imports the app, and so warms up, before it listens
+            asyncio.run(wait_until_up(port, timeout=120))
+            boot = time.monotonic() - started
+            first = {}
+            for path in paths:
+                status, seconds = asyncio.run(first_request(port, path))
+                if status != 200:
+                    raise CommandError(f'GET {path} returned {status}')
+                first[path] = seconds
+            ready = asyncio.run(readiness(port))
+            if ready != 200:
+                raise CommandError(f'/health/ready/ returned {ready} with warm-up {"on" if warmup else "off"}')
+        finally:
+            server.terminate()
+            server.wait()
+        return boot, first
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or WARM_URLS
+        self.stdout.write(f'{options["runs"]} fresh workers per mode, first request to {", ".join(paths)}')
+        for mode, application, extra in SERVERS:
+            for warmup in (False, True):
+                runs = [
+                    self.boot(application, extra, warmup, paths, options['port'])
+                    for _ in range(options['runs'])
+                ]
+                first = {
+                    path: round(statistics.median(run[1][path] for run in runs) * 1000, 1)
+                    for path in paths
+                }
+                self.stdout.write(
+                    f'{mode} warm-up {"on " if warmup else "off"}: '
+                    f'boot {statistics.median(run[0] for run in runs):5.2f}s  '
+                    f'first requests (ms, median) {json.dumps(first)}'
+                )
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from bookings.middleware import RateLimitMiddleware
+
+# High enough that every timed request is let through
+RULE = {'per_minute': 10 ** 9, 'burst': 10 ** 9, 'key': 'ip'}
+
+CACHES = {
+    'MongoDB': {'BACKEND': 'bookings.cache.MongoCache', 'LOCATION': 'bookings_benchmark_cache'},
+    'in-process cache': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Time the rate-limit check per request, on a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000,
+                            help='Requests timed per case (default: %(default)s)')
+
+    def time_requests(self, method, count):
+        """Microseconds RateLimitMiddleware adds to one request"""
+        path = reverse('add_to_cart', args=[1])
+        request = getattr(RequestFactory(), method)(path)
+        request.resolver_match = resolve(path)
+        middleware = RateLimitMiddleware(lambda request: None)
+        started = time.perf_counter()
+        for _ in range(count):
+            middleware.process_view(request, None, (), {})
+        return (time.perf_counter() - started) / count * 1e6
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        results = []
+        try:
+            with override_settings(RATE_LIMITS={'add_to_cart': RULE}):
+                backend = settings.CACHES[settings.RATE_LIMIT_CACHE]['BACKEND']
+                results.append((f'POST, {backend}', self.time_requests('post', count)))
+                for name, cache in CACHES.items():
+                    with override_settings(CACHES={**settings.CACHES, 'benchmark': cache},
+                                           RATE_LIMIT_CACHE='benchmark'):
+                        results.append((f'POST, {name}', self.time_requests('post', count)))
+                        caches['benchmark'].clear()
+                results.append(('GET (not limited)', self.time_requests('get', count)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'{count} requests per case, {connection.vendor}')
+        for name, micros in results:
+            self.stdout.write(f'{name:50} {micros:8.1f}us per request')
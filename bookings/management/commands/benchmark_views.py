@@ -0,0 +1,142 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+SERVERS = [
+    # uvicorn runs the WSGI app on its own thread pool, so both modes get
+    # the same number of processes from the same server
+    ('WSGI', f'{__name__}:wsgi_application', ['--interface', 'wsgi', '--factory']),
+    ('ASGI', 'car_polishing_site.asgi:application', []),
+]
+
+
+def wsgi_application():
+    """car_polishing_site.wsgi, minus the space Django puts before Set-Cookie
+    values: gunicorn strips it, uvicorn's WSGI adapter rejects the response.
+    A factory, so uvicorn loads (and warms up) the app before it listens."""
+    from car_polishing_site.wsgi import application
+
+    def app(environ, start_response):
+        def start(status, headers, exc_info=None):
+            return start_response(status, [(name, value.strip()) for name, value in headers], exc_info)
+        return application(environ, start)
+    return app
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response, returns the status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Server closed the connection')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    return int(status_line.split()[1])
+
+
+async def client(port, paths, deadline, latencies, errors):
+    """One keep-alive connection requesting `paths` in turn until `deadline`"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        index = 0
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.monotonic()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: identity\r\n\r\n'.encode())
+            status = await read_response(reader)
+            if status == 200:
+                latencies.append(time.monotonic() - started)
+            else:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load(port, paths, concurrency, seconds):
+    latencies, errors = [], []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[
+        client(port, paths, deadline, latencies, errors) for _ in range(concurrency)
+    ])
+    return latencies, errors
+
+
+async def wait_until_up(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            await asyncio.sleep(0.2)
+            continue
+        writer.close()
+        return
+    raise CommandError(f'Server on port {port} did not start')
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/s of the WSGI and ASGI deployments under uvicorn at equal worker counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Server processes per mode (default: %(default)s)')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='Concurrent keep-alive connections (default: %(default)s)')
+        parser.add_argument('--seconds', type=float, default=10,
+                            help='Measured seconds per mode (default: %(default)s)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='URL to request, repeatable (default: /catalog.json and /shop/)')
+        parser.add_argument('--port', type=int, default=8701)
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or ['/catalog.json', '/shop/']
+        port = options['port']
+        self.stdout.write(
+            f'{options["workers"]} workers, {options["concurrency"]} connections, '
+            f'{options["seconds"]:g}s, {", ".join(paths)}'
+        )
+        for mode, application, extra in SERVERS:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', application, '--port', str(port),
+                 '--workers', str(options['workers']), '--log-level', 'warning',
+                 '--no-access-log'] + extra,
+                env=os.environ.copy(), stdout=subprocess.DEVNULL,
+            )
+            try:
+                asyncio.run(wait_until_up(port))
+                # Not measured: lets every worker finish warming up
+                asyncio.run(load(port, paths, options['concurrency'], 2))
+                latencies, errors = asyncio.run(
+                    load(port, paths, options['concurrency'], options['seconds'])
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+            if not latencies:
+                raise CommandError(f'{mode}: no successful requests ({len(errors)} errors)')
+            latencies.sort()
+            self.stdout.write(
+                f'{mode}: {len(latencies) / options["seconds"]:8.1f} req/s  '
+                f'p50 {statistics.median(latencies) * 1000:6.1f}ms  '
+                f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f}ms  '
+                f'errors {len(errors)}'
+            )
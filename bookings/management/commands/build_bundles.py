@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.utils import get_app_template_dirs
+
+from bookings.bundles import write_bundles
+from bookings.templatetags.bundles import BundleNode
+
+
+class Command(BaseCommand):
+    help = 'Extract {% bundle %} blocks from the templates into static CSS/JS files'
+
+    def handle(self, *args, **options):
+        engine = engines['django'].engine
+        template_dirs = [Path(d) for d in engine.dirs] + [Path(d) for d in get_app_template_dirs('templates')]
+
+        sources = {}
+        for template_dir in template_dirs:
+            for path in sorted(template_dir.rglob('*.html')):
+                name = path.relative_to(template_dir).as_posix()
+                nodes = engine.get_template(name).nodelist.get_nodes_by_type(BundleNode)
+                for node in nodes:
+                    if sources.get(node.name, node.source) != node.source:
+                        raise CommandError(f'Bundle "{node.name}" is defined differently in {name}')
+                    sources[node.name] = node.source
+                    self.stdout.write(f'{name}: {node.name}')
+
+        write_bundles(sources)
+        self.stdout.write(self.style.SUCCESS(f'{len(sources)} bundles written'))
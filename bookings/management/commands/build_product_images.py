@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.images import (
+    PRODUCT_IMAGE_DIR, STATIC_DIR, VARIANT_FORMATS, VARIANT_WIDTHS,
+    variant_path, write_variants,
+)
+
+SOURCE_SUFFIXES = {'.png', '.jpg', '.jpeg'}
+
+
+class Command(BaseCommand):
+    help = 'Generate resized PNG and WebP variants of the product images for the shop grid'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--widths', nargs='+', type=int, default=VARIANT_WIDTHS,
+                            help='Thumbnail widths in pixels (default: %(default)s)')
+        parser.add_argument('--quality', type=int, default=80,
+                            help='WebP quality, 1-100 (default: %(default)s)')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild variants even if they are newer than the source')
+
+    def handle(self, *args, **options):
+        try:
+            from PIL import Image
+        except ImportError:
+            raise CommandError('Pillow is required: pip install Pillow')
+
+        sources = sorted(
+            p for p in PRODUCT_IMAGE_DIR.iterdir()
+            if p.is_file() and p.suffix.lower() in SOURCE_SUFFIXES
+        )
+        manifest = {}
+        built = 0
+
+        for source in sources:
+            image_url = source.relative_to(STATIC_DIR).as_posix()
+            with Image.open(source) as original:
+                original.load()
+                # Never upscale; small images still get a single variant
+                widths = sorted({min(w, original.width) for w in options['widths']})
+                variants = []
+
+                for width in widths:
+                    image = original.copy()
+                    # Scale to the target width; srcset descriptors are widths
+                    image.thumbnail((width, original.height), Image.LANCZOS)
+                    for fmt in VARIANT_FORMATS:
+                        target = STATIC_DIR / variant_path(image_url, width, fmt)
+                        if (options['force'] or not target.exists()
+                                or target.stat().st_mtime < source.stat().st_mtime):
+                            target.parent.mkdir(parents=True, exist_ok=True)
+                            self._save(image, target, fmt, options['quality'])
+                            built += 1
+                    variants.append({
+                        'width': width,
+                        'height': image.height,
+                    })
+
+            manifest[image_url] = variants
+            self.stdout.write(f'{image_url}: {", ".join(str(v["width"]) for v in variants)}')
+
+        write_variants(manifest)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(manifest)} product images, {built} variant files written'
+        ))
+
+    def _save(self, image, target, fmt, quality):
+        if fmt == 'webp':
+            image.save(target, 'WEBP', quality=quality, method=6)
+        else:
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            image.save(target, 'PNG', optimize=True)
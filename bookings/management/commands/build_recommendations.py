@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookings import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild "frequently bought together" recommendations from all orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help='Neighbours kept per product (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        orders, products = recommendations.rebuild(options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{orders} orders, {products} products with recommendations '
+            f'({time.monotonic() - started:.2f}s)'
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookings import dispatch
+from bookings.db import price_to_float
+
+
+class Command(BaseCommand):
+    help = 'Group confirmed orders into driver batches with stops in route order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacity', type=int, default=dispatch.DEFAULT_CAPACITY,
+                            help='Most stops per driver (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        batches = dispatch.plan(max(1, options['capacity']))
+        elapsed = time.monotonic() - started
+
+        for number, batch in enumerate(batches, 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'Driver {number}: {batch.area}, blocks {", ".join(batch.blocks)} ({len(batch)} stops)'
+            ))
+            for stop in batch.stops:
+                order = stop.order
+                self.stdout.write(
+                    f'  {order.order_number}  {order.get_full_address()}  '
+                    f'{order.customer_phone}  {price_to_float(order.total_amount):.3f} BHD'
+                )
+        stops = sum(len(batch) for batch in batches)
+        self.stdout.write(self.style.SUCCESS(
+            f'Planned {stops} orders into {len(batches)} batches ({elapsed:.2f}s)'
+        ))
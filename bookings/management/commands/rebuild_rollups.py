@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from the full order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Orders read per query (default: %(default)s)')
+        parser.add_argument('--force', action='store_true',
+                            help='Start even if an earlier rebuild looks unfinished')
+
+    def handle(self, *args, **options):
+        # Live orders keep being counted meanwhile, see bookings/rollups.py
+        try:
+            orders, daily, products = rollups.rebuild(options['chunk_size'], options['force'])
+        except RuntimeError as e:
+            raise CommandError(f'{e}; use --force if it was interrupted')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {orders} orders into {daily} daily and {products} product rows'
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookings import scheduler
+
+
+class Command(BaseCommand):
+    help = 'Queue appointment reminders and cancel stale pending bookings, once a minute (run one)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Seconds between ticks (default: %(default)s)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Appointments per bulk update (default: %(default)s)')
+        parser.add_argument('--once', action='store_true',
+                            help='Run a single tick and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            reminded, cancelled = scheduler.tick(options['batch_size'])
+            elapsed = time.monotonic() - started
+            if options['once'] or reminded or cancelled:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Queued {reminded} reminders, cancelled {cancelled} stale bookings '
+                    f'in {elapsed:.3f}s'
+                ))
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - elapsed))
@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def worker_loop(index, batch_size, poll_interval, once):
+    # Spawned processes (Windows) start with a fresh interpreter
+    import django
+    django.setup()
+    from bookings.jobs import run_pending
+
+    worker = f'{socket.gethostname()}:{os.getpid()}:{index}'
+    while True:
+        processed = run_pending(worker, batch_size)
+        if once and not processed:
+            return
+        if not processed:
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (order and appointment side effects) from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+                            help='Number of worker processes (default: %(default)s)')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Jobs claimed per poll (default: %(default)s)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty (default: %(default)s)')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained instead of polling')
+
+    def handle(self, *args, **options):
+        args = (options['batch_size'], options['poll_interval'], options['once'])
+        if options['processes'] <= 1:
+            worker_loop(0, *args)
+            return
+
+        # Children must open their own database connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=worker_loop, args=(i,) + args, daemon=True)
+            for i in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Started {len(processes)} workers')
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
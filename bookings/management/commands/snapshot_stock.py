@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bookings import inventory
+
+
+class Command(BaseCommand):
+    help = 'Expire overdue cart reservations and move stock snapshots forward (run periodically)'
+
+    def handle(self, *args, **options):
+        expired = inventory.expire_overdue()
+        moved = inventory.take_snapshots()
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {expired} reservations, updated {moved} stock snapshots'
+        ))
@@ -0,0 +1,182 @@
+"""Request ids, rate limits, response compression and HTML minification"""
+import asyncio
+import gzip
+import math
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_finished
+from django.dispatch import receiver
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import ratelimit
+from .log import request_id
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Below this the compression overhead isn't worth it (same as GZipMiddleware)
+MIN_COMPRESS_SIZE = 200
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+PRESERVE_RE = re.compile(r'<(pre|textarea|script)\b.*?</\1>', re.S | re.I)
+INDENT_RE = re.compile(r'\n\s+')
+STRONG_ETAG_RE = re.compile(r'^"')
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9-]{1,64}$')
+
+
+def minify_html(html):
+    """Drop indentation and blank lines outside <pre>, <textarea> and <script>.
+
+    Line breaks are kept, so inline CSS keeps working, and scripts are left
+    alone so multi-line strings in them aren't changed.
+    """
+    parts = []
+    pos = 0
+    for match in PRESERVE_RE.finditer(html):
+        parts.append(INDENT_RE.sub('\n', html[pos:match.start()]))
+        parts.append(match.group(0))
+        pos = match.end()
+    parts.append(INDENT_RE.sub('\n', html[pos:]))
+    return ''.join(parts).strip()
+
+
+def choose_encoding(accept_encoding):
+    """Best encoding we support from an Accept-Encoding header, or ''"""
+    accepted = set()
+    for coding in accept_encoding.lower().split(','):
+        name, _, params = coding.partition(';')
+        params = params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return ''
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Minify HTML and brotli/gzip-compress responses.
+
+    Place it right after UpdateCacheMiddleware: the page cache then stores the
+    compressed body, so compression runs once per cache fill. Accept-Encoding
+    is normalised to the chosen coding, so the cache holds one entry per coding
+    rather than one per browser's header string.
+    """
+
+    def process_request(self, request):
+        request.META['HTTP_ACCEPT_ENCODING'] = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        content_type = response.get('Content-Type', '')
+        if settings.HTML_MINIFY and content_type.startswith('text/html'):
+            html = response.content.decode(response.charset)
+            response.content = minify_html(html).encode(response.charset)
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+
+        if not content_type.startswith(COMPRESSIBLE_TYPES) or len(response.content) < MIN_COMPRESS_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if not encoding:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, quality=5)
+        else:
+            compressed = gzip.compress(response.content, compresslevel=6)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The body changed, so a strong ETag no longer matches it byte for byte
+        if response.has_header('ETag'):
+            response['ETag'] = STRONG_ETAG_RE.sub('W/"', response['ETag'])
+        return response
+
+
+def clear_page_cache():
+    """Drop every cached page, e.g. after bulk product edits in the admin"""
+    if settings.PAGE_CACHE_SECONDS:
+        caches[settings.CACHE_MIDDLEWARE_ALIAS].clear()
+
+
+class RequestIdMiddleware(MiddlewareMixin):
+    """Tag every log record of a request with one id.
+
+    Reuses a well-formed X-Request-ID from the proxy, otherwise makes one, and
+    echoes it in the response. Keep it first, outside the page cache, so
+    cached responses never carry another request's id.
+    """
+
+    def new_id(self, request):
+        incoming = request.META.get('HTTP_X_REQUEST_ID', '')
+        return incoming if REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+
+    # The id is only reset by forget_request_id() below: the handler logs
+    # 4xx/5xx responses (django.request) after the middleware returns
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        request_id.set(self.new_id(request))
+        response = self.get_response(request)
+        response['X-Request-ID'] = request_id.get()
+        return response
+
+    async def __acall__(self, request):
+        request_id.set(self.new_id(request))
+        response = await self.get_response(request)
+        response['X-Request-ID'] = request_id.get()
+        return response
+
+
+@receiver(request_finished)
+def forget_request_id(**kwargs):
+    # Sent once the response is closed, on the thread that served it, so
+    # nothing logged afterwards (warm-up, jobs) carries the request's id
+    request_id.set('-')
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """Answer 429 to POSTs over the settings.RATE_LIMITS rule for their URL"""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method != 'POST' or request.resolver_match is None:
+            return None
+        url_name = request.resolver_match.url_name
+        rule = settings.RATE_LIMITS.get(url_name)
+        if rule is None:
+            return None
+        wait = ratelimit.check(request, url_name, rule)
+        if not wait:
+            return None
+
+        retry_after = math.ceil(wait)
+        seconds = 'second' if retry_after == 1 else 'seconds'
+        message = f'Too many requests, please try again in {retry_after} {seconds}.'
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            response = JsonResponse({'success': False, 'message': message}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(retry_after)
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:10
+
+from django.db import migrations, models
+
+SEQUENCE_NAME = 'bookings_rating_id_seq'
+
+
+def backfill_rating_ids(apps, schema_editor):
+    """Number ratings saved without an id and start the counter after max(id)"""
+    if schema_editor.connection.vendor != 'djongo':
+        return
+    db = schema_editor.connection.connection
+    ratings = db[apps.get_model('bookings', 'Rating')._meta.db_table]
+
+    highest = ratings.find_one({'id': {'$type': 'number'}}, sort=[('id', -1)])
+    last_id = int(highest['id']) if highest else 0
+
+    missing = ratings.find({'id': {'$not': {'$type': 'number'}}}, {'_id': 1}).sort('created_at', 1)
+    for doc in missing:
+        last_id += 1
+        ratings.update_one({'_id': doc['_id']}, {'$set': {'id': last_id}})
+
+    # $max so a counter that is already ahead (e.g. the manual fix) is kept
+    db['django_sequences'].update_one(
+        {'_id': SEQUENCE_NAME}, {'$max': {'last_id': last_id}}, upsert=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0003_cart_cartitem_order_orderitem_product_productcategory'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rating',
+            name='id',
+            field=models.IntegerField(primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(backfill_rating_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('area', models.CharField(max_length=100)),
+                ('payment_method', models.CharField(max_length=20)),
+                ('order_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily sales',
+                'unique_together': {('date', 'area', 'payment_method')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('product_name', models.CharField(max_length=200)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bookings.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily product sales',
+                'unique_together': {('date', 'product_name')},
+            },
+        ),
+    ]
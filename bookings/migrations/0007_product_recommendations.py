@@ -0,0 +1,26 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendations',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('neighbours', models.TextField(default='[]')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='bookings.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Product recommendations',
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:19
+
+import bookings.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def opening_balances(apps, schema_editor):
+    """Carry each product's stock_quantity into the ledger"""
+    Product = apps.get_model('bookings', 'Product')
+    StockMovement = apps.get_model('bookings', 'StockMovement')
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            product_id=product.pk,
+            kind='adjustment',
+            quantity=product.stock_quantity,
+            key=f'opening:{product.pk}',
+            note='Opening balance',
+        )
+        for product in Product.objects.all()
+        if product.stock_quantity
+    ])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('last_movement_id', models.IntegerField(default=0)),
+                ('taken_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshot', to='bookings.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('restock', 'Restock'), ('adjustment', 'Adjustment'), ('sale', 'Sale'), ('reservation', 'Reservation'), ('release', 'Reservation released'), ('expiry', 'Reservation expired')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('key', models.CharField(default=bookings.models.movement_key, max_length=100, unique=True)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='bookings.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['reference', 'kind'], name='bookings_st_referen_902996_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['kind', 'expires_at'], name='bookings_st_kind_b0db2d_idx'),
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('order_number', models.CharField(max_length=50, unique=True)),
+                ('customer_name', models.CharField(max_length=200)),
+                ('customer_phone', models.CharField(max_length=20)),
+                ('customer_email', models.EmailField(blank=True, max_length=254)),
+                ('house_number', models.CharField(max_length=50)),
+                ('road_number', models.CharField(max_length=50)),
+                ('block_number', models.CharField(max_length=50)),
+                ('area', models.CharField(help_text='e.g., Riffa, Manama, Muharraq', max_length=100)),
+                ('building_name', models.CharField(blank=True, help_text='Optional', max_length=200)),
+                ('flat_number', models.CharField(blank=True, help_text='Optional', max_length=50)),
+                ('additional_directions', models.TextField(blank=True)),
+                ('payment_method', models.CharField(choices=[('cash', 'Cash on Delivery'), ('card', 'Card on Delivery'), ('benefit', 'BenefitPay on Delivery')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('out_for_delivery', 'Out for Delivery'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], default='pending', max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('product_name', models.CharField(max_length=200)),
+                ('quantity', models.IntegerField()),
+                ('price', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'updated_at'], name='bookings_or_status_cdbed4_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='bookings.archivedorder'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='bookings.product'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0009_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockAdjacency',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block', models.CharField(max_length=50)),
+                ('adjacent_block', models.CharField(max_length=50)),
+            ],
+            options={
+                'verbose_name_plural': 'Block adjacencies',
+                'unique_together': {('block', 'adjacent_block')},
+            },
+        ),
+    ]
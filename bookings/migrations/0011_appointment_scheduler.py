@@ -0,0 +1,26 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0010_block_adjacency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerMark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'appointment_date', 'appointment_time'], name='bookings_ap_status_cdff42_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.12 on 2026-10-19 17:51
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def count_carts(apps, schema_editor):
+    """Fill in item_count and total for existing carts"""
+    Cart = apps.get_model('bookings', 'Cart')
+    CartItem = apps.get_model('bookings', 'CartItem')
+    counts = {}
+    for item in CartItem.objects.select_related('product'):
+        price = item.product.price
+        price = price.to_decimal() if hasattr(price, 'to_decimal') else Decimal(str(price))
+        count, total = counts.get(item.cart_id, (0, Decimal(0)))
+        counts[item.cart_id] = (count + item.quantity, total + price * item.quantity)
+    for cart_id, (count, total) in counts.items():
+        Cart.objects.filter(pk=cart_id).update(item_count=count, total=round(total, 3))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0011_appointment_scheduler'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=10),
+        ),
+        migrations.RunPython(count_carts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.1.12 on 2026-10-19 18:11
+
+from collections import Counter, defaultdict
+from itertools import permutations
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_pairs(apps, schema_editor):
+    """Pair counts of the existing orders, so new ones add to the full history"""
+    ProductPair = apps.get_model('bookings', 'ProductPair')
+    baskets = defaultdict(set)
+    for model_name in ('OrderItem', 'ArchivedOrderItem'):
+        lines = apps.get_model('bookings', model_name).objects.filter(
+            product__isnull=False
+        ).values_list('order_id', 'product_id')
+        for order_id, product_id in lines.iterator():
+            baskets[order_id].add(product_id)
+    counts = Counter()
+    for basket in baskets.values():
+        counts.update(permutations(basket, 2))
+    ProductPair.objects.bulk_create([
+        ProductPair(product_id=product_id, other_id=other_id, order_count=count)
+        for (product_id, other_id), count in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0013_rollup_rebuild'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('other_id', models.IntegerField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bookings.product')),
+            ],
+            options={
+                'unique_together': {('product', 'other_id')},
+            },
+        ),
+        migrations.RunPython(count_pairs, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
+import json
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
+from .db import increment
+from .ids import rating_ids
 
 class Service(models.Model):
     name = models.CharField(max_length=100)
@@ -31,6 +35,17 @@ class Appointment(models.Model):
     
     class Meta:
         ordering = ['-appointment_date', '-appointment_time']
+        # Due-window lookups by bookings/scheduler.py
+        indexes = [models.Index(fields=['status', 'appointment_date', 'appointment_time'])]
+
+class RatingManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        # One counter round trip for the whole batch
+        objs = list(objs)
+        new = [obj for obj in objs if obj.id is None]
+        for obj, new_id in zip(new, rating_ids.take(len(new))):
+            obj.id = new_id
+        return super().bulk_create(objs, *args, **kwargs)
 
 class Rating(models.Model):
     RATING_CHOICES = [
@@ -53,6 +68,16 @@ class Rating(models.Model):
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = RatingManager()
+    
+    def save(self, *args, **kwargs):
+        # Djongo can't auto-increment this manual primary key, so take the
+        # next id from the atomic counter (see bookings/ids.py)
+        if self.id is None:
+            self.id = rating_ids.next_id()
+            kwargs.setdefault('force_insert', True)
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         if self.rating_type == 'overall':
             return f"{self.customer_name} - Overall Rating: {self.rating} stars"
@@ -105,6 +130,7 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=3)  # BHD format
     image_url = models.CharField(max_length=500, blank=True, help_text="Path to image in static folder (e.g., 'images/products/oil.jpg')")
+    # Opening stock only; live stock is kept in the StockMovement ledger
     stock_quantity = models.IntegerField(default=0)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -115,15 +141,17 @@ class Product(models.Model):
 class Cart(models.Model):
     """Shopping cart for customers"""
     session_id = models.CharField(max_length=255, unique=True)
+    # Moved with every item change (add_items), so the nav badge and
+    # add-to-cart never load the items. The cart page corrects any drift
+    # from price changes.
+    item_count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=10, decimal_places=3, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
-    def get_total(self):
-        total = sum(item.get_subtotal() for item in self.items.all())
-        return round(total, 3)  # Round to 3 decimal places for BHD
-    
-    def get_item_count(self):
-        return sum(item.quantity for item in self.items.all())
+    def add_items(self, quantity, price):
+        """Atomically count `quantity` more units (or fewer, if negative) at `price`"""
+        increment(Cart, self.pk, item_count=quantity, total=price * quantity)
 
 class CartItem(models.Model):
     """Items in shopping cart"""
@@ -139,8 +167,8 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.quantity}x {self.product.name}"
 
-class Order(models.Model):
-    """Customer orders"""
+class BaseOrder(models.Model):
+    """Fields of an order, shared by live and archived orders"""
     PAYMENT_METHOD_CHOICES = [
         ('cash', 'Cash on Delivery'),
         ('card', 'Card on Delivery'),
@@ -192,10 +220,18 @@ class Order(models.Model):
         if self.flat_number:
             address_parts.insert(1, f"Flat {self.flat_number}")
         return ", ".join(address_parts)
+    
+    class Meta:
+        abstract = True
 
-class OrderItem(models.Model):
-    """Items in an order"""
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+class Order(BaseOrder):
+    """Customer orders"""
+    class Meta:
+        # Used by `manage.py archive_orders`
+        indexes = [models.Index(fields=['status', 'updated_at'])]
+
+class BaseOrderItem(models.Model):
+    """Fields of an order line, shared by live and archived orders"""
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     product_name = models.CharField(max_length=200)
     quantity = models.IntegerField()
@@ -206,7 +242,193 @@ class OrderItem(models.Model):
         return float(self.price) * self.quantity
     
     def __str__(self):
-        return f"{self.quantity}x {self.product_name}"    
+        return f"{self.quantity}x {self.product_name}"
+    
+    class Meta:
+        abstract = True
+
+class OrderItem(BaseOrderItem):
+    """Items in an order"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+
+class ArchivedOrder(BaseOrder):
+    """Delivered or cancelled order moved out of Order (see bookings/archive.py)"""
+    id = models.IntegerField(primary_key=True)  # Same id as the original Order
+    # Copied from the order, not reset when archiving
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+class ArchivedOrderItem(BaseOrderItem):
+    """Items of an archived order"""
+    id = models.IntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+
+class BlockAdjacency(models.Model):
+    """Two blocks that border each other, used to order delivery stops (see bookings/dispatch.py)"""
+    block = models.CharField(max_length=50)
+    adjacent_block = models.CharField(max_length=50)
+    
+    class Meta:
+        unique_together = [('block', 'adjacent_block')]
+        verbose_name_plural = "Block adjacencies"
+    
+    def __str__(self):
+        return f"Block {self.block} - Block {self.adjacent_block}"
+
+
+
+
+class Job(models.Model):
+    """Background job, run by `manage.py run_worker` (see bookings/jobs.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')  # JSON
+    # Enqueueing the same key twice is a no-op, so hooks can fire safely again
+    idempotency_key = models.CharField(max_length=200, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+    
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+class DailySales(models.Model):
+    """Order totals per day, area and payment method (see bookings/rollups.py)"""
+    date = models.DateField()
+    area = models.CharField(max_length=100)
+    payment_method = models.CharField(max_length=20)
+    order_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    
+    class Meta:
+        unique_together = [('date', 'area', 'payment_method')]
+        verbose_name_plural = "Daily sales"
+    
+    def __str__(self):
+        return f"{self.date} {self.area} ({self.payment_method})"
+
+class DailyProductSales(models.Model):
+    """Units and revenue per day and product (see bookings/rollups.py)"""
+    date = models.DateField()
+    product_name = models.CharField(max_length=200)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    
+    class Meta:
+        unique_together = [('date', 'product_name')]
+        verbose_name_plural = "Daily product sales"
+    
+    def __str__(self):
+        return f"{self.date} {self.product_name}"
+
+class RollupRebuild(models.Model):
+    """A running `manage.py rebuild_rollups` (see bookings/rollups.py)"""
+    started_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Rollup rebuild started {self.started_at}"
 
+class RollupChange(models.Model):
+    """Rollup change held back while a rebuild runs (see bookings/rollups.py)"""
+    order_id = models.IntegerField()
+    changes = models.TextField()  # JSON
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Rollup change for order {self.order_id}"
 
+class ProductRecommendations(models.Model):
+    """Top products bought together with a product (see bookings/recommendations.py)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='recommendations')
+    neighbours = models.TextField(default='[]')  # JSON [[product_id, count], ...], best first
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Product recommendations"
+    
+    def get_neighbours(self):
+        return json.loads(self.neighbours)
+    
+    def __str__(self):
+        return f"Recommendations for {self.product.name}"
 
+class ProductPair(models.Model):
+    """Orders that had both products, stored both ways round (see bookings/recommendations.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other_id = models.IntegerField()
+    order_count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = [('product', 'other_id')]
+    
+    def __str__(self):
+        return f"{self.product_id} with {self.other_id}: {self.order_count}"
+
+def movement_key():
+    return uuid.uuid4().hex
+
+class StockMovement(models.Model):
+    """Append-only stock change, +in/-out (see bookings/inventory.py)"""
+    KIND_CHOICES = [
+        ('restock', 'Restock'),
+        ('adjustment', 'Adjustment'),
+        ('sale', 'Sale'),
+        ('reservation', 'Reservation'),
+        ('release', 'Reservation released'),
+        ('expiry', 'Reservation expired'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    # Unique, so a sale or a release can never be recorded twice
+    key = models.CharField(max_length=100, unique=True, default=movement_key)
+    reference = models.CharField(max_length=100, blank=True)  # cart key or order number
+    expires_at = models.DateTimeField(null=True, blank=True)  # reservations only
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['reference', 'kind']),
+            models.Index(fields=['kind', 'expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} {self.product.name}"
+
+class StockSnapshot(models.Model):
+    """Stock level of a product summed up to a movement id"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='stock_snapshot')
+    quantity = models.IntegerField(default=0)
+    last_movement_id = models.IntegerField(default=0)
+    taken_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.product.name}: {self.quantity} at #{self.last_movement_id}"
+
+class SchedulerMark(models.Model):
+    """How far a `manage.py run_scheduler` task has got (see bookings/scheduler.py)"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} up to {self.position}"
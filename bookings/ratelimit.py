@@ -0,0 +1,111 @@
+"""Token-bucket rate limits for the endpoints that write.
+
+settings.RATE_LIMITS maps URL names to rules. Each client gets a bucket of
+`burst` tokens per URL name that refills at `per_minute`; every POST takes
+one, and a POST finding the bucket empty gets a 429 with Retry-After
+(bookings.middleware.RateLimitMiddleware). Clients are told apart by `key`:
+
+- 'ip': the client address (settings.RATE_LIMIT_IP_META)
+- 'session': the session, or the address without one
+- 'user': the signed-in user, or the address for anonymous visitors
+
+Buckets live in the settings.RATE_LIMIT_CACHE cache, so every worker
+process shares them: memcached by default, or MongoDB (bookings/cache.py).
+A cache can't update a bucket's tokens and time in one atomic step, so each
+bucket is kept as counts of the tokens taken per refill period (the time
+`burst` tokens take to refill). The previous period's count fades out over
+the current one, which gives the same limits as a bucket refilling
+continuously. MongoCache counts with one findAndModify; other caches use
+incr() and get(), with an add() once a period.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+def refill_seconds(per_minute, burst):
+    """Time a bucket takes to refill from empty"""
+    return burst * 60 / per_minute
+
+
+def count(cache, key, index, timeout):
+    """Count a token taken in period `index`: (taken in it, taken in the one before)"""
+    if hasattr(cache, 'incr_window'):
+        # One round trip (bookings/cache.py)
+        return cache.incr_window(key, index, timeout)
+    current_key = f'{key}:{index}'
+    try:
+        taken = cache.incr(current_key)
+    except ValueError:
+        # First token of the period
+        if cache.add(current_key, 1, timeout=timeout):
+            taken = 1
+        else:
+            try:
+                taken = cache.incr(current_key)
+            except ValueError:
+                # Neither took: the cache is down, so don't refuse everyone
+                logger.warning('Rate-limit cache is not counting %s', key)
+                taken = 0
+    return taken, cache.get(f'{key}:{index - 1}', 0)
+
+
+def uncount(cache, key, index):
+    """Give back a token counted in period `index`"""
+    if hasattr(cache, 'decr_window'):
+        cache.decr_window(key, index)
+    else:
+        try:
+            cache.decr(f'{key}:{index}')
+        except ValueError:
+            pass
+
+
+def take(cache, key, per_minute, burst):
+    """Take a token: 0 if one was available, else seconds until one is"""
+    period = refill_seconds(per_minute, burst)
+    now = time.time()
+    index = int(now // period)
+    elapsed = now - index * period
+    # The count must outlive the next period
+    taken, previous = count(cache, key, index, int(2 * period) + 1)
+    fading = previous * (1 - elapsed / period)
+    if fading + taken <= burst:
+        return 0
+
+    # A refused request takes no token
+    uncount(cache, key, index)
+    taken -= 1
+    if taken < burst:
+        # Once enough of the previous period has faded
+        return period * (1 - (burst - taken - 1) / previous) - elapsed
+    # Once enough of this period has faded, in the next one
+    return period - elapsed + period * (1 - (burst - 1) / taken)
+
+
+def client_ip(request):
+    # Behind a proxy the last X-Forwarded-For entry is the one it added
+    forwarded = request.META.get(settings.RATE_LIMIT_IP_META, '')
+    return forwarded.split(',')[-1].strip() or request.META.get('REMOTE_ADDR', '')
+
+
+def client_key(request, key):
+    if key == 'session':
+        # Loading the session (the views load it anyway) leaves a made-up
+        # cookie empty, so inventing cookies doesn't earn fresh buckets
+        if request.session.keys():
+            return f'session:{request.session.session_key}'
+    elif key == 'user':
+        if request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def check(request, url_name, rule):
+    """Seconds the client has to wait before this request, or 0"""
+    key = f"ratelimit:{url_name}:{client_key(request, rule.get('key', 'ip'))}"
+    return take(caches[settings.RATE_LIMIT_CACHE], key, rule['per_minute'], rule['burst'])
@@ -0,0 +1,123 @@
+"""'Frequently bought together' from OrderItem co-occurrence.
+
+`manage.py build_recommendations` counts how often each pair of products
+shares an order (ProductPair) and keeps the top-K neighbours of every
+product in one ProductRecommendations row, so pages need one indexed query.
+New orders are folded in by a background job: it adds to the pair counts
+with atomic increments, so concurrent jobs don't lose each other's orders,
+then recomputes the top-K lists of the products in the order.
+"""
+import heapq
+import json
+from collections import Counter, defaultdict
+from itertools import combinations, permutations
+
+from django.db import DatabaseError
+
+from .db import increment
+from .models import ArchivedOrderItem, OrderItem, Product, ProductPair, ProductRecommendations
+
+TOP_K = 10
+
+
+def count_pairs(baskets):
+    """Co-occurrence counts per product: {product_id: Counter(other_id)}"""
+    pair_counts = Counter()
+    for basket in baskets:
+        # Sorted so (a, b) and (b, a) are one key
+        pair_counts.update(combinations(sorted(basket), 2))
+
+    neighbours = defaultdict(Counter)
+    for (a, b), count in pair_counts.items():
+        neighbours[a][b] = count
+        neighbours[b][a] = count
+    return neighbours
+
+
+def prune(counter, k=TOP_K):
+    """Top-k [product_id, count] pairs, ties broken by lower product id"""
+    top = heapq.nsmallest(k, counter.items(), key=lambda item: (-item[1], item[0]))
+    return [[product_id, count] for product_id, count in top]
+
+
+def load_baskets():
+    """Stream live and archived order lines into {order_id: set(product_id)}"""
+    baskets = defaultdict(set)
+    # Archived orders keep their ids, so both tables share one id space
+    for model in (OrderItem, ArchivedOrderItem):
+        lines = model.objects.filter(product__isnull=False).values_list('order_id', 'product_id')
+        for order_id, product_id in lines.iterator():
+            baskets[order_id].add(product_id)
+    return baskets
+
+
+def rebuild(k=TOP_K):
+    baskets = load_baskets()
+    neighbours = count_pairs(basket for basket in baskets.values() if len(basket) > 1)
+
+    ProductPair.objects.all().delete()
+    ProductPair.objects.bulk_create([
+        ProductPair(product_id=product_id, other_id=other_id, order_count=count)
+        for product_id, counter in neighbours.items()
+        for other_id, count in counter.items()
+    ], batch_size=1000)
+    ProductRecommendations.objects.all().delete()
+    ProductRecommendations.objects.bulk_create([
+        ProductRecommendations(product_id=product_id, neighbours=json.dumps(prune(counter, k)))
+        for product_id, counter in neighbours.items()
+    ], batch_size=1000)
+    return len(baskets), len(neighbours)
+
+
+def _get_or_create(model, **key):
+    try:
+        row, created = model.objects.get_or_create(**key)
+    except DatabaseError:
+        # Lost a race to create the same row; it exists now
+        row = model.objects.get(**key)
+    return row
+
+
+def add_basket(product_ids, k=TOP_K):
+    """Fold one new order into the pair counts and the stored top-K lists"""
+    product_ids = set(product_ids)
+    if len(product_ids) < 2:
+        return
+    for product_id, other_id in permutations(product_ids, 2):
+        pair = _get_or_create(ProductPair, product_id=product_id, other_id=other_id)
+        increment(ProductPair, pair.pk, order_count=1)
+
+    for product_id in product_ids:
+        top = ProductPair.objects.filter(product_id=product_id).order_by(
+            '-order_count', 'other_id'
+        ).values_list('other_id', 'order_count')[:k]
+        row = _get_or_create(ProductRecommendations, product_id=product_id)
+        ProductRecommendations.objects.filter(pk=row.pk).update(
+            neighbours=json.dumps([list(pair) for pair in top])
+        )
+
+
+def recommend(product_ids, limit=4):
+    """Available products most often bought with any of `product_ids`"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return []
+    scores = Counter()
+    for row in ProductRecommendations.objects.filter(product_id__in=product_ids):
+        for other_id, count in row.get_neighbours():
+            if other_id not in product_ids:
+                scores[other_id] += count
+    if not scores:
+        return []
+
+    candidates = [product_id for product_id, score in scores.most_common(limit * 2)]
+    products = {p.id: p for p in Product.objects.filter(id__in=candidates) if p.is_available}
+    return [products[product_id] for product_id in candidates if product_id in products][:limit]
+
+
+def neighbour_map(product_ids):
+    """{product_id: [neighbour ids]} for a page of products, one query"""
+    return {
+        row.product_id: [other_id for other_id, count in row.get_neighbours()]
+        for row in ProductRecommendations.objects.filter(product_id__in=product_ids)
+    }
@@ -0,0 +1,314 @@
+"""Incrementally maintained daily sales aggregates.
+
+Every non-cancelled order adds to one DailySales row (date/area/payment
+method) and one DailyProductSales row per item. The signal handlers below
+keep them in step with Order and OrderItem, wherever the rows are written
+(checkout, admin, shell): orders and items being created or deleted, and
+orders moving into or out of 'cancelled'. Orders moved to the archive still
+count. Editing other fields of a counted order needs a rebuild.
+
+rebuild() (`manage.py rebuild_rollups`) recomputes everything from the
+order history. While it runs, live changes are held as RollupChange rows
+instead of being applied, so it never overwrites them; at the end it
+applies the held changes its pass had not already seen.
+"""
+import contextvars
+import json
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .db import increment, price_to_float, update
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyProductSales, DailySales, Order, OrderItem,
+    RollupChange, RollupRebuild,
+)
+
+# Orders in these states don't count as sales
+EXCLUDED_STATUSES = {'cancelled'}
+
+ROLLUP_MODELS = {'sales': DailySales, 'products': DailyProductSales}
+
+# True while orders are deleted because they moved to the archive
+_untracked = contextvars.ContextVar('rollups_untracked', default=False)
+
+
+def to_decimal(value):
+    return Decimal(str(round(price_to_float(value), 3)))
+
+
+def local_day(value):
+    # pymongo hands back naive UTC datetimes
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return timezone.localdate(value)
+
+
+def is_counted(status):
+    return status not in EXCLUDED_STATUSES
+
+
+@contextmanager
+def untracked():
+    """Deleting orders and items inside this block leaves the rollups alone"""
+    token = _untracked.set(True)
+    try:
+        yield
+    finally:
+        _untracked.reset(token)
+
+
+def _get_row(model, **key):
+    try:
+        row, created = model.objects.get_or_create(**key)
+    except DatabaseError:
+        # Lost a race to create the same row; it exists now
+        row = model.objects.get(**key)
+    return row
+
+
+# A change is a JSON-friendly dict: the rollup model, the key of its row
+# and the amounts to add to it
+
+def order_changes(order, sign):
+    """The order's own count and revenue"""
+    return [{
+        'model': 'sales',
+        'key': {
+            'date': local_day(order.created_at).isoformat(),
+            'area': order.area,
+            'payment_method': order.payment_method,
+        },
+        'deltas': {'order_count': sign, 'revenue': str(sign * to_decimal(order.total_amount))},
+    }]
+
+
+def item_changes(order, items, sign):
+    day = local_day(order.created_at).isoformat()
+    return [{
+        'model': 'products',
+        'key': {'date': day, 'product_name': item.product_name},
+        'product_id': item.product_id,
+        'deltas': {
+            'quantity': sign * item.quantity,
+            'revenue': str(sign * to_decimal(item.price) * item.quantity),
+        },
+    } for item in items]
+
+
+def apply_changes(changes):
+    for change in changes:
+        model = ROLLUP_MODELS[change['model']]
+        row = _get_row(model, **change['key'])
+        product_id = change.get('product_id')
+        if product_id is not None and row.product_id is None:
+            model.objects.filter(pk=row.pk).update(product_id=product_id)
+        increment(model, row.pk, **{
+            name: Decimal(value) if isinstance(value, str) else value
+            for name, value in change['deltas'].items()
+        })
+
+
+def rebuilding():
+    return RollupRebuild.objects.exists()
+
+
+def claim(change_id):
+    """Delete a held change, True for the one caller that did"""
+    deleted, per_model = RollupChange.objects.filter(pk=change_id).delete()
+    return deleted > 0
+
+
+def record(order_id, changes):
+    """Apply changes to the rollups, or hold them while a rebuild runs"""
+    if not changes:
+        return
+    if not rebuilding():
+        apply_changes(changes)
+        return
+    held = RollupChange.objects.create(order_id=order_id, changes=json.dumps(changes))
+    # If the rebuild finished meanwhile it may have missed this one
+    if not rebuilding() and claim(held.pk):
+        apply_changes(changes)
+
+
+def apply_order(order, sign, items=None):
+    """Add (sign=1) or remove (sign=-1) an order's contribution"""
+    if items is None:
+        items = list(order.items.all())
+    record(order.pk, order_changes(order, sign) + item_changes(order, items, sign))
+
+
+def set_status(queryset, status):
+    """queryset.update(status=...), keeping the rollups right.
+
+    update() skips the signals below, so orders moving into or out of
+    'cancelled' are loaded and applied here; the update itself is one query.
+    """
+    counted = is_counted(status)
+    if counted:
+        flipped = list(queryset.filter(status__in=EXCLUDED_STATUSES))
+    else:
+        flipped = list(queryset.exclude(status__in=EXCLUDED_STATUSES))
+    updated = update(queryset, status=status, updated_at=timezone.now())
+    for order in flipped:
+        apply_order(order, 1 if counted else -1)
+    return updated
+
+
+@receiver(post_init, sender=Order)
+def remember_status(sender, instance, **kwargs):
+    instance._rollup_status = instance.status
+
+
+@receiver(post_save, sender=Order)
+def update_rollups_on_order_save(sender, instance, created, **kwargs):
+    if created:
+        # Its items add themselves as they are saved
+        if is_counted(instance.status):
+            record(instance.pk, order_changes(instance, 1))
+    elif is_counted(instance._rollup_status) != is_counted(instance.status):
+        apply_order(instance, 1 if is_counted(instance.status) else -1)
+    instance._rollup_status = instance.status
+
+
+@receiver(post_delete, sender=Order)
+def update_rollups_on_order_delete(sender, instance, **kwargs):
+    # Its items were deleted first and took themselves off
+    if not _untracked.get() and is_counted(instance._rollup_status):
+        record(instance.pk, order_changes(instance, -1))
+
+
+@receiver(post_save, sender=OrderItem)
+def update_rollups_on_item_save(sender, instance, created, **kwargs):
+    if created and is_counted(instance.order.status):
+        record(instance.order_id, item_changes(instance.order, [instance], 1))
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_rollups_on_item_delete(sender, instance, **kwargs):
+    if _untracked.get():
+        return
+    order = Order.objects.filter(pk=instance.order_id).first()
+    if order is not None and is_counted(order.status):
+        record(order.pk, item_changes(order, [instance], -1))
+
+
+class Pass:
+    """Which held changes a rebuild's pass over Order had already seen.
+
+    Orders are read in pk chunks, then their items. A change is held only
+    after its row was saved, so one held before the chunk holding its order
+    was read is in the count. Changes only to items go by when the items
+    were read, the rest by when the orders were.
+    """
+    def __init__(self):
+        self.last_pks = []
+        self.positions = []
+
+    def add_chunk(self, last_pk, order_position, item_position):
+        self.last_pks.append(last_pk)
+        self.positions.append((order_position, item_position))
+
+    def saw(self, order_id, change_id, changes):
+        chunk = bisect_left(self.last_pks, order_id)
+        if chunk == len(self.last_pks):
+            return False
+        order_position, item_position = self.positions[chunk]
+        items_only = all(change['model'] == 'products' for change in changes)
+        return change_id <= (item_position if items_only else order_position)
+
+
+def held_position():
+    return RollupChange.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+def count_history(chunk_size):
+    """Aggregate every counted order and item, `chunk_size` orders at a time"""
+    sales = defaultdict(lambda: [0, Decimal(0)])
+    products = defaultdict(lambda: [None, 0, Decimal(0)])
+    order_pass = Pass()
+    orders_counted = 0
+    # Archived orders keep their ids, so live and archived rows never clash
+    for model, item_model in ((ArchivedOrder, ArchivedOrderItem), (Order, OrderItem)):
+        last_pk = 0
+        while True:
+            order_position = held_position()
+            orders = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'created_at', 'area', 'payment_method', 'status', 'total_amount'
+            )[:chunk_size])
+            if not orders:
+                break
+            days = {}
+            for pk, created_at, area, payment_method, status, total in orders:
+                if not is_counted(status):
+                    continue
+                day = days[pk] = local_day(created_at)
+                row = sales[(day, area, payment_method)]
+                row[0] += 1
+                row[1] += to_decimal(total)
+
+            item_position = held_position()
+            items = item_model.objects.filter(order_id__in=list(days)).values_list(
+                'order_id', 'product_id', 'product_name', 'quantity', 'price'
+            )
+            for order_id, product_id, product_name, quantity, price in items:
+                row = products[(days[order_id], product_name)]
+                row[0] = row[0] or product_id
+                row[1] += quantity
+                row[2] += to_decimal(price) * quantity
+
+            last_pk = orders[-1][0]
+            orders_counted += len(days)
+            if model is Order:
+                order_pass.add_chunk(last_pk, order_position, item_position)
+    return sales, products, order_pass, orders_counted
+
+
+def settle_held(order_pass):
+    """Apply the held changes the pass didn't see, drop those it did"""
+    for change in list(RollupChange.objects.order_by('pk')):
+        changes = json.loads(change.changes)
+        if claim(change.pk) and not order_pass.saw(change.order_id, change.pk, changes):
+            apply_changes(changes)
+
+
+def rebuild(chunk_size=1000, force=False):
+    """Recompute the rollups from the order history.
+
+    Returns (orders counted, DailySales rows, DailyProductSales rows).
+    Another rebuild must not be running; `force` clears the mark left by
+    one that was interrupted.
+    """
+    if rebuilding():
+        if not force:
+            raise RuntimeError('A rollup rebuild is already running')
+        RollupRebuild.objects.all().delete()
+    mark = RollupRebuild.objects.create()
+    try:
+        sales, products, order_pass, orders_counted = count_history(chunk_size)
+        DailySales.objects.all().delete()
+        DailyProductSales.objects.all().delete()
+        DailySales.objects.bulk_create([
+            DailySales(date=day, area=area, payment_method=payment_method,
+                       order_count=count, revenue=revenue)
+            for (day, area, payment_method), (count, revenue) in sales.items()
+        ], batch_size=1000)
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(date=day, product_name=product_name, product_id=product_id,
+                              quantity=quantity, revenue=revenue)
+            for (day, product_name), (product_id, quantity, revenue) in products.items()
+        ], batch_size=1000)
+        settle_held(order_pass)
+    finally:
+        mark.delete()
+    # Writers that saw the mark just before it went apply their own change
+    # unless this gets to it first
+    settle_held(order_pass)
+    return orders_counted, len(sales), len(products)
@@ -0,0 +1,143 @@
+"""Time-driven appointment tasks, run by `manage.py run_scheduler`.
+
+- Reminders: a reminder job is queued for every pending or confirmed
+  appointment once it is APPOINTMENT_REMINDER_HOURS away. Appointments
+  booked closer than that only get the booking confirmation.
+- Stale bookings: appointments still pending APPOINTMENT_PENDING_GRACE_HOURS
+  after their start time were never confirmed and are cancelled.
+
+Each task keeps a high-water mark (SchedulerMark) of the appointment time
+it has handled up to. A tick only asks for appointments between the mark
+and the task's horizon, on the (status, appointment_date,
+appointment_time) index, so its cost follows the number of appointments
+due rather than the size of the collection. The mark moves only after a
+window is done, so a crashed tick is simply redone: reminder jobs are
+keyed per appointment and cancelling only touches pending rows. The same
+goes for a second scheduler running by mistake; the one whose mark move
+loses logs a warning.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+
+from . import events, jobs
+from .models import Appointment, SchedulerMark
+
+logger = logging.getLogger(__name__)
+
+REMIND_STATUSES = ['pending', 'confirmed']
+
+
+def local_now():
+    # Appointment dates and times are naive local wall-clock values
+    return timezone.localtime().replace(tzinfo=None, microsecond=0)
+
+
+def between(after, until):
+    """Appointments starting after `after` (if set) up to and including `until`"""
+    # The plain date bounds are what the index seeks on; the rest trims the
+    # first and last day to the exact time
+    window = Q(appointment_date__lte=until.date()) & (
+        Q(appointment_date__lt=until.date())
+        | Q(appointment_date=until.date(), appointment_time__lte=until.time())
+    )
+    if after is not None:
+        window &= Q(appointment_date__gte=after.date()) & (
+            Q(appointment_date__gt=after.date())
+            | Q(appointment_date=after.date(), appointment_time__gt=after.time())
+        )
+    return window
+
+
+def due(statuses, after, until):
+    """(id, user id) of appointments in the window, oldest first"""
+    return list(
+        Appointment.objects.filter(status__in=statuses).filter(between(after, until))
+        .order_by('appointment_date', 'appointment_time', 'pk')
+        .values_list('pk', 'user_id')
+    )
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def get_mark(name):
+    mark = SchedulerMark.objects.filter(name=name).first()
+    return timezone.localtime(mark.position).replace(tzinfo=None) if mark else None
+
+
+def set_mark(name, old, new):
+    """Move the mark from `old` to `new`, unless another run already moved it.
+
+    Returns whether it moved.
+    """
+    position = timezone.make_aware(new)
+    if old is None:
+        try:
+            SchedulerMark.objects.create(name=name, position=position)
+            return True
+        except DatabaseError:  # Another run created it first
+            return False
+    return bool(SchedulerMark.objects.filter(
+        name=name, position=timezone.make_aware(old)
+    ).update(position=position, updated_at=timezone.now()))
+
+
+def warn_moved(name):
+    # Its window was redone here, harmlessly; the mark stays where the other run put it
+    logger.warning('The %s mark was moved by another run; is more than one scheduler running?', name)
+
+
+def send_reminders(now, batch_size):
+    """Queue reminders for appointments that came within the lead time"""
+    mark = get_mark('reminders')
+    until = now + timedelta(hours=settings.APPOINTMENT_REMINDER_HOURS)
+    # First run: don't remind about everything booked so far
+    after = mark if mark is not None else now
+    if until <= after:
+        return 0
+
+    appointments = due(REMIND_STATUSES, after, until)
+    for batch in batches(appointments, batch_size):
+        jobs.enqueue_many('send_appointment_reminder', [
+            ({'appointment_id': pk}, f'send_appointment_reminder:{pk}') for pk, user_id in batch
+        ])
+    if not set_mark('reminders', mark, until):
+        warn_moved('reminders')
+    return len(appointments)
+
+
+def cancel_stale(now, batch_size):
+    """Cancel appointments never confirmed by the end of the grace period"""
+    mark = get_mark('stale_pending')
+    until = now - timedelta(hours=settings.APPOINTMENT_PENDING_GRACE_HOURS)
+    # First run: no lower bound, so the backlog is cleared once
+    if mark is not None and until <= mark:
+        return 0
+
+    appointments = due(['pending'], mark, until)
+    cancelled = 0
+    for batch in batches(appointments, batch_size):
+        pks = [pk for pk, user_id in batch]
+        cancelled += Appointment.objects.filter(pk__in=pks, status='pending').update(status='cancelled')
+        # update() skips post_save, so the live status pages are told here,
+        # leaving out any confirmed since they were read
+        events.appointments_changed(
+            Appointment.objects.filter(pk__in=pks, status='cancelled').values_list('pk', 'user_id'),
+            'cancelled',
+        )
+    if not set_mark('stale_pending', mark, until):
+        warn_moved('stale_pending')
+    return cancelled
+
+
+def tick(batch_size=500):
+    """Run every task once, returns (reminders queued, appointments cancelled)"""
+    now = local_now()
+    return send_reminders(now, batch_size), cancel_stale(now, batch_size)
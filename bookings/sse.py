@@ -0,0 +1,150 @@
+"""Server-Sent Events for live order and appointment status.
+
+Django 3.1 only streams responses from sync iterators, which would hold a
+thread for every open connection. These endpoints are plain ASGI handlers
+in front of Django instead (see car_polishing_site/asgi.py): an idle client
+costs a coroutine and a small queue, with no thread or database connection.
+
+    /events/order/<order number>/   one order (same access as its page)
+    /events/appointments/           the signed-in user's appointments
+
+Each stream starts with the current status, so nothing published between
+rendering the page and connecting is missed, then sends changes as they
+are published by bookings/events.py.
+"""
+import asyncio
+import json
+import re
+from importlib import import_module
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+
+from . import archive, events
+from .async_views import run_in_db_thread
+from .models import Appointment
+
+ORDER_PATH_RE = re.compile(r'^/events/order/([\w-]+)/$')
+APPOINTMENTS_PATH = '/events/appointments/'
+
+# Tells the browser how soon to reconnect after the connection drops
+RETRY_MS = 5000
+
+
+def encode(data):
+    return f'data: {json.dumps(data)}\n\n'.encode()
+
+
+async def respond(send, status, body=b''):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def forward(subscription, send):
+    """Send published events, and a comment line when idle so proxies keep
+    the connection open and dead clients are noticed"""
+    while True:
+        try:
+            data = await asyncio.wait_for(subscription.get(), settings.SSE_HEARTBEAT_SECONDS)
+            chunk = encode(data)
+        except asyncio.TimeoutError:
+            chunk = b': ping\n\n'
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+
+async def stream(receive, send, channel, current):
+    """Stream `channel` until the client disconnects.
+
+    `current` is a sync callable returning the events to start with, or None
+    for a 404. It runs after subscribing, so a change made meanwhile is sent
+    rather than lost.
+    """
+    broker = events.get_broker()
+    subscription = broker.subscribe(channel)
+    try:
+        initial = await run_in_db_thread(current)()
+        if initial is None:
+            return await respond(send, 404, b'Not found')
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),  # nginx: don't buffer the stream
+            ],
+        })
+        body = f'retry: {RETRY_MS}\n\n'.encode() + b''.join(encode(data) for data in initial)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        pump = asyncio.ensure_future(forward(subscription, send))
+        try:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        finally:
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def current_order(order_number):
+    order = archive.find_order(order_number)
+    return [events.order_status(order.order_number, order.status)] if order else None
+
+
+def request_user(scope):
+    """The signed-in user for an ASGI scope, as the auth middleware finds it"""
+    request = ASGIRequest(scope, BytesIO())
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    return get_user(request)
+
+
+def current_appointments(user_id):
+    appointments = Appointment.objects.filter(user_id=user_id).values_list('pk', 'status')
+    return [events.appointment_status(pk, status) for pk, status in appointments]
+
+
+async def handle(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await respond(send, 405, b'Method not allowed')
+    try:
+        ASGIRequest(scope, BytesIO()).get_host()
+    except DisallowedHost:
+        return await respond(send, 400, b'Bad request')
+
+    match = ORDER_PATH_RE.match(scope['path'])
+    if match:
+        order_number = match.group(1)
+        return await stream(
+            receive, send, events.order_channel(order_number),
+            lambda: current_order(order_number),
+        )
+
+    user = await run_in_db_thread(request_user)(scope)
+    if not user.is_authenticated:
+        return await respond(send, 403, b'Sign in to follow your appointments')
+    return await stream(
+        receive, send, events.appointments_channel(user.pk),
+        lambda: current_appointments(user.pk),
+    )
+
+
+def with_event_streams(application):
+    """Wrap Django's ASGI application, serving the event streams itself"""
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and (
+            scope['path'] == APPOINTMENTS_PATH or ORDER_PATH_RE.match(scope['path'])
+        ):
+            return await handle(scope, receive, send)
+        return await application(scope, receive, send)
+    return app
@@ -0,0 +1,35 @@
+import logging
+
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+logger = logging.getLogger(__name__)
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Content-hashed static file names so browsers can cache them forever,
+    with precompressed .gz (and .br, if Brotli is installed) siblings.
+
+    Product.image_url is typed into the admin, so a path that was never
+    collected falls back to its plain name instead of raising a 500. That is
+    logged as an error, once per name, and once for all of them when there
+    is no manifest because collectstatic hasn't run.
+    """
+    manifest_strict = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._logged = set()
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if not self.hashed_files:
+                if not self._logged:
+                    self._logged.add(None)
+                    logger.error('No static files manifest in %s: run collectstatic. '
+                                 'Serving static files unhashed', self.location)
+            elif name not in self._logged:
+                self._logged.add(name)
+                logger.error('Static file %r was not collected, serving it unhashed', name)
+            return name
@@ -0,0 +1,65 @@
+"""Side effects of orders and appointments, run by the background worker"""
+from django.core.mail import send_mail
+
+from . import inventory, recommendations
+from .jobs import job
+from .models import Appointment, Order, OrderItem
+
+
+@job('send_order_confirmation', on='order_placed')
+def send_order_confirmation(payload):
+    order = Order.objects.get(pk=payload['order_id'])
+    if not order.customer_email:
+        return
+    send_mail(
+        f'Khalifa Polish - Order {order.order_number} confirmed',
+        f'Hi {order.customer_name},\n\n'
+        f'Thank you for your order {order.order_number}. '
+        f'We will deliver it to {order.get_full_address()}.\n',
+        None,
+        [order.customer_email],
+    )
+
+
+@job('send_appointment_confirmation', on='appointment_booked')
+def send_appointment_confirmation(payload):
+    appointment = Appointment.objects.select_related('user', 'service').get(pk=payload['appointment_id'])
+    if not appointment.user.email:
+        return
+    send_mail(
+        f'Khalifa Polish - {appointment.service.name} booked',
+        f'Hi {appointment.user.username},\n\n'
+        f'Your {appointment.service.name} appointment on {appointment.appointment_date} '
+        f'at {appointment.appointment_time} has been received.\n',
+        None,
+        [appointment.user.email],
+    )
+
+
+@job('send_appointment_reminder')
+def send_appointment_reminder(payload):
+    appointment = Appointment.objects.select_related('user', 'service').get(pk=payload['appointment_id'])
+    # Cancelled since the scheduler queued this
+    if appointment.status not in ('pending', 'confirmed') or not appointment.user.email:
+        return
+    send_mail(
+        f'Khalifa Polish - Reminder: {appointment.service.name}',
+        f'Hi {appointment.user.username},\n\n'
+        f'This is a reminder of your {appointment.service.name} appointment on '
+        f'{appointment.appointment_date} at {appointment.appointment_time}.\n',
+        None,
+        [appointment.user.email],
+    )
+
+
+@job('update_recommendations', on='order_placed')
+def update_recommendations(payload):
+    product_ids = OrderItem.objects.filter(
+        order_id=payload['order_id'], product__isnull=False
+    ).values_list('product_id', flat=True)
+    recommendations.add_basket(product_ids)
+
+
+@job('expire_stock_reservations')
+def expire_stock_reservations(payload):
+    inventory.expire(payload['reservation_ids'])
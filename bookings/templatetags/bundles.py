@@ -0,0 +1,62 @@
+import re
+
+from django import template
+from django.conf import settings
+from django.template.base import TextNode
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from bookings.bundles import bundle_path, content_digest, load_bundles
+
+register = template.Library()
+
+ELEMENT_RE = re.compile(r'^\s*<(style|script)>(.*)</\1>\s*$', re.S)
+ELEMENT_FOR_SUFFIX = {'.css': 'style', '.js': 'script'}
+
+
+class BundleNode(template.Node):
+    def __init__(self, name, inline, source):
+        self.name = name
+        self.inline = inline
+        self.source = source
+        self.digest = content_digest(source)
+
+    def render(self, context):
+        # Serve the static file only outside development (DEBUG) and only if
+        # it was built from this exact source, otherwise (not built yet, or
+        # template edited since) stay inline.
+        if settings.DEBUG or load_bundles().get(self.name) != self.digest:
+            return self.inline
+        url = static(bundle_path(self.name))
+        if self.name.endswith('.css'):
+            return format_html('<link rel="stylesheet" href="{}">', url)
+        return format_html('<script src="{}"></script>', url)
+
+
+@register.tag
+def bundle(parser, token):
+    """Move an inline <style> or <script> into a cacheable static file.
+
+        {% bundle "shop.css" %}<style>...</style>{% endbundle %}
+
+    `manage.py build_bundles` writes the contents to static/bundles/shop.css;
+    until then, and always with DEBUG on, the block renders inline as before.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2 or bits[1][0] not in '"\'' or bits[1][0] != bits[1][-1]:
+        raise template.TemplateSyntaxError(f'{bits[0]} takes a quoted bundle name')
+    name = bits[1][1:-1]
+
+    nodelist = parser.parse(('endbundle',))
+    parser.delete_first_token()
+    if any(not isinstance(node, TextNode) for node in nodelist):
+        raise template.TemplateSyntaxError(f'bundle "{name}" must not contain template tags or variables')
+
+    inline = ''.join(node.s for node in nodelist)
+    match = ELEMENT_RE.match(inline)
+    suffix = name[name.rfind('.'):]
+    if not match or ELEMENT_FOR_SUFFIX.get(suffix) != match.group(1):
+        raise template.TemplateSyntaxError(
+            f'bundle "{name}" must wrap a single <{ELEMENT_FOR_SUFFIX.get(suffix, "style")}> element'
+        )
+    return BundleNode(name, inline, match.group(2))
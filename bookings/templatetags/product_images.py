@@ -0,0 +1,46 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from bookings.images import image_size, load_variants, variant_path
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, sizes='(max-width: 768px) 200px, 280px'):
+    """Lazy-loaded <picture> for a product, with WebP/PNG srcsets when built.
+
+    Falls back to the original image, sized from its file, until
+    `manage.py build_product_images` has generated the variants.
+    """
+    image_url = product.image_url
+    variants = load_variants().get(image_url)
+    if not variants:
+        size = image_size(image_url)
+        if size is None:
+            return format_html(
+                '<img src="{}" alt="{}" loading="lazy" decoding="async">',
+                static(image_url), product.name,
+            )
+        return format_html(
+            '<img src="{}" width="{}" height="{}" alt="{}" loading="lazy" decoding="async">',
+            static(image_url), size[0], size[1], product.name,
+        )
+
+    def srcset(fmt):
+        return ', '.join(
+            f'{static(variant_path(image_url, v["width"], fmt))} {v["width"]}w'
+            for v in variants
+        )
+
+    smallest = variants[0]
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        srcset('webp'), sizes,
+        static(variant_path(image_url, smallest['width'], 'png')), srcset('png'), sizes,
+        smallest['width'], smallest['height'], product.name,
+    )
@@ -1,3 +1,1303 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from asgiref.sync import async_to_sync
+from PIL import Image
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    archive, async_views, dispatch, events, images, inventory, jobs, log, ratelimit, recommendations, rollups,
+    scheduler, views, warmup,
+)
+from . import ids
+from .bundles import content_digest
+from .cache import MongoCache
+from .db import increment, price_to_float, scale
+from .management.commands import build_product_images
+from .middleware import CompressionMiddleware, brotli, choose_encoding, minify_html
+from .models import (
+    Appointment, ArchivedOrder, ArchivedOrderItem, BlockAdjacency, Cart, CartItem, DailyProductSales, DailySales, Job, Order,
+    OrderItem, Product, ProductPair, ProductRecommendations, Rating, RollupChange, RollupRebuild, SchedulerMark, Service,
+    StockMovement,
+)
+from .storage import StaticFilesStorage
+
+
+def make_product(name='Polish', price='2.500', stock=10, **fields):
+    product = Product.objects.create(
+        name=name, category='polish', description=name, price=Decimal(price), **fields
+    )
+    if stock:
+        StockMovement.objects.create(product=product, kind='restock', quantity=stock)
+    return product
+
+
+def make_order(items, status='confirmed', **fields):
+    """An order written the way the admin or a shell would, items are (product, quantity)"""
+    order = Order.objects.create(**{
+        'order_number': ids.new_order_number(), 'customer_name': 'Ali', 'customer_phone': '33334444',
+        'house_number': '1', 'road_number': '2', 'block_number': '3', 'area': 'Riffa',
+        'payment_method': 'cash', 'total_amount': sum(product.price * quantity for product, quantity in items),
+        'status': status, **fields,
+    })
+    for product, quantity in items:
+        OrderItem.objects.create(
+            order=order, product=product, product_name=product.name, quantity=quantity,
+            price=product.price,
+        )
+    return order
+
+
+def run_in_threads(target, args_list):
+    """Run target(*args) on one thread per args, re-raising the first error"""
+    errors = []
+
+    def run(*args):
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()  # Each thread opened its own
+
+    threads = [threading.Thread(target=run, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class ShopTestCase(TestCase):
+    def setUp(self):
+        # Buckets outlive a test's client, so start each test with full ones
+        caches[settings.RATE_LIMIT_CACHE].clear()
+
+    def add_to_cart(self, product, quantity=1):
+        return self.client.post(reverse('add_to_cart', args=[product.pk]), {'quantity': quantity})
+
+    def cart(self):
+        return Cart.objects.get(session_id=self.client.session['cart_key'])
+
+    def checkout(self, **fields):
+        return self.client.post(reverse('checkout'), {
+            'name': 'Ali', 'phone': '33334444', 'house_number': '1', 'road_number': '2',
+            'block_number': '3', 'area': 'Riffa', 'payment_method': 'cash', **fields,
+        })
+
+
+class LegacyCartTests(ShopTestCase):
+    def test_cart_keyed_by_session_key_is_adopted(self):
+        product = make_product()
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.create()
+        cart = Cart.objects.create(session_id=session.session_key, item_count=2, total=Decimal('5.000'))
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        response = self.client.get(reverse('view_cart'))
+        self.assertEqual(response.context['cart_count'], 2)
+        self.add_to_cart(product)
+
+        self.assertEqual(self.cart().pk, cart.pk)
+        self.assertEqual(CartItem.objects.get().quantity, 3)
+
+    def test_session_without_old_cart_is_checked_once(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.create()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        self.client.get(reverse('view_cart'))
+        self.assertEqual(self.client.session['cart_key'], '')
+        with self.assertNumQueries(1):  # Just the session
+            self.client.get(reverse('view_cart'))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BundleTagTests(TestCase):
+    template = '{% load bundles %}{% bundle "test.css" %}<style>p { margin: 0 }</style>{% endbundle %}'
+
+    def render(self, built):
+        manifest = {'test.css': content_digest('p { margin: 0 }')} if built else {}
+        with mock.patch('bookings.templatetags.bundles.load_bundles', return_value=manifest):
+            return Template(self.template).render(Context())
+
+    @override_settings(DEBUG=False)
+    def test_built_bundle_is_linked(self):
+        self.assertEqual(self.render(built=True), '<link rel="stylesheet" href="/static/bundles/test.css">')
+
+    @override_settings(DEBUG=False)
+    def test_unbuilt_bundle_stays_inline(self):
+        self.assertEqual(self.render(built=False), '<style>p { margin: 0 }</style>')
+
+    @override_settings(DEBUG=True)
+    def test_inline_with_debug_on(self):
+        self.assertEqual(self.render(built=True), '<style>p { margin: 0 }</style>')
+
+
+class CompressionTests(ShopTestCase):
+    body = '<p>Polish</p>\n' * 50
+
+    def process(self, response, accept='gzip, br'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        middleware = CompressionMiddleware(lambda request: None)
+        middleware.process_request(request)
+        return middleware.process_response(request, response)
+
+    def respond(self, body=None, accept='gzip, br', **kwargs):
+        return self.process(HttpResponse(self.body if body is None else body, **kwargs), accept)
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding('gzip, deflate, br'), 'br' if brotli else 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0.5, br;q=0'), 'gzip')
+        self.assertEqual(choose_encoding('br;q=0, gzip;q=0'), '')
+        self.assertEqual(choose_encoding('identity'), '')
+        self.assertEqual(choose_encoding('*'), 'gzip')
+        self.assertEqual(choose_encoding(''), '')
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.respond()
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content).decode(), minify_html(self.body))
+
+    def test_gzip(self):
+        response = self.respond(accept='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content).decode(), minify_html(self.body))
+
+    def test_identity_is_sent_uncompressed(self):
+        for accept in ('identity', 'gzip;q=0, br;q=0'):
+            response = self.respond(accept=accept)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_left_alone(self):
+        small = self.respond(body='<p>Polish</p>')
+        image = self.respond(body=b'\x89PNG' * 100, content_type='image/png')
+        encoded = HttpResponse(gzip.compress(self.body.encode()))
+        encoded['Content-Encoding'] = 'gzip'
+        encoded = self.process(encoded)
+        for response in (small, image, encoded):
+            self.assertFalse(response.has_header('Vary'))
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(image.has_header('Content-Encoding'))
+        self.assertEqual(encoded['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(encoded.content).decode(), self.body)
+
+        streaming = self.process(StreamingHttpResponse([self.body]))
+        self.assertFalse(streaming.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(streaming.streaming_content).decode(), self.body)
+
+    def test_etag_becomes_weak(self):
+        response = HttpResponse(self.body)
+        response['ETag'] = '"abc"'
+        self.assertEqual(self.process(response)['ETag'], 'W/"abc"')
+
+    def test_minify_keeps_pre_textarea_and_script(self):
+        html = (
+            '<div>\n    <p>Wax</p>\n\n    <pre>\n  a\n    b</pre>\n'
+            '    <textarea>\n  note</textarea>\n'
+            '    <script>\n  const s = `one\n    two`;\n</script>\n</div>\n'
+        )
+        self.assertEqual(minify_html(html), (
+            '<div>\n<p>Wax</p>\n<pre>\n  a\n    b</pre>\n'
+            '<textarea>\n  note</textarea>\n'
+            '<script>\n  const s = `one\n    two`;\n</script>\n</div>'
+        ))
+
+    def test_page_cache_serves_the_variant_asked_for(self):
+        for n in range(10):
+            make_product(name=f'Polish {n}')
+        middleware = list(settings.MIDDLEWARE)
+        middleware.insert(1, 'django.middleware.cache.UpdateCacheMiddleware')
+        middleware.append('django.middleware.cache.FetchFromCacheMiddleware')
+        caches[settings.CACHE_MIDDLEWARE_ALIAS].clear()
+        with override_settings(MIDDLEWARE=middleware, CACHE_MIDDLEWARE_SECONDS=60):
+            with mock.patch('bookings.views.catalog_data', wraps=views.catalog_data) as catalog_data:
+                bodies = {}
+                for accept in ('gzip', 'identity', 'gzip, deflate', 'identity'):
+                    response = self.client.get(reverse('catalog'), HTTP_ACCEPT_ENCODING=accept)
+                    bodies.setdefault(response.get('Content-Encoding', ''), set()).add(response.content)
+        caches[settings.CACHE_MIDDLEWARE_ALIAS].clear()
+        # One render per coding; each hit got the body for its own coding
+        self.assertEqual(catalog_data.call_count, 2)
+        self.assertEqual(set(bodies), {'gzip', ''})
+        (gzipped,), (plain,) = bodies['gzip'], bodies['']
+        self.assertEqual(gzip.decompress(gzipped), plain)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProductImageTests(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        static_dir = Path(temp_dir.name).resolve()
+        product_dir = static_dir / 'images' / 'products'
+        product_dir.mkdir(parents=True)
+        paths = {
+            'STATIC_DIR': static_dir, 'PRODUCT_IMAGE_DIR': product_dir, 'VARIANTS_DIR': product_dir / 'variants',
+            'VARIANTS_MANIFEST': product_dir / 'variants' / 'variants.json',
+        }
+        patches = [mock.patch.multiple(images, **paths), mock.patch.multiple(build_product_images, **{
+            name: paths[name] for name in ('STATIC_DIR', 'PRODUCT_IMAGE_DIR')
+        })]
+        patches.append(mock.patch.dict(images._manifest_cache, {'mtime': None, 'data': {}}))
+        patches.append(mock.patch.dict(images._size_cache, clear=True))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.product_dir = product_dir
+        Image.new('RGB', (800, 600), 'red').save(product_dir / 'wax.png')
+        Image.new('RGB', (200, 100), 'blue').save(product_dir / 'cloth.jpg')
+
+    def render(self, image_url):
+        product = Product(name='Wax', image_url=image_url)
+        return Template('{% load product_images %}{% product_image product %}').render(Context({'product': product}))
+
+    def test_unbuilt_image_is_a_sized_img(self):
+        self.assertEqual(
+            self.render('images/products/wax.png'),
+            '<img src="/static/images/products/wax.png" width="800" height="600" alt="Wax" '
+            'loading="lazy" decoding="async">',
+        )
+        # A path that can't be read still renders, just unsized
+        self.assertNotIn('width', self.render('images/products/missing.png'))
+
+    def test_build_writes_variants_without_upscaling(self):
+        call_command('build_product_images', stdout=StringIO())
+        manifest = json.loads((self.product_dir / 'variants' / 'variants.json').read_text())
+        self.assertEqual(manifest, {
+            'images/products/cloth.jpg': [{'width': 200, 'height': 100}],
+            'images/products/wax.png': [{'width': 320, 'height': 240}, {'width': 640, 'height': 480}],
+        })
+        for name in ('cloth-200w', 'wax-320w', 'wax-640w'):
+            for fmt in images.VARIANT_FORMATS:
+                self.assertTrue((self.product_dir / 'variants' / f'{name}.{fmt}').exists())
+        with Image.open(self.product_dir / 'variants' / 'wax-640w.webp') as variant:
+            self.assertEqual(variant.size, (640, 480))
+
+    def test_built_image_is_a_picture(self):
+        call_command('build_product_images', stdout=StringIO())
+        html = self.render('images/products/wax.png')
+        variants = '/static/images/products/variants/wax'
+        self.assertTrue(html.startswith('<picture>'))
+        self.assertIn(
+            f'<source type="image/webp" srcset="{variants}-320w.webp 320w, {variants}-640w.webp 640w"', html
+        )
+        self.assertIn(
+            f'<img src="{variants}-320w.png" srcset="{variants}-320w.png 320w, {variants}-640w.png 640w"', html
+        )
+        self.assertIn('width="320" height="240"', html)
+
+
+class StaticStorageTests(TestCase):
+    def storage(self, manifest):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        if manifest is not None:
+            Path(static_root.name, 'staticfiles.json').write_text(json.dumps({'paths': manifest, 'version': '1.0'}))
+        return StaticFilesStorage(location=static_root.name)
+
+    def test_uncollected_path_is_logged_and_served_unhashed(self):
+        storage = self.storage({'css/site.css': 'css/site.0123abcd.css'})
+        self.assertEqual(storage.stored_name('css/site.css'), 'css/site.0123abcd.css')
+        with self.assertLogs('bookings.storage', 'ERROR'):
+            self.assertEqual(storage.stored_name('images/typo.png'), 'images/typo.png')
+
+    def test_missing_collectstatic_is_logged_once(self):
+        storage = self.storage(None)
+        with self.assertLogs('bookings.storage', 'ERROR') as logs:
+            self.assertEqual(storage.stored_name('css/site.css'), 'css/site.css')
+            self.assertEqual(storage.stored_name('js/site.js'), 'js/site.js')
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('collectstatic', logs.output[0])
+
+
+class OrderNumberTests(ShopTestCase):
+    @skipUnless(connection.vendor == 'djongo', 'Node ids are claimed from the MongoDB counter')
+    @override_settings(ORDER_NODE_ID=None)
+    def test_every_process_claims_its_own_node(self):
+        # Pids a multiple of 32 apart, which used to share a node id
+        nodes = []
+        for pid in (4100, 4132, 4164):
+            with mock.patch('os.getpid', return_value=pid):
+                nodes.append(ids.default_node_id())
+        self.assertEqual(len(set(nodes)), 3)
+
+    @override_settings(ORDER_NODE_ID=1024)
+    def test_configured_node_must_fit(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ids.default_node_id()
+
+    def test_order_numbers_are_unique_and_time_ordered(self):
+        numbers = [ids.new_order_number() for _ in range(5000)]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(numbers, sorted(numbers))
+
+
+@skipUnless(connection.vendor == 'djongo', 'Rating ids come from the MongoDB counter')
+@override_settings(RATE_LIMITS={})
+class RatingIdTests(TransactionTestCase):
+    def submit_ratings(self, count):
+        client = Client()
+        for n in range(count):
+            response = client.post(reverse('submit_rating'), {
+                'rating_type': 'overall', 'customer_name': f'Customer {n}', 'rating': 5,
+            })
+            self.assertEqual(response.status_code, 302)
+
+    def test_parallel_submits_get_unique_ids(self):
+        run_in_threads(self.submit_ratings, [(10,)] * 8)
+        rating_ids = list(Rating.objects.values_list('id', flat=True))
+        self.assertEqual(len(rating_ids), 80)
+        self.assertEqual(len(set(rating_ids)), 80)
+
+    def test_blocks_of_separate_processes_never_overlap(self):
+        # One allocator per simulated worker process, all on one counter
+        allocators = [ids.SequenceAllocator('test_rating_blocks', block_size=3) for _ in range(4)]
+        taken = [[] for _ in allocators]
+
+        def take(allocator, out):
+            for count in [1, 2, 5] * 10:
+                out.extend(allocator.take(count))
+
+        run_in_threads(take, list(zip(allocators, taken)))
+        everything = [i for out in taken for i in out]
+        self.assertEqual(len(everything), 4 * 80)
+        self.assertEqual(len(set(everything)), len(everything))
+
+
+class RollupTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(price='2.500', stock=100)
+
+    def totals(self):
+        """(orders, revenue, units) summed over the rollups"""
+        sales = DailySales.objects.all()
+        products = DailyProductSales.objects.all()
+        return (
+            sum(row.order_count for row in sales),
+            round(sum(price_to_float(row.revenue) for row in sales), 3),
+            sum(row.quantity for row in products),
+        )
+
+    def test_checkout_is_counted_once(self):
+        self.add_to_cart(self.product, 2)
+        self.checkout()
+        self.assertEqual(self.totals(), (1, 5.0, 2))
+
+    def test_orders_written_outside_checkout_are_counted(self):
+        make_order([(self.product, 3)])
+        make_order([(self.product, 1)], status='cancelled')
+        self.assertEqual(self.totals(), (1, 7.5, 3))
+
+    def test_deleted_orders_and_items_are_taken_off(self):
+        order = make_order([(self.product, 3)])
+        extra = make_product('Wax', price='1.000')
+        OrderItem.objects.create(order=order, product=extra, product_name='Wax', quantity=2, price=1)
+        order.items.get(product=extra).delete()
+        self.assertEqual(self.totals(), (1, 7.5, 3))
+        order.delete()
+        self.assertEqual(self.totals(), (0, 0, 0))
+
+    def test_archived_orders_still_count(self):
+        order = make_order([(self.product, 3)], status='delivered')
+        archive.archive_batch([order])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.totals(), (1, 7.5, 3))
+
+    def test_rebuild_matches_the_live_totals(self):
+        orders = [make_order([(self.product, n)]) for n in range(1, 6)]
+        rollups.set_status(Order.objects.filter(pk=orders[0].pk), 'cancelled')
+        archive.archive_batch([orders[1]])
+        live = self.totals()
+        DailySales.objects.all().delete()
+        self.assertEqual(rollups.rebuild(chunk_size=2), (4, 1, 1))
+        self.assertEqual(self.totals(), live)
+
+    def test_orders_placed_during_a_rebuild_are_counted_once(self):
+        make_order([(self.product, 1)])
+        held_position = rollups.held_position
+        placed = []
+
+        def place_orders_while_reading():
+            # One order lands before its chunk is read, one after the pass
+            if not placed:
+                placed.append(make_order([(self.product, 2)]))
+            return held_position()
+
+        def count_then_place(chunk_size):
+            counted = count_history(chunk_size)
+            placed.append(make_order([(self.product, 4)]))
+            return counted
+
+        count_history = rollups.count_history
+        with mock.patch.object(rollups, 'held_position', place_orders_while_reading), \
+                mock.patch.object(rollups, 'count_history', count_then_place):
+            rollups.rebuild(chunk_size=1)
+
+        self.assertEqual(len(placed), 2)
+        self.assertEqual(self.totals(), (3, 17.5, 7))
+        self.assertFalse(RollupChange.objects.exists())
+        self.assertFalse(RollupRebuild.objects.exists())
+
+    def test_rebuild_refuses_to_run_twice(self):
+        RollupRebuild.objects.create()
+        with self.assertRaises(RuntimeError):
+            rollups.rebuild()
+        rollups.rebuild(force=True)
+        self.assertFalse(RollupRebuild.objects.exists())
+
+
+class RecommendationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.wax, self.polish, self.cloth = [make_product(name) for name in ('Wax', 'Polish', 'Cloth')]
+
+    def neighbours(self, product):
+        return ProductRecommendations.objects.get(product=product).get_neighbours()
+
+    def test_new_orders_add_to_the_rebuilt_counts(self):
+        make_order([(self.wax, 1), (self.polish, 1)])
+        make_order([(self.wax, 1), (self.cloth, 1)])
+        recommendations.rebuild()
+        recommendations.add_basket([self.wax.pk, self.cloth.pk])
+        recommendations.add_basket([self.wax.pk, self.cloth.pk, self.polish.pk])
+
+        self.assertEqual(self.neighbours(self.wax), [[self.cloth.pk, 3], [self.polish.pk, 2]])
+        self.assertEqual(self.neighbours(self.cloth), [[self.wax.pk, 3], [self.polish.pk, 1]])
+        self.assertEqual(recommendations.recommend([self.polish.pk]), [self.wax, self.cloth])
+
+    def test_cart_still_loads_when_recommendations_fail(self):
+        self.add_to_cart(self.wax, 2)
+        with mock.patch.object(recommendations, 'recommend', side_effect=RuntimeError), \
+                self.assertLogs('bookings.views', 'ERROR'):
+            response = self.client.get(reverse('view_cart'))
+        self.assertEqual(response.context['cart_count'], 2)
+        self.assertEqual(response.context['recommendations'], [])
+
+
+@skipUnless(connection.vendor == 'djongo', 'Pair counts use the MongoDB $inc')
+class ParallelRecommendationTests(TransactionTestCase):
+    def test_concurrent_orders_are_all_counted(self):
+        wax, polish = make_product('Wax'), make_product('Polish')
+        run_in_threads(lambda: [recommendations.add_basket([wax.pk, polish.pk]) for _ in range(5)], [()] * 8)
+        self.assertEqual(ProductPair.objects.get(product=wax).order_count, 40)
+        self.assertEqual(ProductRecommendations.objects.get(product=polish).get_neighbours(), [[wax.pk, 40]])
+
+
+class CartCounterTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.wax, self.polish = make_product('Wax', '2.500'), make_product('Polish', '4.000')
+
+    def update(self, product, action):
+        return self.client.post(reverse('update_cart', args=[product.pk]), {'action': action})
+
+    def assertCounters(self, item_count, total):
+        cart = self.cart()
+        self.assertEqual((cart.item_count, price_to_float(cart.total)), (item_count, total))
+        items = cart.items.all()
+        self.assertEqual(sum(item.quantity for item in items), item_count)
+
+    def test_counters_follow_every_change(self):
+        self.add_to_cart(self.wax, 3)
+        self.assertEqual(self.add_to_cart(self.polish).json()['cart_count'], 4)
+        self.assertCounters(4, 11.5)
+        self.assertEqual(self.client.get(reverse('shop')).context['cart_badge_count'], 4)
+        self.update(self.wax, 'increase')
+        self.update(self.polish, 'decrease')  # The last one goes
+        self.assertCounters(4, 10.0)
+        self.update(self.wax, 'decrease')
+        self.assertCounters(3, 7.5)
+        self.update(self.wax, 'remove')
+        self.assertCounters(0, 0.0)
+        self.assertEqual(self.client.get(reverse('shop')).context['cart_badge_count'], 0)
+
+    def changed_after_read(self, delta):
+        """Patch views so the cart item changes by `delta` right after the view reads it"""
+        real = views.get_object_or_404
+
+        def get_object_or_404(model, **lookups):
+            found = real(model, **lookups)
+            if model is CartItem:
+                increment(CartItem, found.pk, quantity=delta)
+                self.cart().add_items(delta, Decimal('2.500'))
+            return found
+        return mock.patch.object(views, 'get_object_or_404', get_object_or_404)
+
+    def test_decrease_never_goes_below_one(self):
+        self.add_to_cart(self.wax, 2)
+        # Another decrease lands between the read and this one
+        with self.changed_after_read(-1):
+            self.update(self.wax, 'decrease')
+        self.assertFalse(CartItem.objects.exists())
+        self.assertCounters(0, 0.0)
+
+    def test_remove_takes_off_what_it_deleted(self):
+        self.add_to_cart(self.wax, 1)
+        # An increase lands between the read and the remove
+        with self.changed_after_read(2):
+            self.update(self.wax, 'remove')
+        self.assertFalse(CartItem.objects.exists())
+        self.assertCounters(0, 0.0)
+
+    def test_checkout_keeps_what_was_added_meanwhile(self):
+        self.add_to_cart(self.wax, 2)
+        real = inventory.hold_for_checkout
+
+        def hold_for_checkout(cart):
+            short = real(cart)
+            # Another tab adds polish once checkout has read the cart
+            self.add_to_cart(self.polish)
+            return short
+        with mock.patch.object(inventory, 'hold_for_checkout', hold_for_checkout):
+            self.checkout()
+        self.assertEqual(OrderItem.objects.get().product_name, 'Wax')
+        self.assertCounters(1, 4.0)
+        self.assertEqual(self.cart().items.get().product, self.polish)
+
+
+@skipUnless(connection.vendor == 'djongo', 'Cart counters use the MongoDB $inc')
+class ParallelCartCounterTests(TransactionTestCase):
+    def test_concurrent_decreases_and_removes(self):
+        caches[settings.RATE_LIMIT_CACHE].clear()
+        wax = make_product('Wax', '2.500')
+        client = Client()
+        client.post(reverse('add_to_cart', args=[wax.pk]), {'quantity': 3})
+
+        def update(action):
+            other = Client()
+            other.cookies = client.cookies  # The same shopper, in another tab
+            other.post(reverse('update_cart', args=[wax.pk]), {'action': action})
+        run_in_threads(update, [('decrease',)] * 6 + [('remove',)] * 2)
+
+        cart = Cart.objects.get(session_id=client.session['cart_key'])
+        self.assertFalse(cart.items.exists())
+        self.assertEqual((cart.item_count, price_to_float(cart.total)), (0, 0.0))
+
+
+class AsyncViewTests(ShopTestCase):
+    def call(self, view, path):
+        request = RequestFactory().get(path)
+        request.session = SessionStore()
+        request.user = mock.Mock(is_authenticated=False)
+        with mock.patch.object(async_views, 'run_in_db_thread', wraps=async_views.run_in_db_thread) as hop:
+            response = async_to_sync(view)(request)
+        return response, hop.call_count
+
+    def test_pages_take_one_trip_to_the_pool(self):
+        response, hops = self.call(async_views.shop, '/shop/')
+        self.assertEqual((response.status_code, hops), (200, 1))
+        self.assertIn(b'Car Accessories Shop', response.content)
+        response, hops = self.call(async_views.view_cart, '/cart/')
+        self.assertEqual((response.status_code, hops), (200, 1))
+
+
+class StockTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(stock=10)
+
+    def test_quantities_below_one_or_not_whole_are_rejected(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            for quantity in ('0', '-3', 'two', '1.5'):
+                response = self.add_to_cart(self.product, quantity)
+                self.assertEqual(response.status_code, 400, quantity)
+        request = RequestFactory().post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': '-3'})
+        self.assertEqual(async_to_sync(async_views.add_to_cart)(request, self.product.pk).status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(inventory.stock_level(self.product.pk), 10)
+
+    def test_checkout_refuses_stock_sold_after_the_hold_expired(self):
+        self.add_to_cart(self.product, 8)
+        held = StockMovement.objects.filter(kind='reservation').values_list('pk', flat=True)
+        inventory.expire(list(held))
+        other = Client()
+        other.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 5})
+        self.assertEqual(inventory.stock_level(self.product.pk), 5)
+
+        response = self.checkout()
+        self.assertRedirects(response, reverse('view_cart'))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(inventory.stock_level(self.product.pk), 5)
+
+        self.client.post(reverse('update_cart', args=[self.product.pk]), {'action': 'decrease'})
+        self.client.post(reverse('update_cart', args=[self.product.pk]), {'action': 'decrease'})
+        self.client.post(reverse('update_cart', args=[self.product.pk]), {'action': 'decrease'})
+        self.assertEqual(self.checkout().status_code, 302)
+        self.assertEqual(Order.objects.get().items.get().quantity, 5)
+        self.assertEqual(inventory.stock_level(self.product.pk), 0)
+
+    def test_old_holds_the_worker_missed_are_expired(self):
+        long_ago = timezone.now() - timedelta(days=30)
+        StockMovement.objects.create(
+            product=self.product, kind='reservation', quantity=-3, reference='lost-cart',
+            expires_at=long_ago,
+        )
+        # Djongo can't run an UPDATE without a WHERE
+        StockMovement.objects.filter(product=self.product).update(created_at=long_ago)
+        inventory.take_snapshots()
+        self.assertEqual(inventory.stock_level(self.product.pk), 7)
+
+        self.assertEqual(inventory.expire_overdue(), 1)
+        self.assertEqual(inventory.stock_level(self.product.pk), 10)
+        StockMovement.objects.filter(product=self.product).update(created_at=long_ago)
+        inventory.take_snapshots()
+        self.assertEqual(inventory.snapshot_position(), StockMovement.objects.order_by('-pk').first().pk)
+
+    def test_staff_only_restock_and_adjust_stock(self):
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'pw'))
+        product = make_product(stock=0)
+        add = reverse('admin:bookings_stockmovement_add')
+        for kind in ('reservation', 'sale', 'expiry'):
+            response = self.client.post(add, {'product': product.pk, 'kind': kind, 'quantity': -1})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('kind', response.context['adminform'].form.errors)
+        self.client.post(add, {'product': product.pk, 'kind': 'restock', 'quantity': 5})
+        self.assertEqual(product.stock_movements.get().kind, 'restock')
+
+
+class ArchiveTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product()
+
+    def make_order(self, status, days_ago):
+        order = make_order([(self.product, 2)], status=status)
+        # update() leaves auto_now alone
+        Order.objects.filter(pk=order.pk).update(updated_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def test_only_old_finished_orders_move(self):
+        delivered = self.make_order('delivered', 40)
+        cancelled = self.make_order('cancelled', 40)
+        recent = self.make_order('delivered', 5)
+        still_open = self.make_order('confirmed', 40)
+        item_ids = set(OrderItem.objects.filter(order__in=[delivered, cancelled]).values_list('pk', flat=True))
+
+        call_command('archive_orders', older_than=30, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(set(ArchivedOrder.objects.values_list('pk', flat=True)), {delivered.pk, cancelled.pk})
+        self.assertEqual(set(ArchivedOrderItem.objects.values_list('pk', flat=True)), item_ids)
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {recent.pk, still_open.pk})
+        self.assertEqual(ArchivedOrder.objects.get(pk=delivered.pk).order_number, delivered.order_number)
+
+    def test_interrupted_batch_is_finished_without_duplicates(self):
+        order = self.make_order('delivered', 40)
+        # A run that copied the order, then stopped before deleting it
+        archive._copy(order, ArchivedOrder).save()
+        archive.archive_batch([order])
+        self.assertEqual(ArchivedOrder.objects.count(), 1)
+        self.assertEqual(ArchivedOrderItem.objects.count(), 1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_archived_orders_can_still_be_looked_up(self):
+        order = self.make_order('delivered', 40)
+        archive.archive_batch([order])
+
+        response = self.client.get(reverse('order_confirmation', args=[order.order_number]))
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'pw'))
+        response = self.client.get(reverse('admin:bookings_order_change', args=[order.pk]))
+        self.assertRedirects(response, reverse('admin:bookings_archivedorder_change', args=[order.pk]))
+        response = self.client.get(reverse('admin:bookings_order_changelist'), {'q': order.order_number})
+        self.assertRedirects(
+            response, reverse('admin:bookings_archivedorder_changelist') + f'?q={order.order_number}'
+        )
+
+
+@override_settings(PAGE_CACHE_SECONDS=60)
+class BulkActionTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'pw'))
+        caches[settings.CACHE_MIDDLEWARE_ALIAS].set('page', 'cached')
+
+    def run_action(self, model, action, objects, **fields):
+        return self.client.post(reverse(f'admin:bookings_{model}_changelist'), {
+            'action': action, helpers.ACTION_CHECKBOX_NAME: [obj.pk for obj in objects], **fields,
+        })
+
+    def test_order_status_actions_clear_the_page_cache(self):
+        product = make_product()
+        orders = [make_order([(product, 1)], status='cancelled') for _ in range(3)]
+        self.run_action('order', 'mark_confirmed', orders[:2])
+
+        self.assertEqual(Order.objects.filter(status='confirmed').count(), 2)
+        self.assertIsNone(caches[settings.CACHE_MIDDLEWARE_ALIAS].get('page'))
+        self.assertEqual(DailySales.objects.get().order_count, 2)
+
+    def test_select_all_over_an_unfiltered_list(self):
+        products = [make_product(f'Wax {n}') for n in range(3)]
+        self.run_action('product', 'make_unavailable', products[:1], select_across='1', index='0')
+        self.assertEqual(list(Product.objects.values_list('is_available', flat=True)), [False] * 3)
+
+    def test_price_change_scales_and_rounds_every_selected_price(self):
+        products = [make_product('Wax', price='2.500'), make_product('Polish', price='1.234')]
+        untouched = make_product('Cloth', price='3.000')
+        self.run_action('product', 'change_price', products, apply='1', percent='-10')
+
+        prices = {p.name: price_to_float(p.price) for p in Product.objects.all()}
+        self.assertEqual(prices, {'Wax': 2.25, 'Polish': 1.111, 'Cloth': 3.0})
+        self.assertIsNone(caches[settings.CACHE_MIDDLEWARE_ALIAS].get('page'))
+        self.assertEqual(scale(Product.objects.filter(pk=untouched.pk), 'price', 1.5), 1)
+        self.assertEqual(price_to_float(Product.objects.get(pk=untouched.pk).price), 4.5)
+
+
+class DispatchTests(ShopTestCase):
+    def stops(self, *addresses, area='Riffa'):
+        """Unsaved orders at (block, road, house)"""
+        return [dispatch.Stop(Order(
+            order_number=f'ORD-{n}', area=area, block_number=block, road_number=road, house_number=house,
+        )) for n, (block, road, house) in enumerate(addresses)]
+
+    def test_batches_fill_by_area_and_keep_blocks_together(self):
+        stops = self.stops(*[('901', '1', str(n)) for n in range(3)], *[('905', '2', str(n)) for n in range(3)])
+        stops += self.stops(('101', '1', '1'), area='Sitra')
+        batches = dispatch.make_batches(stops, dispatch.BlockGraph([]), capacity=4)
+
+        self.assertEqual([(b.area, b.blocks, len(b)) for b in batches], [
+            ('Riffa', ['901'], 3), ('Riffa', ['905'], 3), ('Sitra', ['101'], 1),
+        ])
+
+    def test_blocks_bigger_than_a_batch_are_split(self):
+        stops = self.stops(*[('901', '1', str(n)) for n in range(5)])
+        batches = dispatch.make_batches(stops, dispatch.BlockGraph([]), capacity=2)
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+
+    def test_adjacent_blocks_come_before_nearer_numbers(self):
+        graph = dispatch.BlockGraph([('101', '150')])
+        self.assertEqual(dispatch.block_order(['102', '150', '101'], graph), ['101', '150', '102'])
+        self.assertEqual(graph.distance('101', '150'), 1)
+        self.assertEqual(graph.distance('101', '103'), 1.2)
+
+    def test_route_never_doubles_back_along_a_line(self):
+        blocks = ['905', '901', '909', '903', '907']
+        stops = dispatch.route(self.stops(*[(block, '1', '1') for block in blocks]), dispatch.BlockGraph([]))
+        self.assertEqual([stop.block for stop in stops], sorted(blocks))
+
+    def test_plan_reads_confirmed_orders_and_adjacency_in_two_queries(self):
+        product = make_product()
+        make_order([(product, 1)], block_number='905')
+        make_order([(product, 1)], status='pending')
+        BlockAdjacency.objects.create(block='905', adjacent_block='906')
+        with self.assertNumQueries(2):
+            batches = dispatch.plan()
+        self.assertEqual([b.blocks for b in batches], [['905']])
+
+    def test_page_is_for_staff_only(self):
+        url = reverse('dispatch_plan')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'pw'))
+        response = self.client.get(url, {'capacity': 'lots'})
+        self.assertEqual(response.context['capacity'], dispatch.DEFAULT_CAPACITY)
+
+
+@override_settings(WARMUP=True)
+class WarmupTests(TestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.dict(warmup.state, {'ready': False, 'seconds': None, 'steps': {}, 'error': '', 'attempts': 0}),
+            mock.patch.dict(warmup._retry, {'at': 0.0}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_warms_up_inside_a_running_event_loop(self):
+        # uvicorn imports asgi.py, and so runs warm-up, inside its loop
+        async def import_app():
+            warmup.run()
+        self.assertEqual(self.client.get(reverse('readiness')).status_code, 503)
+        asyncio.run(import_app())
+
+        self.assertEqual(warmup.state['error'], '')
+        self.assertEqual(list(warmup.state['steps']), [name for name, step in warmup.STEPS])
+        self.assertEqual(self.client.get(reverse('readiness')).status_code, 200)
+
+    def test_failed_step_is_retried_by_the_probe(self):
+        urls = mock.Mock()
+        pages = mock.Mock(side_effect=[RuntimeError('MongoDB is down'), None])
+        with mock.patch.object(warmup, 'STEPS', [('urls', urls), ('pages', pages)]):
+            with self.assertLogs('bookings.warmup', 'ERROR'):
+                warmup.run()
+            self.assertEqual(warmup.state['error'], 'pages: MongoDB is down')
+            # Not again until the backoff is over
+            self.assertEqual(self.client.get(reverse('readiness')).status_code, 503)
+            self.assertEqual(pages.call_count, 1)
+
+            warmup._retry['at'] = 0.0
+            self.assertEqual(self.client.get(reverse('readiness')).status_code, 200)
+        self.assertEqual((urls.call_count, pages.call_count), (1, 2))
+        self.assertEqual((warmup.state['error'], warmup.state['attempts']), ('', 2))
+
+    @override_settings(ALLOWED_HOSTS=['*', '.khalifapolish.com'], WARMUP_HOST='')
+    def test_pages_are_rendered_for_the_served_host(self):
+        self.assertEqual(warmup.warm_host(), 'khalifapolish.com')
+        with override_settings(WARMUP_HOST='www.khalifapolish.com'):
+            self.assertEqual(warmup.warm_host(), 'www.khalifapolish.com')
+
+
+class EventBrokerTests(TestCase):
+    def start(self, argv, environ=None):
+        """check_broker() in a worker started with these arguments"""
+        with mock.patch('sys.argv', ['uvicorn', 'car_polishing_site.asgi:application'] + argv), \
+                mock.patch.dict('os.environ', environ or {}):
+            events.check_broker()
+
+    @skipIf('DJANGO_EVENT_BROKER' in os.environ, 'The broker is set by the environment')
+    def test_default_broker_reaches_every_worker(self):
+        self.assertEqual(settings.EVENT_BROKER, 'bookings.events.MongoBroker')
+        self.start(['--workers', '4'])
+
+    @override_settings(EVENT_BROKER='bookings.events.LocalBroker')
+    def test_local_broker_refuses_several_workers(self):
+        for argv, environ in ((['--workers', '4'], None), (['--workers=2'], None),
+                              ([], {'WEB_CONCURRENCY': '3'})):
+            with self.subTest(argv=argv, environ=environ), self.assertRaises(ImproperlyConfigured):
+                self.start(argv, environ)
+        self.start(['--workers', '1'], {'WEB_CONCURRENCY': ''})
+        self.start([], {'WEB_CONCURRENCY': ''})
+
+    @skipUnless(connection.vendor == 'djongo', 'MongoBroker writes to MongoDB')
+    def test_mongo_broker_writes_events_for_other_processes(self):
+        broker = events.MongoBroker()
+        broker.publish([(events.order_channel('KP-1'), {'status': 'delivered'})])
+        event = broker.collection().find_one({'channel': 'order:KP-1'})
+        self.assertEqual(event['data'], {'status': 'delivered'})
+
+
+@override_settings(RATE_LIMITS={'add_to_cart': {'per_minute': 60, 'burst': 3, 'key': 'ip'}})
+class RateLimitTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(stock=100)
+        self.cache = caches[settings.RATE_LIMIT_CACHE]
+
+    def take(self, now):
+        # The cache keeps its own clock for expiry
+        with mock.patch.object(ratelimit, 'time', mock.Mock(time=lambda: now)):
+            return ratelimit.take(self.cache, 'ratelimit:test', 60, 3)
+
+    def test_burst_then_429_with_retry_after(self):
+        for _ in range(3):
+            self.assertEqual(self.add_to_cart(self.product).status_code, 200)
+        response = self.add_to_cart(self.product)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response['Retry-After']), range(1, 5))
+        response = self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 1},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.json()['success'])
+        # GETs and other clients are not limited
+        self.assertEqual(self.client.get(reverse('shop')).status_code, 200)
+        other = Client(REMOTE_ADDR='10.0.0.9').post(reverse('add_to_cart', args=[self.product.pk]),
+                                                     {'quantity': 1})
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(self.cart().items.get().quantity, 3)
+
+    def test_tokens_refill_at_the_rule_rate(self):
+        check_refill(self, self.take)
+
+    def test_a_cache_that_is_down_refuses_no_one(self):
+        down = mock.Mock(spec=['incr', 'add', 'get'], incr=mock.Mock(side_effect=ValueError),
+                         add=mock.Mock(return_value=False), get=mock.Mock(return_value=0))
+        with self.assertLogs('bookings.ratelimit', 'WARNING'):
+            self.assertEqual(ratelimit.take(down, 'ratelimit:test', 60, 3), 0)
+
+
+def check_refill(test, take):
+    """A 3-token bucket refilling at one a second, as take(now) sees it"""
+    start = 3000.0  # The start of a refill period (3s)
+    test.assertEqual([take(start + 0.1) for _ in range(3)], [0, 0, 0])
+    wait = take(start + 0.5)
+    test.assertAlmostEqual(wait, 3.5)
+    # Refused requests take no token, and one is back after `wait`
+    test.assertGreater(take(start + 0.5 + wait - 0.1), 0)
+    test.assertEqual(take(start + 0.5 + wait), 0)
+    # The previous period fades out: a token per second after that
+    test.assertGreater(take(start + 4.2), 0)
+    test.assertEqual(take(start + 5.1), 0)
+    # Idle for a whole period, the bucket is full again
+    test.assertEqual([take(start + 12) for _ in range(3)], [0, 0, 0])
+    test.assertGreater(take(start + 12), 0)
+
+
+@skipUnless(connection.vendor == 'djongo', 'MongoCache stores entries in MongoDB')
+class MongoCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.cache = MongoCache('test_cache', {})
+        self.cache.clear()
+
+    def test_entries(self):
+        self.assertTrue(self.cache.add('count', 1))
+        self.assertFalse(self.cache.add('count', 5))
+        self.assertEqual(self.cache.incr('count', 2), 3)
+        self.assertEqual(self.cache.decr('count'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('cart', {'wax': 2})
+        self.assertEqual(self.cache.get('cart'), {'wax': 2})
+        self.assertTrue(self.cache.delete('cart'))
+        self.assertIsNone(self.cache.get('cart'))
+
+    def test_expired_entries_are_gone(self):
+        self.cache.set('old', 1, timeout=0)  # Expires straight away
+        self.assertIsNone(self.cache.get('old'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('old')
+        # Until the TTL monitor removes it, an expired entry gives way
+        self.assertTrue(self.cache.add('old', 7))
+        self.assertEqual(self.cache.get('old'), 7)
+
+    def test_buckets_take_one_round_trip(self):
+        collection = self.cache.collection()
+        with mock.patch.object(self.cache, 'collection', return_value=mock.Mock(wraps=collection)) as wrapped:
+            self.assertEqual(ratelimit.take(self.cache, 'trips', 60, 3), 0)
+        self.assertEqual([call[0] for call in wrapped.return_value.method_calls], ['find_one_and_update'])
+
+    def test_buckets_refill_at_the_rule_rate(self):
+        def take(now):
+            with mock.patch.object(ratelimit, 'time', mock.Mock(time=lambda: now)):
+                return ratelimit.take(self.cache, 'refill', 60, 3)
+        check_refill(self, take)
+
+    def test_every_process_shares_the_buckets(self):
+        other = MongoCache('test_cache', {})  # As another worker would
+        waits = [ratelimit.take(cache, 'shared', 60, 3) for cache in (self.cache, other, self.cache, other)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertGreater(waits[3], 0)
+
+    def test_parallel_takes_share_one_bucket(self):
+        waits = []
+        run_in_threads(
+            lambda: waits.append(ratelimit.take(MongoCache('test_cache', {}), 'parallel', 60, 10)),
+            [()] * 20,
+        )
+        self.assertEqual(waits.count(0), 10)
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.runs = []
+        handlers = mock.patch.dict(jobs._handlers, {
+            'test_ok': self.runs.append,
+            'test_failing': lambda payload: 1 / 0,
+        })
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def make_due(self, job):
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        queued = [jobs.enqueue('test_ok', {'n': n}) for n in range(5)]
+        first = jobs.claim_jobs('worker-a', 3)
+        second = jobs.claim_jobs('worker-b', 10)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(sorted(job.pk for job in first + second), sorted(job.pk for job in queued))
+        self.assertEqual(jobs.claim_jobs('worker-c', 10), [])
+        self.assertEqual(set(Job.objects.values_list('locked_by', flat=True)), {'worker-a', 'worker-b'})
+
+    def test_claim_from_a_stale_read_loses(self):
+        job = jobs.enqueue('test_ok')
+        real_filter = Job.objects.filter
+        raced = []
+
+        def filter_(*args, **lookups):
+            if lookups.get('status') == 'pending' and not raced:
+                raced.append(True)
+                read = list(real_filter(*args, **lookups).order_by('run_at'))
+                # worker-a claims between worker-b's read and its update
+                jobs.claim_jobs('worker-a', 10)
+                return mock.Mock(order_by=lambda *fields: read)
+            return real_filter(*args, **lookups)
+        with mock.patch.object(Job.objects, 'filter', filter_):
+            self.assertEqual(jobs.claim_jobs('worker-b', 10), [])
+        self.assertEqual(Job.objects.get(pk=job.pk).locked_by, 'worker-a')
+
+    def test_failing_job_backs_off_then_fails(self):
+        job = jobs.enqueue('test_failing', max_attempts=3)
+        delays = []
+        for attempt in range(1, 4):
+            started = timezone.now()
+            self.assertEqual(jobs.run_pending('worker-a'), 1)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn('ZeroDivisionError', job.last_error)
+            self.assertEqual(job.locked_by, '')
+            if attempt < 3:
+                self.assertEqual(job.status, 'pending')
+                delays.append((job.run_at - started).total_seconds())
+                # Not due until the back-off has passed
+                self.assertEqual(jobs.run_pending('worker-a'), 0)
+                self.make_due(job)
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(8 <= delays[0] <= 12.5 and 16 <= delays[1] <= 24.5, delays)
+        self.make_due(job)
+        self.assertEqual(jobs.run_pending('worker-a'), 0)
+
+    def test_stale_lock_is_reclaimed(self):
+        crashed = jobs.enqueue('test_ok', {'n': 1})
+        busy = jobs.enqueue('test_ok', {'n': 2})
+        now = timezone.now()
+        Job.objects.filter(pk=crashed.pk).update(
+            status='running', locked_by='gone', locked_at=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT + 1))
+        Job.objects.filter(pk=busy.pk).update(status='running', locked_by='alive', locked_at=now)
+
+        self.assertEqual([job.pk for job in jobs.claim_jobs('worker-b', 10)], [crashed.pk])
+        self.assertEqual(Job.objects.get(pk=crashed.pk).locked_by, 'worker-b')
+        self.assertEqual(Job.objects.get(pk=busy.pk).locked_by, 'alive')
+
+    def test_events_and_keys_enqueue_once(self):
+        first = jobs.enqueue('test_ok', {'n': 1}, idempotency_key='same')
+        self.assertEqual(jobs.enqueue('test_ok', {'n': 2}, idempotency_key='same').pk, first.pk)
+        order = make_order([(make_product(), 1)])
+        jobs.order_placed(order)
+        jobs.order_placed(order)
+        self.assertEqual(
+            sorted(Job.objects.exclude(pk=first.pk).values_list('name', flat=True)),
+            ['send_order_confirmation', 'update_recommendations'],
+        )
+
+    def test_worker_drains_the_queue(self):
+        for n in range(3):
+            jobs.enqueue('test_ok', {'n': n})
+        call_command('run_worker', processes=1, once=True, stdout=StringIO())
+        self.assertEqual(sorted(payload['n'] for payload in self.runs), [0, 1, 2])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {'done'})
+
+
+@skipUnless(connection.vendor == 'djongo', 'Needs a database that takes parallel writers')
+class ParallelJobTests(TransactionTestCase):
+    def test_parallel_claimers_never_share_a_job(self):
+        for n in range(40):
+            jobs.enqueue('test_ok', {'n': n})
+        claimed = []
+        run_in_threads(
+            lambda worker: claimed.extend(job.pk for job in jobs.claim_jobs(worker, 40)),
+            [(f'worker-{n}',) for n in range(4)],
+        )
+        self.assertEqual(len(claimed), len(set(claimed)))
+        self.assertEqual(len(claimed), 40)
+
+
+@override_settings(APPOINTMENT_REMINDER_HOURS=24, APPOINTMENT_PENDING_GRACE_HOURS=2)
+class SchedulerTests(TestCase):
+    now = datetime(2026, 10, 19, 12, 0)
+
+    def setUp(self):
+        self.user = User.objects.create_user('sara', 'sara@example.com', 'pw')
+        self.service = Service.objects.create(name='Full polish', description='', duration_minutes=90,
+                                              price=Decimal('25.00'))
+        # As left by the tick a minute ago
+        for name, position in (('reminders', self.now + timedelta(hours=24, minutes=-1)),
+                               ('stale_pending', self.now - timedelta(hours=2, minutes=1))):
+            SchedulerMark.objects.create(name=name, position=timezone.make_aware(position))
+
+    def appointments(self, starts, status='pending'):
+        return Appointment.objects.bulk_create([
+            Appointment(user=self.user, service=self.service, appointment_date=start.date(),
+                        appointment_time=start.time(), status=status)
+            for start in starts
+        ], batch_size=1000)
+
+    def tick(self):
+        """scheduler.tick() at self.now, returns its result and the rows each query read"""
+        read = []
+
+        def due(*args):
+            rows = due.real(*args)
+            read.append(len(rows))
+            return rows
+        due.real = scheduler.due
+        with mock.patch.object(scheduler, 'local_now', return_value=self.now), \
+                mock.patch.object(scheduler, 'due', due):
+            return scheduler.tick(), read
+
+    def test_tick_reads_only_the_due_window(self):
+        # Two years of history in every status, plus bookings weeks ahead
+        statuses = ['pending', 'confirmed', 'completed', 'cancelled']
+        for index, status in enumerate(statuses):
+            self.appointments([self.now - timedelta(days=day, hours=index) for day in range(1, 730)], status)
+            self.appointments([self.now + timedelta(days=day, hours=index) for day in range(2, 60)], status)
+        self.appointments([self.now + timedelta(hours=23, minutes=59, seconds=30)], 'confirmed')
+        self.appointments([self.now + timedelta(hours=24)])
+        start = self.now - timedelta(hours=2, seconds=30)
+        stale = Appointment.objects.create(user=self.user, service=self.service, appointment_date=start.date(),
+                                           appointment_time=start.time())
+        self.assertGreater(Appointment.objects.count(), 3000)
+
+        (reminded, cancelled), read = self.tick()
+        self.assertEqual((reminded, cancelled), (2, 1))
+        self.assertEqual(read, [2, 1])
+        self.assertEqual(Job.objects.filter(name='send_appointment_reminder').count(), 2)
+        self.assertEqual(Appointment.objects.get(pk=stale.pk).status, 'cancelled')
+
+        # The marks moved to the end of the windows, so a repeat reads nothing
+        self.assertEqual(self.tick(), ((0, 0), []))
+
+    @skipUnless(connection.vendor == 'sqlite', 'Djongo has no EXPLAIN; check MongoDB with explain() by hand')
+    def test_window_query_uses_the_index(self):
+        window = Appointment.objects.filter(status__in=scheduler.REMIND_STATUSES).filter(
+            scheduler.between(self.now, self.now + timedelta(hours=24))
+        )
+        self.assertIn(Appointment._meta.indexes[0].name, window.explain())
+
+    def test_mark_moved_by_another_run_is_reported(self):
+        def other_run_moves_mark(*args):
+            SchedulerMark.objects.filter(name='reminders').update(
+                position=timezone.make_aware(self.now + timedelta(hours=30))
+            )
+            return []
+        with mock.patch.object(scheduler, 'due', other_run_moves_mark), \
+                self.assertLogs('bookings.scheduler', 'WARNING') as logs:
+            scheduler.send_reminders(self.now, 500)
+        self.assertIn('reminders mark was moved', logs.output[0])
+        self.assertEqual(scheduler.get_mark('reminders'), self.now + timedelta(hours=30))
+
+    def test_enqueue_many_skips_keys_queued_meanwhile(self):
+        jobs.enqueue('send_appointment_reminder', {'appointment_id': 1}, 'reminder:1')
+        real_filter = Job.objects.filter
+        missed = iter([lambda **lookups: Job.objects.none()])  # The check runs before the other insert
+        with mock.patch.object(Job.objects, 'filter', lambda **lookups: next(missed, real_filter)(**lookups)):
+            jobs.enqueue_many('send_appointment_reminder', [
+                ({'appointment_id': pk}, f'reminder:{pk}') for pk in (1, 2, 3)
+            ])
+        self.assertEqual(
+            sorted(Job.objects.values_list('idempotency_key', flat=True)),
+            ['reminder:1', 'reminder:2', 'reminder:3'],
+        )
+
+
+class BlockingStream(StringIO):
+    """A stream whose writes wait until `release` is set"""
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+class LogTests(TestCase):
+    def make_logger(self, handler):
+        logger = logging.getLogger(f'bookings.tests.{self._testMethodName}')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def stop(self, handler):
+        handler._listener.stop()  # Flushes what is queued
+
+    def test_records_are_written_as_json_by_the_listener(self):
+        stream = StringIO()
+        handler = log.NonBlockingHandler(stream)
+        handler.addFilter(log.RequestIdFilter())
+        logger = self.make_logger(handler)
+        token = log.request_id.set('req-1')
+        self.addCleanup(log.request_id.reset, token)
+        cart = ['wax']
+        logger.info('Cart %s', cart, extra={'cart_id': 7})
+        cart.append('polish')  # After the call, so it must not show
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('Failed')
+        self.stop(handler)
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual((first['level'], first['message'], first['cart_id']), ('INFO', "Cart ['wax']", 7))
+        self.assertEqual(first['request_id'], 'req-1')
+        self.assertIn('ZeroDivisionError', second['exc'])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        stream = BlockingStream()
+        handler = log.NonBlockingHandler(stream, maxsize=5)
+        logger = self.make_logger(handler)
+        started = time.monotonic()
+        for n in range(100):
+            logger.info('Record %d', n)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertGreaterEqual(handler.dropped, 90)
+        stream.release.set()
+        self.stop(handler)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        reports = [line for line in lines if 'dropped' in line]
+        self.assertEqual(len(lines) - len(reports), 100 - handler.dropped)
+        # Reported once the listener catches up; nothing was dropped after
+        self.assertEqual([report['dropped'] for report in reports], [handler.dropped])
+        self.assertEqual(reports[0]['level'], 'WARNING')
+
+    def test_drops_are_reported_periodically_and_at_stop(self):
+        stream = StringIO()
+        handler = log.NonBlockingHandler(stream)
+        logger = self.make_logger(handler)
+        logger.info('First')  # Starts the listener
+        handler.dropped = 3  # As if the queue had been full
+        logger.info('Second')
+        handler._listener.queue.join()
+        handler.dropped += 2  # Within report_seconds of the first report
+        self.stop(handler)
+        reports = [json.loads(line) for line in stream.getvalue().splitlines() if 'dropped' in line]
+        self.assertEqual([report['dropped'] for report in reports], [3, 2])
+
+    def test_sampling_keeps_warnings_and_caps_the_rate(self):
+        sampling = log.SamplingFilter({'chatty': {'sample_rate': 0, 'max_per_second': 3}})
+        record = lambda name, level: logging.makeLogRecord({'name': name, 'levelno': level})
+        self.assertFalse(sampling.filter(record('chatty.child', logging.INFO)))
+        self.assertTrue(sampling.filter(record('quiet', logging.INFO)))
+        kept = [sampling.filter(record('chatty', logging.ERROR)) for _ in range(10)]
+        self.assertEqual(kept.count(True), 3)
+
+    def test_request_id_is_echoed_and_tags_the_request_logs(self):
+        records = []
+        handler = logging.Handler()
+        handler.addFilter(log.RequestIdFilter())
+        handler.emit = records.append
+        logger = logging.getLogger('django.request')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        response = self.client.get('/no-such-page/', HTTP_X_REQUEST_ID='edge-42')
+        self.assertEqual(response['X-Request-ID'], 'edge-42')
+        # Logged by the handler after the middleware has returned
+        self.assertEqual([record.request_id for record in records], ['edge-42'])
+        # ...and forgotten once the response is closed
+        self.assertEqual(log.request_id.get(), '-')
+
+        response = self.client.get(reverse('readiness'), HTTP_X_REQUEST_ID='not valid!')
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import views, async_views
+
+# Under ASGI the hot shop/cart endpoints use the async views
+shop_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -14,10 +18,17 @@ urlpatterns = [
     path('submit-rating/', views.submit_rating, name='submit_rating'),
     
     # Shop URLs
-    path('shop/', views.shop, name='shop'),
-    path('cart/', views.view_cart, name='view_cart'),
-    path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('update-cart/<int:product_id>/', views.update_cart, name='update_cart'),
+    path('shop/', shop_views.shop, name='shop'),
+    path('catalog.json', shop_views.catalog, name='catalog'),
+    path('cart/', shop_views.view_cart, name='view_cart'),
+    path('add-to-cart/<int:product_id>/', shop_views.add_to_cart, name='add_to_cart'),
+    path('update-cart/<int:product_id>/', shop_views.update_cart, name='update_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('order-confirmation/<str:order_number>/', views.order_confirmation, name='order_confirmation'),
+    
+    path('health/ready/', views.readiness, name='readiness'),
+    
+    # Staff URLs
+    path('staff/sales/', views.sales_dashboard, name='sales_dashboard'),
+    path('staff/dispatch/', views.dispatch_plan, name='dispatch_plan'),
 ]
\ No newline at end of file
@@ -1,14 +1,28 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib import messages
 from django.db.models import Avg, Count, Q
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_POST
-from .models import Service, Appointment, Rating, Product, Cart, CartItem, Order, OrderItem
+from django.utils import timezone
+from .models import (
+    Service, Appointment, Rating, Product, Cart, CartItem, Order, OrderItem,
+    DailySales, DailyProductSales,
+)
 from .forms import RatingForm
+from .db import delete_returning, increment, price_to_float
+from .ids import new_order_number
+from . import archive, dispatch, inventory, jobs, recommendations, rollups, warmup
+import logging
 import uuid
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
 
 # Existing Views
 def home(request):
@@ -38,13 +52,15 @@ def book_appointment(request, service_id):
         appointment_time = request.POST.get('appointment_time')
         customer_notes = request.POST.get('customer_notes', '')
         
-        Appointment.objects.create(
+        appointment = Appointment.objects.create(
             user=request.user,
             service=service,
             appointment_date=appointment_date,
             appointment_time=appointment_time,
             customer_notes=customer_notes
         )
+        # Confirmations etc. run in the background worker
+        jobs.appointment_booked(appointment)
         messages.success(request, f'Appointment for {service.name} booked successfully!')
         return redirect('my_appointments')
     
@@ -53,7 +69,14 @@ def book_appointment(request, service_id):
 @login_required
 def my_appointments(request):
     appointments = Appointment.objects.filter(user=request.user)
-    return render(request, 'bookings/my_appointments.html', {'appointments': appointments})
+    return render(request, 'bookings/my_appointments.html', {
+        'appointments': appointments,
+        'events_url': live_status_url('/events/appointments/'),
+    })
+
+def live_status_url(path):
+    """Status stream URL, served by bookings/sse.py only under ASGI"""
+    return path if settings.ASYNC_VIEWS else ''
 
 # Rating Views
 def reviews(request):
@@ -112,13 +135,8 @@ def submit_rating(request):
     return render(request, 'bookings/submit_rating.html', {'form': form})
 
 # Shop Views
-def shop(request):
-    """Display all products"""
-    from bookings.models import Product
-    
-    category = request.GET.get('category', '')
-    car_make = request.GET.get('car_make', '')
-    
+def get_shop_products(category='', car_make=''):
+    """Available products, optionally filtered by category and car make"""
     try:
         # Get all products
         all_products = Product.objects.all()
@@ -139,42 +157,116 @@ def shop(request):
             
             products.append(p)
         
-        print(f"Found {len(products)} products")
+        logger.debug('Found %d products', len(products))
         
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception('Could not load shop products')
         products = []
     
-    categories = Product.CATEGORY_CHOICES
-    car_makes = Product.CAR_MAKE_CHOICES
-    
-    context = {
+    return inventory.attach_stock_levels(products)
+
+def shop_context(products, category='', car_make=''):
+    return {
         'products': products,
-        'categories': categories,
-        'car_makes': car_makes,
+        'categories': Product.CATEGORY_CHOICES,
+        'car_makes': Product.CAR_MAKE_CHOICES,
         'selected_category': category,
         'selected_car_make': car_make,
     }
-    return render(request, 'bookings/shop.html', context)
+
+def attach_bought_with(products, limit=3):
+    """Set product.bought_with to its most frequent co-purchases"""
+    neighbours = recommendations.neighbour_map([p.id for p in products])
+    by_id = {p.id: p for p in products}
+    missing = {n for ids in neighbours.values() for n in ids[:limit]} - set(by_id)
+    if missing:
+        by_id.update((p.id, p) for p in Product.objects.filter(id__in=missing))
+    for p in products:
+        p.bought_with = [by_id[n] for n in neighbours.get(p.id, [])[:limit] if n in by_id]
+    return products
+
+def shop(request):
+    """Display all products"""
+    category = request.GET.get('category', '')
+    car_make = request.GET.get('car_make', '')
+    
+    products = attach_bought_with(get_shop_products(category, car_make))
+    return render(request, 'bookings/shop.html', shop_context(products, category, car_make))
+
+def catalog_data(category='', car_make=''):
+    """JSON-serialisable list of available products"""
+    return [
+        {
+            'id': p.id,
+            'name': p.name,
+            'category': p.category,
+            'car_make': p.car_make,
+            'price': round(price_to_float(p.price), 3),
+            'image_url': p.image_url,
+            'stock_quantity': p.stock_level,
+        }
+        for p in get_shop_products(category, car_make)
+    ]
+
+def catalog(request):
+    """Product catalog as JSON"""
+    products = catalog_data(request.GET.get('category', ''), request.GET.get('car_make', ''))
+    return JsonResponse({'products': products})
+
+# Session key holding the Cart.session_id token. A separate token (rather
+# than the session key itself) keeps carts working with the signed_cookies
+# and cache session engines, whose keys are not stable database ids.
+CART_SESSION_KEY = 'cart_key'
+
+def session_cart_key(request):
+    """The session's cart token, '' or None if it has no cart.
+    
+    Carts used to be keyed by the session key itself. A session from then
+    is checked for such a cart once, and adopts its key if there is one.
+    """
+    cart_key = request.session.get(CART_SESSION_KEY)
+    if cart_key is None and request.session.session_key:
+        legacy_key = request.session.session_key
+        found = Cart.objects.filter(session_id=legacy_key).exists()
+        cart_key = request.session[CART_SESSION_KEY] = legacy_key if found else ''
+    return cart_key
+
+def get_cart(request):
+    """Return the session's cart, or None if nothing was ever added.
+    
+    Read-only pages use this so browsing never creates a session or a Cart.
+    """
+    cart_key = session_cart_key(request)
+    if not cart_key:
+        return None
+    return Cart.objects.filter(session_id=cart_key).first()
+
+def cart_count(**lookup):
+    """Item count of the matching cart (0 if none), one indexed read"""
+    return Cart.objects.filter(**lookup).values_list('item_count', flat=True).first() or 0
 
 def get_or_create_cart(request):
-    """Get or create a cart for the current session"""
-    session_key = request.session.session_key
-    if not session_key:
-        request.session.create()
-        session_key = request.session.session_key
+    """Get or create a cart for the current session, only call on mutations"""
+    cart_key = session_cart_key(request)
+    if not cart_key:
+        cart_key = uuid.uuid4().hex
+        request.session[CART_SESSION_KEY] = cart_key
     
-    cart, created = Cart.objects.get_or_create(session_id=session_key)
+    cart, created = Cart.objects.get_or_create(session_id=cart_key)
     return cart
 
-@require_POST
-def add_to_cart(request, product_id):
-    """Add a product to cart"""
+def add_product_to_cart(request, product_id, quantity):
+    """Add quantity of a product to the session cart, returns the JSON payload"""
     product = get_object_or_404(Product, id=product_id)
+    # Net of this cart's own holds, which are replaced below
+    available = inventory.stock_level(product.id)
+    if quantity > available:
+        return {
+            'success': False,
+            'message': f'Only {max(available, 0)} {product.name} left in stock.'
+        }
     cart = get_or_create_cart(request)
     
-    quantity = int(request.POST.get('quantity', 1))
-    
     # Check if product already in cart
     cart_item, created = CartItem.objects.get_or_create(
         cart=cart,
@@ -183,20 +275,51 @@ def add_to_cart(request, product_id):
     )
     
     if not created:
-        cart_item.quantity += quantity
-        cart_item.save()
+        increment(CartItem, cart_item.pk, quantity=quantity)
+    cart.add_items(quantity, rollups.to_decimal(product.price))
+    inventory.hold_cart(cart)
     
-    return JsonResponse({
+    return {
         'success': True,
-        'cart_count': cart.get_item_count(),
+        'cart_count': cart_count(pk=cart.pk),
         'message': f'{product.name} added to cart!'
-    })
+    }
 
-def view_cart(request):
-    """View shopping cart"""
+def posted_quantity(request):
+    """The POSTed quantity, or None unless it is a whole number of at least 1"""
     try:
-        cart = get_or_create_cart(request)
-        cart_items = list(cart.items.all())
+        quantity = int(request.POST.get('quantity', 1))
+    except ValueError:
+        return None
+    return quantity if quantity >= 1 else None
+
+def invalid_quantity_response():
+    return JsonResponse(
+        {'success': False, 'message': 'Quantity must be a whole number of at least 1.'}, status=400
+    )
+
+@require_POST
+def add_to_cart(request, product_id):
+    """Add a product to cart"""
+    quantity = posted_quantity(request)
+    if quantity is None:
+        return invalid_quantity_response()
+    return JsonResponse(add_product_to_cart(request, product_id, quantity))
+
+class ProcessedItem:
+    """Cart item with its price already converted from Decimal128"""
+    def __init__(self, cart_item, calculated_price, calculated_subtotal):
+        self.id = cart_item.id
+        self.product = cart_item.product
+        self.quantity = cart_item.quantity
+        self.price = round(calculated_price, 3)
+        self.get_total_price = round(calculated_subtotal, 3)
+
+def cart_context(request):
+    """Template context for the cart page"""
+    try:
+        cart = get_cart(request)
+        cart_items = list(cart.items.all()) if cart else []
         
         # Process items to handle Decimal128
         processed_items = []
@@ -206,97 +329,113 @@ def view_cart(request):
         for item in cart_items:
             try:
                 # Handle Djongo's Decimal128 type
-                price_value = item.product.price
-                
-                # Convert Decimal128 to float
-                if hasattr(price_value, 'to_decimal'):
-                    price = float(price_value.to_decimal())
-                elif isinstance(price_value, str):
-                    price = float(price_value)
-                else:
-                    price = float(str(price_value))
-                
+                price = price_to_float(item.product.price)
                 subtotal = price * item.quantity
                 
-                # Create a simple object to hold processed data
-                class ProcessedItem:
-                    def __init__(self, cart_item, calculated_price, calculated_subtotal):
-                        self.id = cart_item.id
-                        self.product = cart_item.product
-                        self.quantity = cart_item.quantity
-                        self.price = round(calculated_price, 3)
-                        self.get_total_price = round(calculated_subtotal, 3)
-                
-                processed_item = ProcessedItem(item, price, subtotal)
-                processed_items.append(processed_item)
+                processed_items.append(ProcessedItem(item, price, subtotal))
                 
                 total += subtotal
                 total_count += item.quantity
                 
             except Exception as e:
-                print(f"Error processing item: {e}")
+                logger.warning('Skipped cart item %s: %s', item.pk, e)
                 continue
         
+        # Prices may have changed since the items were added
+        if cart and (cart.item_count != total_count or price_to_float(cart.total) != round(total, 3)):
+            Cart.objects.filter(pk=cart.pk).update(
+                item_count=total_count, total=rollups.to_decimal(total)
+            )
+        
         context = {
             'cart_items': processed_items,
             'total': round(total, 3),
-            'cart_count': total_count
+            'cart_count': total_count,
         }
         
-    except Exception as e:
-        print(f"Cart error: {e}")
-        context = {
+    except Exception:
+        logger.exception('Could not load cart')
+        return {
             'cart_items': [],
             'total': 0,
             'cart_count': 0
         }
     
-    return render(request, 'bookings/cart.html', context)
+    # Suggestions are optional, failing to load them mustn't empty the cart
+    try:
+        context['recommendations'] = recommendations.recommend(item.product.id for item in processed_items)
+    except Exception:
+        logger.exception('Could not load recommendations')
+        context['recommendations'] = []
+    return context
 
+def view_cart(request):
+    """View shopping cart"""
+    return render(request, 'bookings/cart.html', cart_context(request))
 
-@require_POST
-def update_cart(request, product_id):  # Changed from item_id to product_id
-    """Update cart item quantity"""
-    cart = get_or_create_cart(request)
+
+def apply_cart_action(request, product_id, action):
+    """Increase, decrease or remove a cart item, returns the flash message"""
+    cart = get_cart(request)
+    if cart is None:
+        raise Http404('Cart is empty')
     
     # Find cart item by product_id instead
-    try:
-        product = get_object_or_404(Product, id=product_id)
-        cart_item = get_object_or_404(CartItem, cart=cart, product=product)
-    except CartItem.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Item not found'})
-    
-    action = request.POST.get('action')
+    product = get_object_or_404(Product, id=product_id)
+    cart_item = get_object_or_404(CartItem, cart=cart, product=product)
     
     if action == 'increase':
-        cart_item.quantity += 1
-        cart_item.save()
-        messages.success(request, f'Updated {product.name} quantity')
-    elif action == 'decrease':
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-            messages.success(request, f'Updated {product.name} quantity')
-        else:
-            cart_item.delete()
-            messages.success(request, f'Removed {product.name} from cart')
-    elif action == 'remove':
-        cart_item.delete()
-        messages.success(request, f'Removed {product.name} from cart')
+        if inventory.stock_level(product.id) < 1:
+            return f'Sorry, no more {product.name} in stock'
+        change = 1
+        increment(CartItem, cart_item.pk, quantity=change)
+        message = f'Updated {product.name} quantity'
+    # Only while more than one is left, so concurrent decreases stop at one
+    elif action == 'decrease' and increment(CartItem, cart_item.pk, where={'quantity__gt': 1}, quantity=-1):
+        change = -1
+        message = f'Updated {product.name} quantity'
+    elif action in ('decrease', 'remove'):
+        # What the delete removed, which may differ from what was read above
+        change = -(delete_returning(CartItem, cart_item.pk, 'quantity') or 0)
+        message = f'Removed {product.name} from cart'
+    else:
+        return None
+    cart.add_items(change, rollups.to_decimal(product.price))
+    inventory.hold_cart(cart)
+    return message
+
+@require_POST
+def update_cart(request, product_id):  # Changed from item_id to product_id
+    """Update cart item quantity"""
+    message = apply_cart_action(request, product_id, request.POST.get('action'))
+    if message:
+        messages.success(request, message)
     
     # Redirect back to cart page instead of JSON response
     return redirect('view_cart')
 
 def checkout(request):
     """Checkout page"""
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
     
     if request.method == 'POST':
-        # Create order
-        order_number = f"ORD-{uuid.uuid4().hex[:8].upper()}"
+        if cart is None:
+            messages.error(request, 'Your cart is empty.')
+            return redirect('view_cart')
         
-        # Calculate total manually with Decimal128 handling
         cart_items = list(cart.items.all())
+        # The cart's holds may have expired and the stock sold meanwhile
+        short = inventory.hold_for_checkout(cart)
+        if short:
+            for item in cart_items:
+                if item.product_id in short:
+                    messages.error(
+                        request,
+                        f'Sorry, only {max(short[item.product_id], 0)} {item.product.name} left in stock.'
+                    )
+            return redirect('view_cart')
+        
+        # Calculate total manually with Decimal128 handling
         total = 0
         
         for item in cart_items:
@@ -308,7 +447,7 @@ def checkout(request):
             total += price * item.quantity
         
         order = Order.objects.create(
-            order_number=order_number,
+            order_number=new_order_number(),
             customer_name=request.POST.get('name'),  # Changed from 'customer_name'
             customer_phone=request.POST.get('phone'),  # Changed from 'customer_phone'
             customer_email=request.POST.get('email', ''),  # Changed from 'customer_email'
@@ -325,6 +464,7 @@ def checkout(request):
         )
         
         # Create order items
+        order_items = []
         for cart_item in cart_items:
             price_value = cart_item.product.price
             if hasattr(price_value, 'to_decimal'):
@@ -332,21 +472,29 @@ def checkout(request):
             else:
                 price = float(str(price_value))
             
-            OrderItem.objects.create(
+            order_items.append(OrderItem.objects.create(
                 order=order,
                 product=cart_item.product,
                 product_name=cart_item.product.name,
                 quantity=cart_item.quantity,
                 price=price
-            )
+            ))
+        
+        # Clear the ordered items, taking off what each delete removed, so an
+        # item added meanwhile stays in the cart and in its counters
+        for cart_item in cart_items:
+            removed = delete_returning(CartItem, cart_item.pk, 'quantity') or 0
+            cart.add_items(-removed, rollups.to_decimal(cart_item.product.price))
+        # Its held stock becomes sold stock
+        inventory.record_sale(order, order_items, cart.session_id)
         
-        # Clear cart
-        cart.items.all().delete()
+        # Confirmation email etc. run in the background worker
+        jobs.order_placed(order)
         
         return redirect('order_confirmation', order_number=order.order_number)
     
     # GET request - show checkout form
-    cart_items = list(cart.items.all())
+    cart_items = list(cart.items.all()) if cart else []
     
     # Process items for display
     processed_items = []
@@ -381,7 +529,7 @@ def checkout(request):
 
 def order_confirmation(request, order_number):
     """Order confirmation page"""
-    order = get_object_or_404(Order, order_number=order_number)
+    order = archive.get_order_or_404(order_number)
     
     # Process order items to handle Decimal128
     order_items = []
@@ -411,10 +559,82 @@ def order_confirmation(request, order_number):
     context = {
         'order': order,
         'order_items': order_items,
-        'total_amount': round(total_amount, 3)
+        'total_amount': round(total_amount, 3),
+        'events_url': live_status_url(f'/events/order/{order.order_number}/'),
     }
     return render(request, 'bookings/order_confirmation.html', context)
 
 def booking(request):
     services = Service.objects.all()
-    return render(request, 'bookings/booking.html', {'services': services})
\ No newline at end of file
+    return render(request, 'bookings/booking.html', {'services': services})
+
+@never_cache
+def readiness(request):
+    """200 once this worker has warmed up, 503 before (for load balancer checks)"""
+    warmup.retry()
+    return JsonResponse(warmup.state, status=200 if warmup.state['ready'] else 503)
+
+# Staff reports
+DASHBOARD_DAY_OPTIONS = [7, 30, 90, 365]
+
+def _group_sales(rows, key):
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(key(row), {'label': key(row), 'orders': 0, 'revenue': 0})
+        group['orders'] += row.order_count
+        group['revenue'] += price_to_float(row.revenue)
+    return list(groups.values())
+
+@staff_member_required
+def sales_dashboard(request):
+    """Sales report read only from the daily rollups, never from Order/OrderItem"""
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        days = 30
+    if days not in DASHBOARD_DAY_OPTIONS:
+        days = 30
+    
+    today = timezone.localdate()
+    sales = list(DailySales.objects.filter(date__gte=today - timedelta(days=days - 1)))
+    product_sales = DailyProductSales.objects.filter(date__gte=today - timedelta(days=6))
+    
+    top_products = {}
+    for row in product_sales:
+        product = top_products.setdefault(row.product_name, {'label': row.product_name, 'quantity': 0, 'revenue': 0})
+        product['quantity'] += row.quantity
+        product['revenue'] += price_to_float(row.revenue)
+    
+    payment_labels = dict(Order.PAYMENT_METHOD_CHOICES)
+    by_day = sorted(_group_sales(sales, lambda r: r.date), key=lambda g: g['label'], reverse=True)
+    by_area = sorted(_group_sales(sales, lambda r: r.area), key=lambda g: g['revenue'], reverse=True)
+    by_payment_method = _group_sales(sales, lambda r: payment_labels.get(r.payment_method, r.payment_method))
+    
+    context = {
+        'days': days,
+        'day_options': DASHBOARD_DAY_OPTIONS,
+        'total_orders': sum(row.order_count for row in sales),
+        'total_revenue': sum(price_to_float(row.revenue) for row in sales),
+        'by_day': by_day,
+        'by_area': by_area,
+        'by_payment_method': by_payment_method,
+        'top_products': sorted(top_products.values(), key=lambda p: p['revenue'], reverse=True)[:10],
+    }
+    return render(request, 'bookings/sales_dashboard.html', context)
+
+@staff_member_required
+def dispatch_plan(request):
+    """Confirmed orders grouped into driver batches, stops in delivery order"""
+    try:
+        capacity = int(request.GET.get('capacity', dispatch.DEFAULT_CAPACITY))
+    except ValueError:
+        capacity = dispatch.DEFAULT_CAPACITY
+    capacity = min(max(capacity, 1), 100)
+    
+    batches = dispatch.plan(capacity)
+    context = {
+        'capacity': capacity,
+        'batches': batches,
+        'order_count': sum(len(batch) for batch in batches),
+    }
+    return render(request, 'bookings/dispatch.html', context)
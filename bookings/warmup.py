@@ -0,0 +1,170 @@
+"""Startup warm-up for WSGI/ASGI workers.
+
+wsgi.py and asgi.py call run() before the worker takes traffic, so the first
+real requests don't pay for populating the URL resolver, compiling
+templates, importing and priming the Djongo SQL translation and opening the
+MongoDB connection. /health/ready/ answers 503 until it has finished.
+
+uvicorn imports the application inside its running event loop, where the
+ORM and the sync request handler refuse to run, so there the steps run on a
+thread of their own while the import waits. Either way the worker takes
+traffic only once warm-up is done.
+
+A failed step (MongoDB not up yet, say) doesn't fail the worker for good:
+the readiness probe re-runs it and the steps after it, waiting twice as
+long after each failure, up to RETRY_MAX_SECONDS.
+"""
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.template.loader import get_template
+from django.urls import resolve, reverse
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+# Rendered once each, which runs their queries and fills the page cache
+WARM_URLS = ['/', '/shop/', '/reviews/', '/catalog.json']
+
+# Backoff between retries of a failed step
+RETRY_SECONDS = 1
+RETRY_MAX_SECONDS = 60
+
+state = {'ready': False, 'seconds': None, 'steps': {}, 'error': '', 'attempts': 0}
+_retry = {'at': 0.0}
+_retry_lock = threading.Lock()
+
+
+def template_names():
+    for root, dirs, files in os.walk(TEMPLATE_DIR):
+        for filename in files:
+            if filename.endswith('.html'):
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, TEMPLATE_DIR).replace(os.sep, '/')
+
+
+def warm_urls():
+    reverse('home')  # Builds the reverse lookup tables
+    for url in WARM_URLS:
+        resolve(url)  # Imports the view modules
+
+
+def warm_templates():
+    """Compile every app template; kept when the cached loader is on"""
+    for name in template_names():
+        get_template(name)
+
+
+def warm_connections():
+    connection.ensure_connection()
+    if settings.ASYNC_VIEWS:
+        # Imported here: async_views imports views, which imports this module
+        from .async_views import get_db_executor
+
+        # Every pool thread has its own connection. The barrier keeps each
+        # task busy until all have started, so each lands on its own thread.
+        barrier = threading.Barrier(settings.ASYNC_DB_THREADS, timeout=30)
+
+        def connect():
+            connection.ensure_connection()
+            barrier.wait()
+
+        tasks = [get_db_executor().submit(connect) for _ in range(settings.ASYNC_DB_THREADS)]
+        for task in tasks:
+            task.result()
+
+
+def warm_host():
+    """Host the pages are rendered for; the page cache is keyed on it"""
+    if settings.WARMUP_HOST:
+        return settings.WARMUP_HOST
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def render_pages():
+    handler = WSGIHandler()
+    for url in WARM_URLS:
+        statuses = []
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': url,
+            'QUERY_STRING': '',
+            'SERVER_NAME': warm_host(),
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_ACCEPT_ENCODING': 'gzip, deflate, br',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': io.StringIO(),
+        }
+        response = handler(environ, lambda status, headers: statuses.append(status))
+        response.close()
+        if not statuses[0].startswith('200'):
+            raise RuntimeError(f'GET {url} returned {statuses[0]}')
+
+
+STEPS = [
+    ('urls', warm_urls),
+    ('templates', warm_templates),
+    ('connections', warm_connections),
+    ('pages', render_pages),
+]
+
+
+def run():
+    """Run every warm-up step once and record how long each took"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        run_steps()
+    else:
+        thread = threading.Thread(target=run_steps, name='warmup')
+        thread.start()
+        thread.join()
+
+
+def retry():
+    """Re-run the failed steps once their backoff is over (readiness probe)"""
+    if state['ready'] or not state['error'] or time.monotonic() < _retry['at']:
+        return
+    # Probes arriving meanwhile answer 503 rather than queue up behind it
+    if _retry_lock.acquire(blocking=False):
+        try:
+            run()
+        finally:
+            _retry_lock.release()
+
+
+def run_steps():
+    started = time.monotonic()
+    state['error'] = ''
+    state['attempts'] += 1
+    if settings.WARMUP:
+        for name, step in STEPS:
+            if name in state['steps']:
+                continue  # Done by an earlier attempt
+            step_started = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                state['error'] = f'{name}: {e}'
+                backoff = min(RETRY_SECONDS * 2 ** (state['attempts'] - 1), RETRY_MAX_SECONDS)
+                _retry['at'] = time.monotonic() + backoff
+                logger.exception('Warm-up step %s failed, retrying in %ss', name, backoff)
+                break
+            state['steps'][name] = round(time.monotonic() - step_started, 3)
+    state['ready'] = not state['error']
+    state['seconds'] = round(time.monotonic() - started, 3)
+    logger.info('Warm-up finished in %.3fs %s', state['seconds'], state['steps'])
+
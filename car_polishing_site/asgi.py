@@ -5,12 +5,38 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+
+Optional: production serves wsgi.py. This is needed for the live status
+streams; benchmark it (manage.py benchmark_views) before switching. Run with
+uvicorn, e.g.:
+
+    uvicorn car_polishing_site.asgi:application --workers 4
+
+Loading this module turns on the async shop/cart views (DJANGO_ASYNC_VIEWS),
+serves the live status streams (bookings/sse.py) and warms each worker up
+before it serves; see bookings/warmup.py.
 """
 
 import os
 
 from django.core.asgi import get_asgi_application
 
+from bookings import warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'car_polishing_site.settings')
+os.environ.setdefault('DJANGO_CACHED_TEMPLATES', '1')
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Imports models, so only once Django is set up
+from bookings.events import check_broker  # noqa: E402
+from bookings.sse import with_event_streams  # noqa: E402
+
+# Several workers need a broker that reaches all of them
+check_broker()
+
+application = with_event_streams(application)
+
+# Warm this worker up before it takes traffic (bookings/warmup.py)
+warmup.run()
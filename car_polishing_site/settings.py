@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,15 +42,57 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bookings.middleware.RequestIdMiddleware',
+    'bookings.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bookings.middleware.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Full-page cache, off by default. The compression middleware sits inside
+# UpdateCacheMiddleware, so cached pages are stored already compressed. The
+# request id middleware stays outside it, so ids are never cached.
+PAGE_CACHE_SECONDS = int(os.environ.get('DJANGO_PAGE_CACHE_SECONDS', '0'))
+if PAGE_CACHE_SECONDS:
+    MIDDLEWARE = (
+        MIDDLEWARE[:1]
+        + ['django.middleware.cache.UpdateCacheMiddleware']
+        + MIDDLEWARE[1:]
+        + ['django.middleware.cache.FetchFromCacheMiddleware']
+    )
+    CACHE_MIDDLEWARE_SECONDS = PAGE_CACHE_SECONDS
+
+# Pages get their own cache so clearing it (bookings.middleware.clear_page_cache)
+# never drops cache-backed sessions. The rate-limit buckets are shared by
+# every worker process: in memcached, or in MongoDB (bookings/cache.py) when
+# DJANGO_RATE_LIMIT_MEMCACHED is set empty.
+RATE_LIMIT_MEMCACHED = os.environ.get('DJANGO_RATE_LIMIT_MEMCACHED', '127.0.0.1:11211')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pages'},
+    'ratelimit': (
+        {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': RATE_LIMIT_MEMCACHED}
+        if RATE_LIMIT_MEMCACHED else
+        {'BACKEND': 'bookings.cache.MongoCache', 'LOCATION': 'bookings_cache'}
+    ),
+}
+CACHE_MIDDLEWARE_ALIAS = 'pages'
+
+# Order numbers embed a node id (0-1023) that no two running processes
+# share: each process claims one from a MongoDB counter with its first order
+# number. Setting DJANGO_ORDER_NODE_ID fixes it instead, for a lone process
+# (e.g. a database without that counter); never give two processes the same.
+ORDER_NODE_ID = int(os.environ['DJANGO_ORDER_NODE_ID']) if 'DJANGO_ORDER_NODE_ID' in os.environ else None
+
+# Strip indentation from rendered HTML before it is compressed
+HTML_MINIFY = True
+
 ROOT_URLCONF = 'car_polishing_site.urls'
 
 TEMPLATES = [
@@ -63,13 +106,44 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'bookings.context_processors.cart_badge',
             ],
         },
     },
 ]
 
+# Served through wsgi.py/asgi.py, compiled templates are kept per process (and
+# preloaded by bookings/warmup.py); runserver keeps re-reading them on edits.
+if os.environ.get('DJANGO_CACHED_TEMPLATES') == '1':
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'car_polishing_site.wsgi.application'
 
+# Async shop/cart views, switched on by car_polishing_site/asgi.py.
+# Djongo is sync-only, so async views run their queries on a bounded pool.
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+ASYNC_DB_THREADS = int(os.environ.get('DJANGO_ASYNC_DB_THREADS', '8'))
+
+# Live order/appointment status over Server-Sent Events (bookings/sse.py,
+# ASGI only). MongoBroker reaches every worker, the admin and the job worker.
+# bookings.events.LocalBroker only reaches clients of the process that saved
+# the change, so asgi.py refuses to start several workers with it.
+EVENT_BROKER = os.environ.get('DJANGO_EVENT_BROKER', 'bookings.events.MongoBroker')
+SSE_HEARTBEAT_SECONDS = 15
+
+# Warm each worker up before it serves (bookings/warmup.py). Checked by the
+# load balancer through /health/ready/.
+WARMUP = os.environ.get('DJANGO_WARMUP', '1') == '1'
+# Host the warm-up renders pages for, so the page cache is primed for it.
+# Defaults to the first ALLOWED_HOSTS entry.
+WARMUP_HOST = os.environ.get('DJANGO_WARMUP_HOST', '')
+
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
@@ -81,7 +155,10 @@ DATABASES = {
         'CLIENT': {
             'host': 'localhost',
             'port': 27017,
-        }
+        },
+        # Keep each thread's MongoClient (and its pool) across requests instead
+        # of reconnecting every time; pymongo reconnects on its own if needed
+        'CONN_MAX_AGE': None,
     }
 }
 
@@ -126,7 +203,87 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     BASE_DIR / 'bookings' / 'static',
 ]
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed copies (lexus-oil.3f2a9c1b7d4e.png) plus
+# gzip/brotli siblings, and WhiteNoise serves those with far-future, immutable
+# cache headers. Run `manage.py build_product_images` and
+# `manage.py build_bundles` first to include the product thumbnails and the
+# CSS/JS bundles extracted from the templates.
+STATICFILES_STORAGE = 'bookings.storage.StaticFilesStorage'
 
 
 LOGIN_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
+
+# Sessions
+# Carts are created on the first add-to-cart, so read-only browsing never
+# writes a session. To keep shopper sessions out of MongoDB altogether set
+# DJANGO_SESSION_ENGINE to 'django.contrib.sessions.backends.signed_cookies'
+# or 'django.contrib.sessions.backends.cache'.
+SESSION_ENGINE = os.environ.get('DJANGO_SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
+# Background jobs (manage.py run_worker). A job locked by a worker for
+# longer than this is assumed orphaned and picked up again.
+JOB_LOCK_TIMEOUT = 600
+
+# Appointment scheduler (manage.py run_scheduler, bookings/scheduler.py):
+# reminders go out this long before the appointment, and bookings still
+# pending this long after their start time are cancelled
+APPOINTMENT_REMINDER_HOURS = 24
+APPOINTMENT_PENDING_GRACE_HOURS = 2
+
+# Stock held for a cart is returned to the shelf after this long without a
+# cart change or checkout (see bookings/inventory.py)
+STOCK_RESERVATION_MINUTES = 15
+
+# Logging (bookings/log.py): one JSON object per line on stdout, tagged with
+# the request id. Records are written by a background thread, so a slow
+# stdout never holds up a request; when its queue is full they are dropped.
+# LOG_SAMPLING thins out chatty loggers: `sample_rate` applies below WARNING,
+# `max_per_second` to every record of that logger and its children.
+LOG_LEVEL = os.environ.get('DJANGO_LOG_LEVEL', 'INFO')
+LOG_SAMPLING = {
+    'bookings.views': {'sample_rate': 0.1, 'max_per_second': 50},
+    'django.request': {'max_per_second': 20},
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'bookings.log.RequestIdFilter'},
+        'sampling': {'()': 'bookings.log.SamplingFilter', 'rules': LOG_SAMPLING},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'bookings.log.NonBlockingHandler',
+            'stream': 'ext://sys.stdout',
+            'filters': ['sampling', 'request_id'],
+        },
+    },
+    'loggers': {
+        'bookings': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+        'django': {'handlers': ['queue'], 'level': 'INFO', 'propagate': False},
+    },
+    'root': {'handlers': ['queue'], 'level': 'WARNING'},
+}
+
+# Rate limits for POSTs, by URL name (bookings/ratelimit.py): `burst`
+# requests at once, refilled at `per_minute`, per client `key` ('ip',
+# 'session' or 'user'), across all workers. Behind a proxy set
+# DJANGO_RATE_LIMIT_IP_META to the header holding the client address, e.g.
+# HTTP_X_FORWARDED_FOR.
+RATE_LIMITS = {
+    'add_to_cart': {'per_minute': 60, 'burst': 20, 'key': 'session'},
+    'update_cart': {'per_minute': 60, 'burst': 20, 'key': 'session'},
+    'submit_rating': {'per_minute': 2, 'burst': 3, 'key': 'user'},
+    'checkout': {'per_minute': 6, 'burst': 5, 'key': 'session'},
+}
+RATE_LIMIT_IP_META = os.environ.get('DJANGO_RATE_LIMIT_IP_META', 'REMOTE_ADDR')
+# Cache holding the buckets; it needs atomic add() and incr() and must be
+# shared by the workers (see CACHES above)
+RATE_LIMIT_CACHE = 'ratelimit'
+
+# Emails are sent by the background worker; the console backend just prints them
+EMAIL_BACKEND = os.environ.get('DJANGO_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = 'Khalifa Polish <no-reply@khalifapolish.com>'
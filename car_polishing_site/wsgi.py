@@ -2,6 +2,8 @@
 WSGI config for car_polishing_site project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Each worker warms up (templates, URLs, database) before serving; see
+bookings/warmup.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
@@ -11,6 +13,12 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from bookings import warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'car_polishing_site.settings')
+os.environ.setdefault('DJANGO_CACHED_TEMPLATES', '1')
 
 application = get_wsgi_application()
+
+# Warm this worker up before it takes traffic (bookings/warmup.py)
+warmup.run()